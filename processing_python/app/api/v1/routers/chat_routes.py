@@ -1,15 +1,29 @@
 # app/api/v1/routers/chat_routes.py
 from __future__ import annotations
 
-from typing import List, Optional, Literal
+import json
+from typing import Any, Dict, List, Optional, Literal
 from fastapi import APIRouter, Depends, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.core.deps import verify_internal_token
+from app.core.deps import (
+    get_answer_cache,
+    get_embed_batcher,
+    get_gemini,
+    get_history_cache,
+    get_lexical_index,
+    get_query_cache,
+    get_retrieval_cache,
+    get_vector_store,
+    verify_internal_token,
+)
 from app.core import config
 from app.services.llm.gemini_client import GeminiClient
 from app.services.vector.qdrant_store import QdrantStore
+from app.pipelines.history import HistoryCompressor
 from app.pipelines.rag import RAG
+from app.utils import logger
 
 
 router = APIRouter(
@@ -33,45 +47,136 @@ class AskIn(BaseModel):
     mode: Literal["auto", "doc", "general"] = "auto"
     history: Optional[List[HistoryItem]] = None
     min_score: Optional[float] = None  # override config.RAG_MIN_SCORE
+    no_cache: bool = False  # skip every cache (query embedding, retrieval, answer, history summary)
 
-@router.post("/ask")
-def ask(
-    body: AskIn,
-    x_user_id: str = Header(..., alias="X-User-Id"),
-):
-    gemini = GeminiClient(
-        api_key=config.GEMINI_API_KEY,
-        embed_model=config.GEMINI_EMBED_MODEL,
-        chat_model=config.GEMINI_CHAT_MODEL,
-        embed_dims=getattr(config, "GEMINI_EMBED_DIMS", None),
-        max_output_tokens=getattr(config, "GEMINI_MAX_OUTPUT_TOKENS", 1024),
-        temperature=getattr(config, "GEMINI_TEMPERATURE", 0.2),
-    )
+class AskStreamIn(AskIn):
+    format: Literal["sse", "ndjson"] = "sse"
 
-    store = QdrantStore(
-        url=config.QDRANT_URL,
-        api_key=config.QDRANT_API_KEY,
-        collection=config.QDRANT_COLLECTION,
-    )
 
-    rag = RAG(
+def _rag(
+    body: AskIn,
+    gemini,
+    store,
+    lexical,
+    query_cache,
+    retrieval_cache,
+    answer_cache,
+    history_cache,
+    embed_batcher,
+) -> RAG:
+    return RAG(
         gemini_client=gemini,
         qdrant_store=store,
         top_k=body.top_k or config.TOP_K,
         min_score=(body.min_score if body.min_score is not None else getattr(config, "RAG_MIN_SCORE", 0.2)),
         general_system_prompt=getattr(config, "GENERAL_CHAT_SYSTEM_PROMPT", "You are a helpful assistant."),
+        lexical_index=lexical,
+        lexical_fastpath=config.RAG_LEXICAL_FASTPATH,
+        fastpath_max_terms=config.RAG_LEXICAL_FASTPATH_MAX_TERMS,
+        fastpath_margin=config.RAG_LEXICAL_FASTPATH_MARGIN,
+        rrf_k=config.RAG_RRF_K,
+        query_cache=None if body.no_cache else query_cache,
+        retrieval_cache=None if body.no_cache else retrieval_cache,
+        answer_cache=None if body.no_cache else answer_cache,
+        context_tokens=config.RAG_CONTEXT_TOKENS,
+        chunk_overlap=config.CHUNK_OVERLAP,
+        mmr_lambda=config.RAG_MMR_LAMBDA,
+        candidates=config.RAG_CANDIDATES,
+        rerank_dense_weight=config.RAG_RERANK_DENSE_WEIGHT,
+        history_compressor=HistoryCompressor(
+            token_budget=config.HISTORY_TOKEN_BUDGET,
+            summary_tokens=config.HISTORY_SUMMARY_TOKENS,
+            step=config.HISTORY_SUMMARY_STEP,
+            summarize=gemini.agenerate_text,
+            cache=None if body.no_cache else history_cache,
+        ),
+        embed_batcher=embed_batcher,
     )
 
+
+def _history(body: AskIn) -> Optional[List[Dict[str, Any]]]:
     history = [m.model_dump() for m in (body.history or [])] or None
     # Normalize role "model" -> "assistant" so downstream formatting is correct.
     if history:
         for m in history:
             if (m.get("role") or "").lower() == "model":
                 m["role"] = "assistant"
-    return rag.ask(
+    return history
+
+
+@router.post("/ask")
+async def ask(
+    body: AskIn,
+    x_user_id: str = Header(..., alias="X-User-Id"),
+    gemini: GeminiClient = Depends(get_gemini),
+    store: QdrantStore = Depends(get_vector_store),
+    lexical=Depends(get_lexical_index),
+    query_cache=Depends(get_query_cache),
+    retrieval_cache=Depends(get_retrieval_cache),
+    answer_cache=Depends(get_answer_cache),
+    history_cache=Depends(get_history_cache),
+    embed_batcher=Depends(get_embed_batcher),
+):
+    rag = _rag(
+        body, gemini, store, lexical, query_cache, retrieval_cache, answer_cache, history_cache, embed_batcher
+    )
+    return await rag.ask(
         user_id=x_user_id,
         question=body.question,
         doc_ids=body.doc_ids,
         mode=body.mode,
-        history=history,
+        history=_history(body),
+    )
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _ndjson(event: Dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+@router.post("/ask_stream")
+async def ask_stream(
+    body: AskStreamIn,
+    x_user_id: str = Header(..., alias="X-User-Id"),
+    gemini: GeminiClient = Depends(get_gemini),
+    store: QdrantStore = Depends(get_vector_store),
+    lexical=Depends(get_lexical_index),
+    query_cache=Depends(get_query_cache),
+    retrieval_cache=Depends(get_retrieval_cache),
+    answer_cache=Depends(get_answer_cache),
+    history_cache=Depends(get_history_cache),
+    embed_batcher=Depends(get_embed_batcher),
+):
+    """
+    Streaming /ask: a "meta" event with citations, then "token" events, then "done".
+    SSE by default; body.format="ndjson" sends one JSON object per line instead.
+    """
+    rag = _rag(
+        body, gemini, store, lexical, query_cache, retrieval_cache, answer_cache, history_cache, embed_batcher
+    )
+    encode = _sse if body.format == "sse" else _ndjson
+
+    async def events():
+        try:
+            async for event in rag.ask_stream(
+                user_id=x_user_id,
+                question=body.question,
+                doc_ids=body.doc_ids,
+                mode=body.mode,
+                history=_history(body),
+            ):
+                yield encode(event)
+        except Exception as e:
+            # Headers are already sent; report the failure in-band.
+            logger.error("Chat stream failed", {"err": repr(e)})
+            yield encode({"type": "error", "message": "Answer generation failed"})
+
+    media_type = "text/event-stream" if body.format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        events(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
@@ -2,9 +2,15 @@ from __future__ import annotations
 
 from typing import List, Optional
 from fastapi import APIRouter, Depends, Header
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 
-from app.core.deps import verify_internal_token
+from app.core.deps import (
+    get_gemini,
+    get_lexical_index,
+    get_retrieval_cache,
+    get_vector_store,
+    verify_internal_token,
+)
 from app.core import config
 from app.services.llm.gemini_client import GeminiClient
 from app.services.vector.qdrant_store import QdrantStore
@@ -27,35 +33,46 @@ class UpsertOcrIn(BaseModel):
     title: Optional[str] = None
     replace: bool = True
     pages: List[PageIn]
+
+class UpsertOcrBulkIn(BaseModel):
+    documents: List[UpsertOcrIn] = Field(..., min_length=1)
+
+    @field_validator("documents")
+    @classmethod
+    def unique_doc_ids(cls, documents: List[UpsertOcrIn]) -> List[UpsertOcrIn]:
+        seen = set()
+        for d in documents:
+            if d.doc_id in seen:
+                raise ValueError(f"duplicate doc_id: {d.doc_id}")
+            seen.add(d.doc_id)
+        return documents
     
 class DeleteDocIn(BaseModel):
     doc_id: str
 
-@router.post("/upsert_ocr")
-def upsert_ocr(
-    body: UpsertOcrIn,
-    x_user_id: str = Header(..., alias="X-User-Id"),
-):
-    gemini = GeminiClient(
-        api_key=config.GEMINI_API_KEY,
-        chat_model=None,
-        embed_model=config.GEMINI_EMBED_MODEL,
-    )
-    store = QdrantStore(
-        url=config.QDRANT_URL,
-        api_key=config.QDRANT_API_KEY,
-        collection=config.QDRANT_COLLECTION,
-    )
-
-    indexer = Indexer(
+def _indexer(gemini: Optional[GeminiClient], store: QdrantStore, lexical, retrieval_cache) -> Indexer:
+    return Indexer(
         gemini_client=gemini,
         qdrant_store=store,
         chunk_size=config.CHUNK_SIZE,
         overlap=config.CHUNK_OVERLAP,
+        lexical_index=lexical,
+        retrieval_cache=retrieval_cache,
     )
 
+@router.post("/upsert_ocr")
+async def upsert_ocr(
+    body: UpsertOcrIn,
+    x_user_id: str = Header(..., alias="X-User-Id"),
+    gemini: GeminiClient = Depends(get_gemini),
+    store: QdrantStore = Depends(get_vector_store),
+    lexical=Depends(get_lexical_index),
+    retrieval_cache=Depends(get_retrieval_cache),
+):
+    indexer = _indexer(gemini, store, lexical, retrieval_cache)
+
     pages = [PageText(p.page_number, p.text) for p in body.pages]
-    return indexer.upsert_ocr(
+    return await indexer.upsert_ocr(
         user_id=x_user_id,
         doc_id=body.doc_id,
         title=body.title,
@@ -63,15 +80,41 @@ def upsert_ocr(
         replace=body.replace,
     )
 
+@router.post("/upsert_ocr_bulk")
+async def upsert_ocr_bulk(
+    body: UpsertOcrBulkIn,
+    x_user_id: str = Header(..., alias="X-User-Id"),
+    gemini: GeminiClient = Depends(get_gemini),
+    store: QdrantStore = Depends(get_vector_store),
+    lexical=Depends(get_lexical_index),
+    retrieval_cache=Depends(get_retrieval_cache),
+):
+    """
+    Backfill-friendly variant of /upsert_ocr: chunks from every document share
+    embedding batches. Returns one result per document ("indexed": false plus
+    "error" for documents whose write failed). doc_ids must be unique.
+    """
+    indexer = _indexer(gemini, store, lexical, retrieval_cache)
+
+    documents = [
+        {
+            "doc_id": d.doc_id,
+            "title": d.title,
+            "replace": d.replace,
+            "pages": [PageText(p.page_number, p.text) for p in d.pages],
+        }
+        for d in body.documents
+    ]
+    return await indexer.upsert_ocr_bulk(user_id=x_user_id, documents=documents)
+
 @router.post("/delete_doc")
-def delete_doc(
+async def delete_doc(
     body: DeleteDocIn,
     x_user_id: str = Header(..., alias="X-User-Id"),
+    store: QdrantStore = Depends(get_vector_store),
+    lexical=Depends(get_lexical_index),
+    retrieval_cache=Depends(get_retrieval_cache),
 ):
-    store = QdrantStore(
-        url=config.QDRANT_URL,
-        api_key=config.QDRANT_API_KEY,
-        collection=config.QDRANT_COLLECTION,
-    )
-    store.delete_doc(user_id=x_user_id, doc_id=body.doc_id)
+    # No embeddings needed to delete
+    await _indexer(None, store, lexical, retrieval_cache).delete_doc(user_id=x_user_id, doc_id=body.doc_id)
     return {"deleted": True, "doc_id": body.doc_id}
\ No newline at end of file
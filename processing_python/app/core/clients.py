@@ -0,0 +1,176 @@
+# app/core/clients.py
+"""
+Process-wide Gemini/Qdrant clients.
+
+Built once in the FastAPI lifespan (see app.main) and shared by every request,
+so connection pools and TLS sessions are reused instead of rebuilt per call.
+"""
+from __future__ import annotations
+
+import httpx
+from google.genai import types
+
+from app.core import config
+from app.core.resilience import CallPolicy, CircuitBreaker
+from app.pipelines.cache import AnswerCache, QueryEmbeddingCache, RetrievalCache
+from app.pipelines.history import HistorySummaryCache
+from app.services.lexical.fts_store import FtsStore
+from app.services.llm.embed_batcher import EmbeddingBatcher
+from app.services.llm.fake_backend import FakeGenAIClient
+from app.services.llm.gemini_client import GeminiClient
+from app.services.vector.hot_cache import HotDocCache
+from app.services.vector.local_store import LocalVectorStore
+from app.services.vector.qdrant_store import QdrantStore
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _policy(name: str):
+    if not config.RESILIENCE_ENABLED:
+        return None
+    breaker = CircuitBreaker(name, failure_threshold=config.BREAKER_FAILURES, reset_timeout=config.BREAKER_RESET_S)
+    return CallPolicy(name, breaker=breaker, margin_ms=config.DEADLINE_MARGIN_MS)
+
+
+def _seconds(ms: float):
+    return ms / 1000.0 if ms > 0 else None
+
+
+def _gemini_resilience():
+    return dict(
+        policy=_policy("gemini"),
+        embed_timeout=_seconds(config.GEMINI_EMBED_TIMEOUT_MS),
+        generate_timeout=_seconds(config.GEMINI_GENERATE_TIMEOUT_MS),
+        stream_idle_timeout=_seconds(config.GEMINI_STREAM_IDLE_TIMEOUT_MS),
+        embed_hedge_after=_seconds(config.GEMINI_EMBED_HEDGE_MS),
+    )
+
+
+def build_gemini_client() -> GeminiClient:
+    if config.LLM_BACKEND == "fake":
+        return GeminiClient(
+            api_key="",
+            embed_model="fake-embedding",
+            chat_model="fake-chat",
+            embed_dims=getattr(config, "GEMINI_EMBED_DIMS", None),
+            max_output_tokens=getattr(config, "GEMINI_MAX_OUTPUT_TOKENS", 1024),
+            temperature=getattr(config, "GEMINI_TEMPERATURE", 0.2),
+            embed_concurrency=config.GEMINI_EMBED_CONCURRENCY,
+            backend=FakeGenAIClient(
+                dims=config.FAKE_EMBED_DIMS,
+                embed_latency_ms=config.FAKE_EMBED_LATENCY_MS,
+                generate_latency_ms=config.FAKE_GENERATE_LATENCY_MS,
+                first_token_latency_ms=config.FAKE_FIRST_TOKEN_LATENCY_MS,
+                token_latency_ms=config.FAKE_TOKEN_LATENCY_MS,
+            ),
+            **_gemini_resilience(),
+        )
+    if config.LLM_BACKEND != "gemini":
+        raise ValueError(f"Unknown LLM_BACKEND: {config.LLM_BACKEND!r}")
+    return GeminiClient(
+        api_key=config.GEMINI_API_KEY,
+        embed_model=config.GEMINI_EMBED_MODEL,
+        chat_model=config.GEMINI_CHAT_MODEL,
+        embed_dims=getattr(config, "GEMINI_EMBED_DIMS", None),
+        max_output_tokens=getattr(config, "GEMINI_MAX_OUTPUT_TOKENS", 1024),
+        temperature=getattr(config, "GEMINI_TEMPERATURE", 0.2),
+        embed_concurrency=config.GEMINI_EMBED_CONCURRENCY,
+        http_options=types.HttpOptions(
+            client_args={"limits": _limits()},
+            async_client_args={"limits": _limits()},
+        ),
+        **_gemini_resilience(),
+    )
+
+
+def build_qdrant_store() -> QdrantStore:
+    return QdrantStore(
+        url=config.QDRANT_URL,
+        api_key=config.QDRANT_API_KEY,
+        collection=config.QDRANT_COLLECTION,
+        upsert_batch_size=config.QDRANT_UPSERT_BATCH_SIZE,
+        upsert_parallel=config.QDRANT_UPSERT_PARALLEL,
+        upsert_wait=config.QDRANT_UPSERT_WAIT,
+        upsert_barrier=config.QDRANT_UPSERT_BARRIER,
+        quantization=config.QDRANT_QUANTIZATION,
+        on_disk=config.QDRANT_ON_DISK,
+        rescore=config.QDRANT_RESCORE,
+        oversampling=config.QDRANT_OVERSAMPLING,
+        prefer_grpc=config.QDRANT_PREFER_GRPC,
+        grpc_port=config.QDRANT_GRPC_PORT,
+        limits=_limits(),
+        tenant_layout=config.QDRANT_TENANT_LAYOUT,
+        hnsw_payload_m=config.QDRANT_HNSW_PAYLOAD_M,
+        tenant_shard_users=config.QDRANT_TENANT_SHARD_USERS,
+        policy=_policy("qdrant"),
+        timeout=_seconds(config.QDRANT_TIMEOUT_MS),
+        search_hedge_after=_seconds(config.QDRANT_SEARCH_HEDGE_MS),
+        hot_cache=build_hot_doc_cache(),
+        hot_doc_max_points=config.HOT_DOC_MAX_POINTS,
+    )
+
+
+def build_hot_doc_cache():
+    if config.HOT_DOC_CACHE_MB <= 0:
+        return None
+    return HotDocCache(
+        max_bytes=int(config.HOT_DOC_CACHE_MB * 1024 * 1024),
+        ttl=config.HOT_DOC_CACHE_TTL,
+        max_docs_per_query=config.HOT_DOC_MAX_DOCS,
+    )
+
+
+def build_vector_store():
+    """QdrantStore or LocalVectorStore, depending on VECTOR_BACKEND."""
+    if config.VECTOR_BACKEND == "local":
+        return LocalVectorStore(
+            path=config.LOCAL_VECTOR_DIR,
+            ann_threshold=config.LOCAL_VECTOR_ANN_THRESHOLD,
+            nprobe=config.LOCAL_VECTOR_NPROBE,
+            ivf_rebuild_drift=config.LOCAL_VECTOR_IVF_REBUILD_DRIFT,
+        )
+    if config.VECTOR_BACKEND != "qdrant":
+        raise ValueError(f"Unknown VECTOR_BACKEND: {config.VECTOR_BACKEND!r}")
+    return build_qdrant_store()
+
+
+def build_lexical_index():
+    if not config.LEXICAL_INDEX_ENABLED:
+        return None
+    return FtsStore(path=config.LEXICAL_DB_PATH)
+
+
+def build_query_cache() -> QueryEmbeddingCache:
+    return QueryEmbeddingCache(maxsize=config.QUERY_EMBED_CACHE_SIZE, ttl=config.QUERY_EMBED_CACHE_TTL)
+
+
+def build_retrieval_cache() -> RetrievalCache:
+    return RetrievalCache(maxsize=config.RETRIEVAL_CACHE_SIZE, ttl=config.RETRIEVAL_CACHE_TTL)
+
+
+def build_answer_cache():
+    if not config.ANSWER_CACHE_ENABLED:
+        return None
+    return AnswerCache(maxsize=config.ANSWER_CACHE_SIZE, ttl=config.ANSWER_CACHE_TTL)
+
+
+def build_history_cache():
+    if not config.HISTORY_SUMMARY_ENABLED:
+        return None
+    return HistorySummaryCache(maxsize=config.HISTORY_SUMMARY_CACHE_SIZE, ttl=config.HISTORY_SUMMARY_CACHE_TTL)
+
+
+def build_embed_batcher(gemini: GeminiClient):
+    if gemini is None or not config.EMBED_BATCH_ENABLED:
+        return None
+    return EmbeddingBatcher(
+        embed_many=gemini.aembed_documents,
+        max_batch=config.EMBED_BATCH_MAX_SIZE,
+        max_wait_ms=config.EMBED_BATCH_MAX_WAIT_MS,
+    )
@@ -1,4 +1,6 @@
 import os
+from typing import List, Optional
+
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -38,16 +40,137 @@ GENERAL_CHAT_SYSTEM_PROMPT: str = os.getenv(
 GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
 GEMINI_CHAT_MODEL: str = os.getenv("GEMINI_CHAT_MODEL", "gemini-2.5-flash")
 GEMINI_EMBED_MODEL: str = os.getenv("GEMINI_EMBED_MODEL","")
+# Optional output dimensionality; when set, the Qdrant collection is bootstrapped at startup
+_embed_dims = os.getenv("GEMINI_EMBED_DIMS")
+GEMINI_EMBED_DIMS: Optional[int] = int(_embed_dims) if _embed_dims else None
+# Embedding batches (100 texts each) in flight at once, across all requests of this process
+GEMINI_EMBED_CONCURRENCY: int = int(os.getenv("GEMINI_EMBED_CONCURRENCY", "4"))
 
 # Gemini output controls (increase to avoid truncated answers)
 GEMINI_MAX_OUTPUT_TOKENS: int = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "1024"))
 GEMINI_TEMPERATURE: float = float(os.getenv("GEMINI_TEMPERATURE", "0.2"))
 
+# "gemini" or "fake" (offline, deterministic; for load tests and local runs)
+LLM_BACKEND: str = os.getenv("LLM_BACKEND", "gemini").lower().strip()
+FAKE_EMBED_DIMS: int = int(os.getenv("FAKE_EMBED_DIMS", "768"))
+FAKE_EMBED_LATENCY_MS: float = float(os.getenv("FAKE_EMBED_LATENCY_MS", "40"))
+FAKE_GENERATE_LATENCY_MS: float = float(os.getenv("FAKE_GENERATE_LATENCY_MS", "800"))
+FAKE_FIRST_TOKEN_LATENCY_MS: float = float(os.getenv("FAKE_FIRST_TOKEN_LATENCY_MS", "250"))
+FAKE_TOKEN_LATENCY_MS: float = float(os.getenv("FAKE_TOKEN_LATENCY_MS", "20"))
+
+# Vector store backend: "qdrant" (remote server) | "local" (in-process, files on disk)
+VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "qdrant").lower().strip()
+# May be shared by the workers and scripts of one host (writes are flock()ed);
+# not by several hosts, and not on a network filesystem.
+LOCAL_VECTOR_DIR: str = os.getenv("LOCAL_VECTOR_DIR", "./vector_data")
+# Per-user row count above which the local store switches from exact to IVF search
+LOCAL_VECTOR_ANN_THRESHOLD: int = int(os.getenv("LOCAL_VECTOR_ANN_THRESHOLD", "20000"))
+LOCAL_VECTOR_NPROBE: int = int(os.getenv("LOCAL_VECTOR_NPROBE", "8"))
+# Retrain IVF centroids (in the background) once this share of a user's rows changed
+LOCAL_VECTOR_IVF_REBUILD_DRIFT: float = float(os.getenv("LOCAL_VECTOR_IVF_REBUILD_DRIFT", "0.2"))
+
 # Qdrant
 QDRANT_URL: str = os.getenv("QDRANT_URL", "")
 QDRANT_API_KEY: str = os.getenv("QDRANT_API_KEY", "")  # optional
 QDRANT_COLLECTION: str = os.getenv("QDRANT_COLLECTION", "doc_chunks")
 
+# Multi-tenant layout for new collections: user_id is the tenant key and HNSW is
+# built per tenant. Run scripts/migrate_qdrant_tenancy.py for existing collections.
+QDRANT_TENANT_LAYOUT: bool = os.getenv("QDRANT_TENANT_LAYOUT", "true").lower() in ("1", "true", "yes")
+QDRANT_HNSW_PAYLOAD_M: int = int(os.getenv("QDRANT_HNSW_PAYLOAD_M", "16"))
+# Comma-separated user ids of large tenants that get a dedicated shard key.
+# Non-empty => custom sharding (collection must be created/migrated that way).
+QDRANT_TENANT_SHARD_USERS: List[str] = [
+    u.strip() for u in os.getenv("QDRANT_TENANT_SHARD_USERS", "").split(",") if u.strip()
+]
+
+# Transport: gRPC is usually faster for upserts/search; REST stays the default
+QDRANT_PREFER_GRPC: bool = os.getenv("QDRANT_PREFER_GRPC", "false").lower() in ("1", "true", "yes")
+QDRANT_GRPC_PORT: int = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+
+# Keep-alive pools for the process-wide Gemini/Qdrant clients (created once at startup)
+HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Qdrant uploads: points per request, concurrent requests, and whether each batch
+# waits for indexing. Set QDRANT_UPSERT_WAIT=false to opt out; then only the last
+# batch per shard key waits (QDRANT_UPSERT_BARRIER) as a consistency barrier.
+QDRANT_UPSERT_BATCH_SIZE: int = int(os.getenv("QDRANT_UPSERT_BATCH_SIZE", "128"))
+QDRANT_UPSERT_PARALLEL: int = int(os.getenv("QDRANT_UPSERT_PARALLEL", "4"))
+QDRANT_UPSERT_WAIT: bool = os.getenv("QDRANT_UPSERT_WAIT", "true").lower() in ("1", "true", "yes")
+QDRANT_UPSERT_BARRIER: bool = os.getenv("QDRANT_UPSERT_BARRIER", "true").lower() in ("1", "true", "yes")
+
+# Qdrant storage for new collections: "none" | "scalar" (int8) | "binary".
+# With quantisation, originals can live on disk and are only read to rescore candidates.
+QDRANT_QUANTIZATION: str = os.getenv("QDRANT_QUANTIZATION", "none")
+QDRANT_ON_DISK: bool = os.getenv("QDRANT_ON_DISK", "false").lower() in ("1", "true", "yes")
+QDRANT_RESCORE: bool = os.getenv("QDRANT_RESCORE", "true").lower() in ("1", "true", "yes")
+_oversampling = os.getenv("QDRANT_OVERSAMPLING")
+QDRANT_OVERSAMPLING: Optional[float] = float(_oversampling) if _oversampling else None
+
+# Keyword (BM25) index kept next to the vector store, used for hybrid retrieval.
+# A local SQLite file: run a single replica (or disable it when scaling out), and
+# fill it for documents indexed earlier with scripts/backfill_lexical_index.py.
+LEXICAL_INDEX_ENABLED: bool = os.getenv("LEXICAL_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+LEXICAL_DB_PATH: str = os.getenv("LEXICAL_DB_PATH", "./lexical_index.sqlite")
+# Skip the query embedding when short keyword queries have a clear lexical winner
+RAG_LEXICAL_FASTPATH: bool = os.getenv("RAG_LEXICAL_FASTPATH", "true").lower() in ("1", "true", "yes")
+RAG_LEXICAL_FASTPATH_MAX_TERMS: int = int(os.getenv("RAG_LEXICAL_FASTPATH_MAX_TERMS", "4"))
+RAG_LEXICAL_FASTPATH_MARGIN: float = float(os.getenv("RAG_LEXICAL_FASTPATH_MARGIN", "1.5"))
+RAG_RRF_K: int = int(os.getenv("RAG_RRF_K", "60"))
+# Doc-mode prompt: passages are packed into this many (estimated) tokens.
+RAG_CONTEXT_TOKENS: int = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+# MMR trade-off in [0, 1] (1 = pure relevance); unset disables MMR.
+_mmr_lambda = os.getenv("RAG_MMR_LAMBDA")
+RAG_MMR_LAMBDA: Optional[float] = float(_mmr_lambda) if _mmr_lambda else None
+# Over-fetch this many candidates and rerank them locally down to TOP_K (<= TOP_K disables).
+RAG_CANDIDATES: int = int(os.getenv("RAG_CANDIDATES", "50"))
+RAG_RERANK_DENSE_WEIGHT: float = float(os.getenv("RAG_RERANK_DENSE_WEIGHT", "0.7"))
+
+# General-mode history: recent turns within a token budget, older turns summarised.
+HISTORY_TOKEN_BUDGET: int = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_SUMMARY_ENABLED: bool = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+HISTORY_SUMMARY_TOKENS: int = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+HISTORY_SUMMARY_STEP: int = int(os.getenv("HISTORY_SUMMARY_STEP", "6"))  # turns per re-summary
+HISTORY_SUMMARY_CACHE_SIZE: int = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024"))
+HISTORY_SUMMARY_CACHE_TTL: float = float(os.getenv("HISTORY_SUMMARY_CACHE_TTL", "86400"))
+
+# Concurrent query embeddings are sent as one batch (wait at most this long).
+EMBED_BATCH_ENABLED: bool = os.getenv("EMBED_BATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBED_BATCH_MAX_SIZE: int = int(os.getenv("EMBED_BATCH_MAX_SIZE", "100"))
+EMBED_BATCH_MAX_WAIT_MS: float = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+# Resilience: request deadline (X-Request-Timeout-Ms may shorten it; 0 = none),
+# per-call timeouts, hedging of idempotent calls (0 disables) and breakers.
+RESILIENCE_ENABLED: bool = os.getenv("RESILIENCE_ENABLED", "true").lower() in ("1", "true", "yes")
+REQUEST_BUDGET_MS: float = float(os.getenv("REQUEST_BUDGET_MS", "30000"))
+DEADLINE_MARGIN_MS: float = float(os.getenv("DEADLINE_MARGIN_MS", "50"))
+GEMINI_EMBED_TIMEOUT_MS: float = float(os.getenv("GEMINI_EMBED_TIMEOUT_MS", "5000"))
+GEMINI_GENERATE_TIMEOUT_MS: float = float(os.getenv("GEMINI_GENERATE_TIMEOUT_MS", "25000"))
+GEMINI_STREAM_IDLE_TIMEOUT_MS: float = float(os.getenv("GEMINI_STREAM_IDLE_TIMEOUT_MS", "10000"))
+GEMINI_EMBED_HEDGE_MS: float = float(os.getenv("GEMINI_EMBED_HEDGE_MS", "400"))
+QDRANT_TIMEOUT_MS: float = float(os.getenv("QDRANT_TIMEOUT_MS", "3000"))
+QDRANT_SEARCH_HEDGE_MS: float = float(os.getenv("QDRANT_SEARCH_HEDGE_MS", "200"))
+BREAKER_FAILURES: int = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S: float = float(os.getenv("BREAKER_RESET_S", "30"))
+
+# Scoped chats: pin the vectors of recently used (user, doc) pairs in memory
+# (Qdrant backend; 0 MB disables). TTL bounds staleness from other workers' writes.
+HOT_DOC_CACHE_MB: float = float(os.getenv("HOT_DOC_CACHE_MB", "256"))
+HOT_DOC_CACHE_TTL: float = float(os.getenv("HOT_DOC_CACHE_TTL", "300"))
+HOT_DOC_MAX_DOCS: int = int(os.getenv("HOT_DOC_MAX_DOCS", "16"))      # per query
+HOT_DOC_MAX_POINTS: int = int(os.getenv("HOT_DOC_MAX_POINTS", "20000"))  # per document
+
+# Per-process chat caches (size 0 or TTL 0 disables)
+QUERY_EMBED_CACHE_SIZE: int = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096"))
+QUERY_EMBED_CACHE_TTL: float = float(os.getenv("QUERY_EMBED_CACHE_TTL", "3600"))
+RETRIEVAL_CACHE_SIZE: int = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_TTL: float = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL", "1800"))
+
 # RAG knobs
 TOP_K: int = int(os.getenv("TOP_K", "8"))
 CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "1200"))       # chars (simple MVP)
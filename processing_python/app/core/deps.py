@@ -1,4 +1,4 @@
-from fastapi import Header, HTTPException, status
+from fastapi import Header, HTTPException, Request, status
 from .config import INTERNAL_TOKEN
 
 async def verify_internal_token(
@@ -7,4 +7,41 @@ async def verify_internal_token(
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid internal token",
-        )
\ No newline at end of file
+        )
+
+def get_gemini(request: Request):
+    gemini = getattr(request.app.state, "gemini", None)
+    if gemini is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Gemini client is not configured",
+        )
+    return gemini
+
+def get_vector_store(request: Request):
+    store = getattr(request.app.state, "store", None)
+    if store is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Vector store is not configured",
+        )
+    return store
+
+def get_lexical_index(request: Request):
+    # Optional: hybrid retrieval falls back to dense-only without it
+    return getattr(request.app.state, "lexical", None)
+
+def get_query_cache(request: Request):
+    return getattr(request.app.state, "query_cache", None)
+
+def get_retrieval_cache(request: Request):
+    return getattr(request.app.state, "retrieval_cache", None)
+
+def get_answer_cache(request: Request):
+    return getattr(request.app.state, "answer_cache", None)
+
+def get_history_cache(request: Request):
+    return getattr(request.app.state, "history_cache", None)
+
+def get_embed_batcher(request: Request):
+    return getattr(request.app.state, "embed_batcher", None)
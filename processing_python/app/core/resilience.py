@@ -0,0 +1,301 @@
+# app/core/resilience.py
+"""
+Deadlines, hedging and circuit breaking for calls to Gemini and Qdrant.
+
+- Every request gets a deadline (X-Request-Timeout-Ms header or
+  REQUEST_BUDGET_MS); each outbound call is bounded by its own timeout and by
+  what is left of that deadline.
+- Idempotent calls can be hedged: if the first attempt is still running after
+  `hedge_after`, a second one is started and the first to succeed wins.
+- A breaker per upstream opens after consecutive failures, fails fast while
+  open, and lets a single probe through (half-open) after `reset_timeout`.
+- Counters record timeouts, hedges, breaker rejections and degraded paths.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from contextvars import Context, ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class UpstreamUnavailable(RuntimeError):
+    """An upstream could not be used for this request (answered as 503)."""
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+# -----------------------------
+# Counters
+# -----------------------------
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, int] = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + n
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(sorted(self._values.items()))
+
+
+counters = Counters()
+
+
+# -----------------------------
+# Request deadline
+# -----------------------------
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None outside a request."""
+    d = _deadline.get()
+    return None if d is None else d - time.monotonic()
+
+
+def current_deadline() -> Optional[float]:
+    """The current request's deadline (time.monotonic() clock), or None."""
+    return _deadline.get()
+
+
+def deadline_context(deadline: Optional[float]) -> Context:
+    """
+    A fresh context carrying nothing but `deadline`: for work shared by several
+    requests, which must not run under (or be cut short by) any one of them.
+    """
+    ctx = Context()
+    if deadline is not None:
+        ctx.run(_deadline.set, deadline)
+    return ctx
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware: start the request's deadline clock. Paths under
+    `no_default_prefixes` (long-running indexing) only get a deadline when the
+    caller sends one.
+    """
+
+    def __init__(
+        self,
+        app,
+        default_budget_ms: float,
+        header: str = "x-request-timeout-ms",
+        no_default_prefixes: Tuple[str, ...] = (),
+    ):
+        self.app = app
+        self.default_budget = float(default_budget_ms) / 1000.0 if default_budget_ms else None
+        self.header = header.encode("latin-1")
+        self.no_default_prefixes = tuple(no_default_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        budget = self.default_budget
+        if scope.get("path", "").startswith(self.no_default_prefixes):
+            budget = None
+        for k, v in scope.get("headers") or []:
+            if k == self.header:
+                try:
+                    asked = float(v) / 1000.0
+                    budget = asked if budget is None else min(budget, asked)
+                except ValueError:
+                    pass
+                break
+
+        if budget is None:
+            return await self.app(scope, receive, send)
+
+        token = _deadline.set(time.monotonic() + budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+# -----------------------------
+# Circuit breaker
+# -----------------------------
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # Half-open: exactly one probe at a time.
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                counters.incr(f"{self.name}.breaker_closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """The call ended without a verdict on the upstream (e.g. cancelled)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "failures": self._failures}
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    counters.incr(f"{self.name}.breaker_opened")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+# -----------------------------
+# Call policy
+# -----------------------------
+
+class CallPolicy:
+    """Per-upstream settings; `call` runs one operation under them."""
+
+    def __init__(
+        self,
+        name: str,
+        breaker: Optional[CircuitBreaker] = None,
+        margin_ms: float = 50.0,
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.margin = float(margin_ms) / 1000.0
+
+    def _budget(self, timeout: Optional[float], op: str) -> Optional[float]:
+        left = remaining()
+        if left is not None:
+            left -= self.margin
+            if left <= 0:
+                counters.incr(f"{self.name}.{op}.deadline_exceeded")
+                raise DeadlineExceeded(f"{self.name}.{op}: request deadline exceeded")
+            return left if timeout is None else min(timeout, left)
+        return timeout
+
+    async def call(
+        self,
+        op: str,
+        fn: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+        answered: Optional[Callable[[Exception], bool]] = None,
+    ) -> Any:
+        """
+        Run fn() within min(timeout, remaining request budget). With hedge_after,
+        fn must be idempotent: a second attempt starts if the first is slow.
+        Errors for which answered(e) is true (e.g. a 404) are passed through
+        without counting against the breaker.
+        """
+        budget = self._budget(timeout, op)
+
+        if self.breaker is not None and not self.breaker.allow():
+            counters.incr(f"{self.name}.{op}.breaker_rejected")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        counters.incr(f"{self.name}.{op}.calls")
+        try:
+            if hedge_after and (budget is None or hedge_after < budget):
+                result = await asyncio.wait_for(self._hedged(op, fn, hedge_after), budget)
+            else:
+                result = await asyncio.wait_for(fn(), budget)
+        except asyncio.TimeoutError as e:
+            counters.incr(f"{self.name}.{op}.timeouts")
+            # Only the upstream's own timeout counts against it, not a short caller budget.
+            if self.breaker is not None:
+                if timeout is not None and budget is not None and budget >= timeout:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+            raise DeadlineExceeded(f"{self.name}.{op} timed out") from e
+        except asyncio.CancelledError:
+            if self.breaker is not None:
+                self.breaker.release()
+            raise
+        except Exception as e:
+            if answered is not None and answered(e):
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                raise
+            counters.incr(f"{self.name}.{op}.failures")
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return result
+
+    async def _hedged(self, op: str, fn: Callable[[], Awaitable[Any]], hedge_after: float) -> Any:
+        first = asyncio.ensure_future(fn())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait({first}, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            counters.incr(f"{self.name}.{op}.hedged")
+            second = asyncio.ensure_future(fn())
+            tasks.append(second)
+            pending = {first, second}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is second:
+                            counters.incr(f"{self.name}.{op}.hedge_won")
+                        return t.result()
+                    error = t.exception()
+            raise error
+        finally:
+            # Losers (or everything, if we were cancelled) are not left running.
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
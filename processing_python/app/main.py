@@ -1,20 +1,110 @@
-from fastapi import FastAPI, Depends, Header, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, status
+from fastapi.responses import JSONResponse
 from .api.v1.routers.router import router as v1_router
-from .core.config import PYTHON_SERVICE_PORT, ENV
+from .core.clients import (
+    build_answer_cache,
+    build_embed_batcher,
+    build_gemini_client,
+    build_history_cache,
+    build_lexical_index,
+    build_query_cache,
+    build_retrieval_cache,
+    build_vector_store,
+)
+from .core.config import PYTHON_SERVICE_PORT, ENV, GEMINI_EMBED_DIMS, REQUEST_BUDGET_MS, VECTOR_BACKEND
 from .core.deps import verify_internal_token
+from .core.resilience import DeadlineMiddleware, UpstreamUnavailable, counters
 from .utils import logger
 
 import os
 import platform
 import shutil
 import subprocess
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any
 
+
+# -----------------------------
+# Shared clients (one per process)
+# -----------------------------
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A missing key/URL must not take down OCR & friends: the RAG routes
+    # answer 503 via the deps when their client is unavailable.
+    try:
+        app.state.gemini = build_gemini_client()
+    except Exception as e:
+        app.state.gemini = None
+        logger.error("Gemini client not created", {"err": repr(e)})
+
+    try:
+        app.state.store = build_vector_store()
+    except Exception as e:
+        app.state.store = None
+        logger.error("Vector store not created", {"err": repr(e)})
+
+    try:
+        app.state.lexical = build_lexical_index()
+    except Exception as e:
+        app.state.lexical = None
+        logger.error("Lexical index not created", {"err": repr(e)})
+
+    app.state.embed_batcher = build_embed_batcher(app.state.gemini)
+    app.state.query_cache = build_query_cache()
+    app.state.retrieval_cache = build_retrieval_cache()
+    app.state.answer_cache = build_answer_cache()
+    app.state.history_cache = build_history_cache()
+
+    # Collection + payload indexes are checked once here instead of on every
+    # upsert/search. If Qdrant is unreachable now, the first call retries lazily.
+    if app.state.store is not None:
+        try:
+            ready = app.state.store.bootstrap(vector_size=GEMINI_EMBED_DIMS)
+            logger.info("Vector store bootstrap", {"backend": VECTOR_BACKEND, "ready": ready})
+        except Exception as e:
+            logger.error("Vector store bootstrap failed", {"err": repr(e)})
+
+    try:
+        yield
+    finally:
+        for name in ("embed_batcher", "gemini", "store", "lexical"):
+            client = getattr(app.state, name, None)
+            if client is None:
+                continue
+            try:
+                if hasattr(client, "aclose"):
+                    await client.aclose()
+                if hasattr(client, "close"):
+                    client.close()
+            except Exception as e:
+                logger.error(f"Failed to close {name} client", {"err": repr(e)})
+
+
 app = FastAPI(
     title="Document Processing Service",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+)
+
+# Chat requests get REQUEST_BUDGET_MS end to end; indexing only when the caller asks.
+app.add_middleware(
+    DeadlineMiddleware,
+    default_budget_ms=REQUEST_BUDGET_MS,
+    no_default_prefixes=("/internal/index",),
 )
 
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    # Timeouts and open breakers fail fast as 503 instead of a generic 500.
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "5"},
+    )
+
+
 # Routers
 app.include_router(v1_router)
 
@@ -163,6 +253,17 @@ def health_tesseract():
     return status
 
 
+@app.get("/health/resilience", dependencies=[Depends(_debug_guard)])
+def health_resilience():
+    """Breaker states and counters (timeouts, hedges, lexical fallbacks, ...)."""
+    breakers = {}
+    for name in ("gemini", "store"):
+        policy = getattr(getattr(app.state, name, None), "policy", None)
+        if policy is not None and policy.breaker is not None:
+            breakers[policy.name] = policy.breaker.snapshot()
+    return {"breakers": breakers, "counters": counters.snapshot()}
+
+
 # Optional: expose what command your OCR router should use
 # so you can import it there: from .main import TESSERACT_CMD
 # (If circular imports happen, move this into a shared config module.)
@@ -0,0 +1,186 @@
+# app/pipelines/cache.py
+"""
+Per-process caches for the chat path.
+
+- QueryEmbeddingCache: question text -> query vector (skips the embedding call)
+- RetrievalCache:      (user, doc_ids, question, top_k, min_score) -> hits,
+                       invalidated when that user's documents are (re)indexed or deleted
+- AnswerCache:         (prompt version, model, temperature, user, question, retrieved chunks)
+                       -> generated answer; chunk ids and content hashes are part of the
+                       key, so a re-indexed document can never serve a stale answer
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def question_hash(text: str) -> str:
+    return hashlib.sha1(normalize_question(text).encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """Bounded LRU map whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class QueryEmbeddingCache:
+    def __init__(self, maxsize: int = 2048, ttl: float = 3600.0):
+        self._cache = TTLCache(maxsize, ttl)
+
+    def get(self, question: str):
+        return self._cache.get(normalize_question(question))
+
+    def set(self, question: str, vector) -> None:
+        self._cache.set(normalize_question(question), vector)
+
+
+class RetrievalCache:
+    def __init__(self, maxsize: int = 2048, ttl: float = 300.0):
+        self._cache = TTLCache(maxsize, ttl)
+        # Bumped on every invalidation; a result computed under an older
+        # generation is not stored (avoids caching across a concurrent re-index).
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        user_id: str,
+        doc_ids: Optional[Iterable[str]],
+        question: str,
+        top_k: int,
+        min_score: float,
+    ) -> Tuple[Any, ...]:
+        docs = tuple(sorted(set(doc_ids))) if doc_ids else None
+        return (user_id, docs, question_hash(question), int(top_k), float(min_score))
+
+    def generation(self, user_id: str) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get(self, key: Tuple[Any, ...]):
+        return self._cache.get(key)
+
+    def set(self, key: Tuple[Any, ...], value: Any, generation: int) -> None:
+        with self._lock:
+            if self._generations.get(key[0], 0) != generation:
+                return
+            self._cache.set(key, value)
+
+    def invalidate(self, user_id: str, doc_ids: Optional[Iterable[str]] = None) -> None:
+        """
+        Drop cached results for `user_id` that can see any of `doc_ids`:
+        unscoped entries (all documents) and entries scoped to an overlapping set.
+        """
+        touched = set(doc_ids or [])
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for k in self._cache.keys():
+                if k[0] != user_id:
+                    continue
+                if not touched or k[1] is None or touched.intersection(k[1]):
+                    self._cache.pop(k)
+
+
+def chunk_version(payload: Dict[str, Any]) -> str:
+    return hashlib.sha1((payload.get("text") or "").encode("utf-8")).hexdigest()[:16]
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 1800.0):
+        self._cache = TTLCache(maxsize, ttl)
+
+    @property
+    def enabled(self) -> bool:
+        return self._cache.enabled
+
+    @staticmethod
+    def key(
+        prompt_version: str,
+        model: Optional[str],
+        temperature: Optional[float],
+        user_id: str,
+        question: str,
+        hits: Iterable[Any],
+    ) -> str:
+        # Answers are never shared across users, even when the prompt is the same.
+        # Order matters: the same chunks in a different order make a different prompt.
+        chunks: List[str] = []
+        for h in hits:
+            p = getattr(h, "payload", {}) or {}
+            chunks.append(f"{getattr(h, 'id', '')}:{chunk_version(p)}")
+        raw = "\x1f".join(
+            [
+                prompt_version,
+                model or "",
+                repr(temperature),
+                user_id,
+                normalize_question(question),
+                *chunks,
+            ]
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    def set(self, key: str, answer: str) -> None:
+        if answer:
+            self._cache.set(key, answer)
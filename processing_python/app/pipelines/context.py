@@ -0,0 +1,175 @@
+# app/pipelines/context.py
+"""
+Context packing for the doc-mode prompt.
+
+Retrieved chunks are merged back into contiguous passages (neighbouring chunks
+of a page share `CHUNK_OVERLAP` characters, which would otherwise be sent
+twice), duplicates are dropped, and passages are added best-first until the
+token budget is used up. Optionally the order is diversified with MMR.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.services.lexical.fts_store import tokenize
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for Latin-script text; no tokenizer round trip.
+    return (len(text or "") + 3) // 4
+
+
+def merge_overlap(a: str, b: str, max_overlap: int) -> Optional[str]:
+    """
+    Join b onto a if b starts with a suffix of a (chunk overlap).
+    Returns None when the two texts do not overlap.
+    """
+    if not a or not b:
+        return None
+    if b in a:
+        return a
+    # chunk_pages strips each piece, so the shared span can be a few chars off.
+    window = min(len(a), len(b), max_overlap + 16)
+    for k in range(window, 0, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return None
+
+
+@dataclass
+class Passage:
+    doc_id: Any
+    title: str
+    page: Any
+    text: str
+    score: float
+    hits: List[Any] = field(default_factory=list)
+
+    def render(self) -> str:
+        # Make context source human-readable (helps the model cite properly)
+        return f"SOURCE: {self.title} (page {self.page})\n{self.text}"
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.render()) + 2  # + separator between passages
+
+
+def _hit_fields(h) -> Tuple[Dict[str, Any], str]:
+    p = getattr(h, "payload", {}) or {}
+    return p, (p.get("text") or "").strip()
+
+
+def _chunk_order(h) -> Tuple[bool, int]:
+    idx = _hit_fields(h)[0].get("chunk_index")
+    return (idx is None, idx or 0)
+
+
+def _group(hits: Sequence[Any], max_overlap: int) -> List[Passage]:
+    """Merge hits of the same page with consecutive chunk_index into passages."""
+    by_page: Dict[Tuple[Any, Any], List[Any]] = {}
+    for h in hits:
+        p, _ = _hit_fields(h)
+        by_page.setdefault((p.get("doc_id"), p.get("page")), []).append(h)
+
+    passages: List[Passage] = []
+    for (doc_id, page), group in by_page.items():
+        group.sort(key=_chunk_order)
+        current: Optional[Passage] = None
+        last_index = None
+        for h in group:
+            p, txt = _hit_fields(h)
+            idx = p.get("chunk_index")
+            score = float(getattr(h, "score", 0.0))
+            if current is not None:
+                merged = None
+                if idx is not None and last_index is not None and idx == last_index + 1:
+                    merged = merge_overlap(current.text, txt, max_overlap)
+                elif txt in current.text:
+                    merged = current.text
+                if merged is not None:
+                    current.text = merged
+                    current.score = max(current.score, score)
+                    current.hits.append(h)
+                    last_index = idx
+                    continue
+            current = Passage(
+                doc_id=doc_id,
+                title=(p.get("title") or "").strip() or doc_id,
+                page=page,
+                text=txt,
+                score=score,
+                hits=[h],
+            )
+            passages.append(current)
+            last_index = idx
+
+    passages.sort(key=lambda x: x.score, reverse=True)
+    return passages
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def mmr_order(hits: Sequence[Any], lam: float) -> List[Any]:
+    """
+    Maximal marginal relevance over the hits, using token-set overlap as the
+    similarity (hits carry payload text, not vectors).
+    """
+    remaining = list(hits)
+    if len(remaining) < 3:
+        return remaining
+    terms = {id(h): set(tokenize(_hit_fields(h)[1])) for h in remaining}
+    ordered: List[Any] = []
+    while remaining:
+        best, best_val = None, None
+        for h in remaining:
+            sim = max((_jaccard(terms[id(h)], terms[id(s)]) for s in ordered), default=0.0)
+            val = lam * float(getattr(h, "score", 0.0)) - (1.0 - lam) * sim
+            if best_val is None or val > best_val:
+                best, best_val = h, val
+        ordered.append(best)
+        remaining.remove(best)
+    return ordered
+
+
+def pack_context(
+    hits: Sequence[Any],
+    token_budget: int,
+    max_overlap: int = 150,
+    mmr_lambda: Optional[float] = None,
+) -> List[Passage]:
+    """
+    Pick hits best-first (or in MMR order) while the merged passages fit in
+    `token_budget`, and return the passages best-first. Hits without text and
+    exact duplicates are skipped. If not even one hit fits, the best one is
+    kept, truncated to the budget.
+    """
+    seen: set = set()
+    candidates: List[Any] = []
+    for h in hits or []:
+        _, txt = _hit_fields(h)
+        if not txt or txt in seen:
+            continue
+        seen.add(txt)
+        candidates.append(h)
+
+    if mmr_lambda is not None:
+        candidates = mmr_order(candidates, mmr_lambda)
+
+    chosen: List[Any] = []
+    for h in candidates:
+        trial = _group(chosen + [h], max_overlap)
+        if sum(p.tokens for p in trial) <= token_budget:
+            chosen.append(h)
+
+    if not chosen and candidates:
+        first = _group(candidates[:1], max_overlap)
+        header = len(first[0].render()) - len(first[0].text)
+        first[0].text = first[0].text[: max(0, token_budget * 4 - header - 8)]
+        return first
+
+    return _group(chosen, max_overlap)
@@ -0,0 +1,144 @@
+# app/pipelines/history.py
+"""
+Bounded chat history for general-mode prompts.
+
+Recent turns are kept verbatim within a token budget. Older turns are folded
+into a rolling summary. Summaries are cached by a chained hash of the history
+prefix they cover, so when a conversation grows only the turns that newly
+fell out of the window are summarised (on top of the previous summary).
+"""
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.pipelines.cache import TTLCache
+from app.pipelines.context import estimate_tokens
+from app.utils import logger
+
+
+Turn = Dict[str, Any]
+
+
+def turn_text(m: Turn) -> str:
+    return str(m.get("text") or m.get("content") or "").strip()
+
+
+def format_turn(m: Turn) -> str:
+    role = (m.get("role") or "user").lower()
+    text = turn_text(m)
+    # Android sometimes uses role="model" for assistant output
+    if role in ("assistant", "model"):
+        return f"Assistant: {text}"
+    if role == "system":
+        return f"System: {text}"
+    return f"User: {text}"
+
+
+def prefix_hashes(turns: List[Turn]) -> List[str]:
+    """hashes[i] identifies turns[:i]; each hash chains the previous one."""
+    h = hashlib.sha1(b"history-v1").hexdigest()
+    out = [h]
+    for m in turns:
+        h = hashlib.sha1(f"{h}\x1f{format_turn(m)}".encode("utf-8")).hexdigest()
+        out.append(h)
+    return out
+
+
+SUMMARY_PROMPT = """Summarise the conversation below for an assistant that will continue it.
+Keep names, numbers, decisions, open questions and user preferences. At most {words} words.
+
+{previous}Conversation:
+{turns}
+
+Summary:"""
+
+
+class HistorySummaryCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 86400.0):
+        self._cache = TTLCache(maxsize, ttl)
+
+    def get(self, prefix_hash: str) -> Optional[str]:
+        return self._cache.get(prefix_hash)
+
+    def set(self, prefix_hash: str, summary: str) -> None:
+        if summary:
+            self._cache.set(prefix_hash, summary)
+
+
+class HistoryCompressor:
+    def __init__(
+        self,
+        token_budget: int = 2000,
+        summary_tokens: int = 300,
+        step: int = 6,
+        summarize: Optional[Callable[[str], Awaitable[str]]] = None,
+        cache: Optional[HistorySummaryCache] = None,
+    ):
+        self.token_budget = int(token_budget)
+        self.summary_tokens = int(summary_tokens)
+        self.step = max(1, int(step))
+        self.summarize = summarize
+        self.cache = cache
+
+    def _cut(self, turns: List[Turn], budget: int) -> int:
+        """Smallest index whose suffix fits in budget (the last turn is always kept)."""
+        used = 0
+        cut = len(turns)
+        for i in range(len(turns) - 1, -1, -1):
+            used += estimate_tokens(format_turn(turns[i])) + 1
+            if used > budget and cut < len(turns):
+                break
+            cut = i
+        return cut
+
+    async def compress(self, history: Optional[List[Turn]]) -> Tuple[Optional[str], List[Turn]]:
+        """Returns (summary of older turns or None, recent turns to include verbatim)."""
+        turns = [m for m in (history or []) if turn_text(m)]
+        if not turns:
+            return None, []
+
+        if sum(estimate_tokens(format_turn(m)) + 1 for m in turns) <= self.token_budget:
+            return None, turns
+
+        if self.summarize is None or self.cache is None:
+            return None, turns[self._cut(turns, self.token_budget):]
+
+        # Round the boundary up to a multiple of `step`, so the summary only
+        # changes every few turns instead of on every request.
+        cut = self._cut(turns, self.token_budget - self.summary_tokens)
+        aligned = -(-cut // self.step) * self.step
+        if aligned >= len(turns):
+            aligned = cut
+        if aligned == 0:
+            return None, turns
+
+        try:
+            summary = await self._summary(turns, aligned)
+        except Exception as e:
+            logger.error("History summary failed", {"err": repr(e)})
+            return None, turns[cut:]
+        return summary, turns[aligned:]
+
+    async def _summary(self, turns: List[Turn], end: int) -> str:
+        hashes = prefix_hashes(turns[:end])
+        cached = self.cache.get(hashes[end])
+        if cached is not None:
+            return cached
+
+        # Newest cached prefix to build on; only turns after it are sent.
+        start, previous = 0, None
+        for i in range(end - 1, 0, -1):
+            previous = self.cache.get(hashes[i])
+            if previous is not None:
+                start = i
+                break
+
+        prompt = SUMMARY_PROMPT.format(
+            words=max(30, self.summary_tokens * 3 // 4),
+            previous=f"Summary so far:\n{previous}\n\n" if previous else "",
+            turns="\n".join(format_turn(m) for m in turns[start:end]),
+        )
+        summary = (await self.summarize(prompt)).strip()
+        self.cache.set(hashes[end], summary)
+        return summary
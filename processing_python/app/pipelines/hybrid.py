@@ -0,0 +1,77 @@
+# app/pipelines/hybrid.py
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.lexical.fts_store import tokenize
+
+
+def chunk_key(payload: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    # Dense and lexical stores have different point ids; a chunk is identified by its position.
+    return (payload.get("doc_id"), payload.get("page"), payload.get("chunk_index"))
+
+
+@dataclass
+class FusedHit:
+    id: str
+    score: float                        # dense cosine if available, else squashed BM25
+    payload: Dict[str, Any] = field(default_factory=dict)
+    dense_score: Optional[float] = None
+    lexical_score: Optional[float] = None
+    rrf: float = 0.0
+
+
+def squash_bm25(score: float) -> float:
+    # BM25 is unbounded; map to (0, 1) so it reads like the other scores.
+    score = max(0.0, float(score))
+    return score / (1.0 + score)
+
+
+def rrf_fuse(dense_hits, lexical_hits, top_k: int, k: int = 60) -> List[FusedHit]:
+    """Reciprocal rank fusion of dense and lexical result lists."""
+    fused: Dict[Tuple[Any, Any, Any], FusedHit] = {}
+
+    for rank, h in enumerate(dense_hits or []):
+        p = getattr(h, "payload", {}) or {}
+        key = chunk_key(p)
+        score = float(getattr(h, "score", 0.0))
+        f = fused.setdefault(key, FusedHit(id=str(getattr(h, "id", "")), score=score, payload=p))
+        f.dense_score = score
+        f.score = score
+        f.rrf += 1.0 / (k + rank + 1)
+
+    for rank, h in enumerate(lexical_hits or []):
+        p = getattr(h, "payload", {}) or {}
+        key = chunk_key(p)
+        score = float(getattr(h, "score", 0.0))
+        f = fused.get(key)
+        if f is None:
+            f = fused[key] = FusedHit(id=str(getattr(h, "id", "")), score=squash_bm25(score), payload=p)
+        f.lexical_score = score
+        f.rrf += 1.0 / (k + rank + 1)
+
+    return sorted(fused.values(), key=lambda f: f.rrf, reverse=True)[:top_k]
+
+
+def lexical_confident(question: str, hits, max_terms: int, margin: float) -> bool:
+    """
+    True when keyword hits alone are good enough to skip the embedding call:
+    a short keyword-style query whose every term occurs in the top hit, and
+    the top hit clearly beats the runner-up.
+    """
+    if not hits:
+        return False
+    terms = set(tokenize(question))
+    if not terms or len(terms) > max_terms:
+        return False
+
+    top_terms = set(tokenize((getattr(hits[0], "payload", {}) or {}).get("text") or ""))
+    if not terms <= top_terms:
+        return False
+
+    if len(hits) == 1:
+        return True
+    s1 = float(getattr(hits[0], "score", 0.0))
+    s2 = float(getattr(hits[1], "score", 0.0))
+    return s2 <= 0.0 or s1 >= margin * s2
@@ -1,18 +1,84 @@
 # app/pipelines/indexer.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import asyncio
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
 from app.pipelines.chunk import PageText, chunk_pages
+from app.utils import logger
 
 
 class Indexer:
-    def __init__(self, gemini_client, qdrant_store, chunk_size: int, overlap: int):
+    def __init__(
+        self,
+        gemini_client,
+        qdrant_store,
+        chunk_size: int,
+        overlap: int,
+        lexical_index=None,
+        retrieval_cache=None,
+        bulk_parallel: int = 4,   # documents written concurrently by upsert_ocr_bulk
+    ):
         self.gemini = gemini_client
         self.store = qdrant_store
         self.chunk_size = chunk_size
         self.overlap = overlap
+        self.lexical = lexical_index
+        self.retrieval_cache = retrieval_cache
+        self.bulk_parallel = max(1, int(bulk_parallel))
+
+    def _invalidate(self, user_id: str, doc_ids: List[str]):
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.invalidate(user_id=user_id, doc_ids=doc_ids)
+
+    async def delete_docs(self, user_id: str, doc_ids: List[str]):
+        ops = [self.store.adelete_docs(user_id=user_id, doc_ids=doc_ids)]
+        if self.lexical is not None:
+            ops.append(self.lexical.adelete_docs(user_id=user_id, doc_ids=doc_ids))
+        await asyncio.gather(*ops)
+        self._invalidate(user_id, doc_ids)
+
+    async def delete_doc(self, user_id: str, doc_id: str):
+        await self.delete_docs(user_id=user_id, doc_ids=[doc_id])
+
+    async def _store(self, user_id: str, doc_ids: List[str], vectors, payloads: List[Dict[str, Any]]) -> int:
+        # Vectors first: keyword rows are only written once their chunks exist in
+        # the vector store, so lexical hits never point at missing chunks.
+        count = await self.store.aupsert(vectors=vectors, payloads=payloads)
+        if self.lexical is not None:
+            await self.lexical.aupsert(payloads)
+        self._invalidate(user_id, doc_ids)
+        return count
 
-    def upsert_ocr(
+    async def _replace(
+        self, user_id: str, doc_id: str, replace: bool, vectors, payloads: List[Dict[str, Any]]
+    ) -> int:
+        # Called once the new chunks are embedded: an embedding failure leaves the
+        # previous version of the document searchable.
+        if replace:
+            await self.delete_docs(user_id=user_id, doc_ids=[doc_id])
+        return await self._store(user_id, [doc_id], vectors, payloads)
+
+    def _payloads(
+        self,
+        user_id: str,
+        doc_id: str,
+        title: Optional[str],
+        chunks: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        return [
+            {
+                "user_id": user_id,
+                "doc_id": doc_id,
+                "title": title,
+                "page": c["page"],
+                "chunk_index": c["chunk_index"],
+                "text": c["text"],
+            }
+            for c in chunks
+        ]
+
+    async def upsert_ocr(
         self,
         user_id: str,
         doc_id: str,
@@ -20,24 +86,69 @@ class Indexer:
         title: Optional[str] = None,
         replace: bool = True,   # ✅ new
     ) -> Dict[str, Any]:
-        # ✅ Make indexing idempotent
-        if replace:
-            self.store.delete_doc(user_id=user_id, doc_id=doc_id)
-
         chunks = chunk_pages(pages, chunk_size=self.chunk_size, overlap=self.overlap)
         texts = [c["text"] for c in chunks]
-        vectors = self.gemini.embed_documents(texts)
 
-        payloads = []
-        for c in chunks:
-            payloads.append({
-                "user_id": user_id,
-                "doc_id": doc_id,
-                "title": title,
-                "page": c["page"],
-                "chunk_index": c["chunk_index"],
-                "text": c["text"],
-            })
+        vectors = await self.gemini.aembed_documents(texts)
+
+        payloads = self._payloads(user_id, doc_id, title, chunks)
 
-        count = self.store.upsert(vectors=vectors, payloads=payloads)
+        # ✅ Make indexing idempotent
+        count = await self._replace(user_id, doc_id, replace, vectors, payloads)
         return {"indexed": True, "chunks": count, "replaced": replace}
+
+    async def _store_one(
+        self,
+        user_id: str,
+        doc_id: str,
+        replace: bool,
+        vectors,
+        payloads: List[Dict[str, Any]],
+        sem: asyncio.Semaphore,
+    ) -> Dict[str, Any]:
+        async with sem:
+            try:
+                count = await self._replace(user_id, doc_id, replace, vectors, payloads)
+            except Exception as e:
+                logger.error("Bulk indexing failed for document", {"doc_id": doc_id, "err": repr(e)})
+                return {"indexed": False, "chunks": 0, "error": f"{type(e).__name__}: {e}"}
+        return {"indexed": True, "chunks": count}
+
+    async def upsert_ocr_bulk(self, user_id: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Index many documents at once.
+        Chunks from all documents are embedded together, so embedding calls run on
+        full batches instead of one small batch per document. Each document is then
+        replaced and written on its own, and its result reports what actually
+        happened to it; if embedding fails, no document is touched.
+
+        Each document is a dict: {doc_id, pages, title?, replace?}; doc_ids must be unique.
+        """
+        duplicates = sorted(doc_id for doc_id, n in Counter(d["doc_id"] for d in documents).items() if n > 1)
+        if duplicates:
+            raise ValueError(f"Duplicate doc_id in bulk request: {', '.join(duplicates)}")
+
+        texts: List[str] = []
+        per_doc: List[Tuple[int, int, List[Dict[str, Any]]]] = []  # (start, end, payloads)
+        for d in documents:
+            chunks = chunk_pages(d["pages"], chunk_size=self.chunk_size, overlap=self.overlap)
+            payloads = self._payloads(user_id, d["doc_id"], d.get("title"), chunks)
+            per_doc.append((len(texts), len(texts) + len(chunks), payloads))
+            texts.extend(c["text"] for c in chunks)
+
+        vectors = await self.gemini.aembed_documents(texts)
+
+        sem = asyncio.Semaphore(self.bulk_parallel)
+        outcomes = await asyncio.gather(*(
+            self._store_one(user_id, d["doc_id"], bool(d.get("replace", True)), vectors[start:end], payloads, sem)
+            for d, (start, end, payloads) in zip(documents, per_doc)
+        ))
+        results = [
+            {"doc_id": d["doc_id"], **outcome, "replaced": bool(d.get("replace", True))}
+            for d, outcome in zip(documents, outcomes)
+        ]
+        return {
+            "indexed": all(r["indexed"] for r in results),
+            "documents": results,
+            "chunks": sum(r["chunks"] for r in results),
+        }
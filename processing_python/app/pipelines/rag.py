@@ -1,11 +1,25 @@
 # app/pipelines/rag.py
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional, Literal
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Literal, Tuple
+
+from app.core.resilience import UpstreamUnavailable, counters
+from app.pipelines.cache import AnswerCache
+from app.pipelines.context import pack_context
+from app.pipelines.history import HistoryCompressor, format_turn
+from app.pipelines.hybrid import lexical_confident, rrf_fuse
+from app.pipelines.rerank import rerank
+from app.utils import logger
 
 
 ChatMode = Literal["auto", "doc", "general"]
 
+# Bump when a prompt template below changes, so cached answers are not reused.
+DOC_PROMPT_VERSION = "doc-v1"
+GENERAL_PROMPT_VERSION = "general-v1"
+
 
 class RAG:
     def __init__(
@@ -15,107 +29,316 @@ class RAG:
         top_k: int,
         min_score: float = 0.0,
         general_system_prompt: str = "You are a helpful assistant.",
+        lexical_index=None,
+        lexical_fastpath: bool = True,
+        fastpath_max_terms: int = 4,
+        fastpath_margin: float = 1.5,
+        rrf_k: int = 60,
+        query_cache=None,       # QueryEmbeddingCache
+        retrieval_cache=None,   # RetrievalCache
+        answer_cache: Optional[AnswerCache] = None,
+        context_tokens: int = 3000,
+        chunk_overlap: int = 150,
+        mmr_lambda: Optional[float] = None,
+        candidates: int = 0,            # over-fetch this many, rerank locally down to top_k
+        rerank_dense_weight: float = 0.7,
+        history_compressor: Optional[HistoryCompressor] = None,
+        embed_batcher=None,     # EmbeddingBatcher shared across requests
     ):
         self.gemini = gemini_client
         self.store = qdrant_store
         self.top_k = top_k
         self.min_score = float(min_score or 0.0)
         self.general_system_prompt = general_system_prompt or "You are a helpful assistant."
+        self.lexical = lexical_index
+        self.lexical_fastpath = lexical_fastpath
+        self.fastpath_max_terms = fastpath_max_terms
+        self.fastpath_margin = fastpath_margin
+        self.rrf_k = rrf_k
+        self.query_cache = query_cache
+        self.retrieval_cache = retrieval_cache
+        self.answer_cache = answer_cache
+        self.context_tokens = int(context_tokens)
+        self.chunk_overlap = int(chunk_overlap)
+        self.mmr_lambda = mmr_lambda
+        self.candidates = max(int(candidates or 0), self.top_k)
+        self.rerank_dense_weight = float(rerank_dense_weight)
+        # Default: token-bounded trimming only, no summaries.
+        self.history = history_compressor or HistoryCompressor()
+        self.embed_batcher = embed_batcher
+
+    @property
+    def reranking(self) -> bool:
+        return self.candidates > self.top_k
+
+    async def _embed_uncached(self, question: str):
+        if self.embed_batcher is not None:
+            return await self.embed_batcher.embed(question)
+        return await self.gemini.aembed_query(question)
+
+    async def _embed_query(self, question: str):
+        if self.query_cache is None:
+            return await self._embed_uncached(question)
+        qv = self.query_cache.get(question)
+        if qv is None:
+            qv = await self._embed_uncached(question)
+            if qv is not None and len(qv):
+                self.query_cache.set(question, qv)
+        return qv
+
+    async def _retrieve(
+        self,
+        user_id: str,
+        question: str,
+        doc_ids: Optional[List[str]],
+    ) -> Tuple[List[Any], str]:
+        """
+        Returns (hits, retrieval) where retrieval is "lexical", "dense", "hybrid",
+        "lexical_fallback" (dense path failed) or "dense_fallback" (keyword search
+        failed); fallbacks are never cached.
+        Served from the retrieval cache when the same user asked the same question
+        over the same documents and nothing was re-indexed since.
+        """
+        if self.retrieval_cache is None:
+            return await self._search(user_id, question, doc_ids)
+
+        key = self.retrieval_cache.key(user_id, doc_ids, question, self.top_k, self.min_score)
+        cached = self.retrieval_cache.get(key)
+        if cached is not None:
+            return cached
+
+        generation = self.retrieval_cache.generation(user_id)
+        result = await self._search(user_id, question, doc_ids)
+        if result[1] not in ("lexical_fallback", "dense_fallback"):
+            self.retrieval_cache.set(key, result, generation=generation)
+        return result
+
+    async def _lexical_search(
+        self, user_id: str, question: str, doc_ids: Optional[List[str]]
+    ) -> Optional[List[Any]]:
+        """Keyword hits, or None when the keyword index failed (dense retrieval still runs)."""
+        if self.lexical is None:
+            return []
+        try:
+            return await self.lexical.asearch(
+                query=question,
+                user_id=user_id,
+                doc_ids=doc_ids,
+                top_k=self.candidates,
+            )
+        except Exception as e:
+            counters.incr("rag.lexical_failed")
+            logger.error("Keyword search failed, using dense hits only", {"err": repr(e)})
+            return None
+
+    async def _search(
+        self,
+        user_id: str,
+        question: str,
+        doc_ids: Optional[List[str]],
+    ) -> Tuple[List[Any], str]:
+        if self.lexical is not None and self.lexical_fastpath:
+            # Keyword hits come first: when they are confident the embedding call is skipped.
+            lexical_hits = await self._lexical_search(user_id, question, doc_ids)
+            if lexical_confident(
+                question, lexical_hits, max_terms=self.fastpath_max_terms, margin=self.fastpath_margin
+            ):
+                # Fused on its own so scores are squashed into (0, 1) like the others
+                return rrf_fuse([], lexical_hits, top_k=self.top_k, k=self.rrf_k), "lexical"
+            hits = await self._dense_or_none(user_id, question, doc_ids, lexical_hits)
+        else:
+            # No fast path to wait for: keyword search runs alongside embed + vector search.
+            lexical_hits, hits = await asyncio.gather(
+                self._lexical_search(user_id, question, doc_ids),
+                self._dense_search(user_id, question, doc_ids),
+                return_exceptions=True,
+            )
+            if isinstance(lexical_hits, BaseException):
+                raise lexical_hits  # cancelled; keyword failures come back as None
+            if isinstance(hits, BaseException):
+                hits = self._degrade(hits, lexical_hits)
+
+        lexical_failed = lexical_hits is None
+        lexical_hits = lexical_hits or []
+
+        if hits is None:
+            # Gemini or the vector store is unavailable: answer from keyword hits alone.
+            return rrf_fuse([], lexical_hits, top_k=self.top_k, k=self.rrf_k), "lexical_fallback"
+
+        # Optional score gating (treat weak matches as "no docs")
+        if hits and self.min_score > 0.0:
+            hits = [h for h in hits if float(getattr(h, "score", 0.0)) >= self.min_score]
+
+        if not lexical_hits:
+            hits, retrieval = list(hits or []), "dense_fallback" if lexical_failed else "dense"
+        else:
+            hits, retrieval = rrf_fuse(hits, lexical_hits, top_k=self.candidates, k=self.rrf_k), "hybrid"
+
+        # 3) local rerank of the over-fetched pool; only the best top_k reach the prompt
+        if self.reranking:
+            return rerank(question, hits, top_k=self.top_k, dense_weight=self.rerank_dense_weight), retrieval
+        return hits[: self.top_k], retrieval
+
+    async def _dense_search(self, user_id: str, question: str, doc_ids: Optional[List[str]]) -> List[Any]:
+        # 1) embed query, 2) retrieve
+        qv = await self._embed_query(question)
+        return await self.store.asearch(
+            query_vector=qv,
+            user_id=user_id,
+            doc_ids=doc_ids,
+            top_k=self.candidates,
+        )
+
+    async def _dense_or_none(self, user_id, question, doc_ids, lexical_hits) -> Optional[List[Any]]:
+        try:
+            return await self._dense_search(user_id, question, doc_ids)
+        except Exception as e:
+            return self._degrade(e, lexical_hits)
+
+    @staticmethod
+    def _degrade(exc: BaseException, lexical_hits: Optional[List[Any]]) -> None:
+        """
+        None when the dense failure can be covered by keyword hits. Otherwise
+        re-raise, as UpstreamUnavailable (503) unless it is one already.
+        """
+        if not isinstance(exc, Exception):
+            raise exc
+        if not lexical_hits:
+            if isinstance(exc, UpstreamUnavailable):
+                raise exc
+            raise UpstreamUnavailable(f"retrieval failed: {type(exc).__name__}") from exc
+        counters.incr("rag.lexical_fallback")
+        logger.error("Dense retrieval failed, using lexical hits", {"err": repr(exc)})
+        return None
+
+    def _answer_key(
+        self, prompt_version: str, user_id: str, question: str, hits: List[Any]
+    ) -> Optional[str]:
+        if self.answer_cache is None or not self.answer_cache.enabled:
+            return None
+        return AnswerCache.key(
+            prompt_version=prompt_version,
+            model=getattr(self.gemini, "chat_model", None),
+            temperature=getattr(self.gemini, "temperature", None),
+            user_id=user_id,
+            question=question,
+            hits=hits,
+        )
+
+    async def _generate(self, prompt: str, cache_key: Optional[str] = None) -> str:
+        if cache_key is None:
+            return await self.gemini.agenerate_text(prompt)
+        answer = self.answer_cache.get(cache_key)
+        if answer is None:
+            answer = await self.gemini.agenerate_text(prompt)
+            self.answer_cache.set(cache_key, answer)
+        return answer
+
+    async def _general_prompt(
+        self,
+        user_id: str,
+        question: str,
+        history: Optional[List[Dict[str, Any]]],
+    ) -> Tuple[str, Optional[str]]:
+        summary, turns = await self.history.compress(history)
+        prompt = self._build_general_prompt(question=question, history=turns, summary=summary)
+        key = None
+        if not history:
+            # The system prompt is configurable, so it is part of the template version.
+            sp = hashlib.sha1(self.general_system_prompt.encode("utf-8")).hexdigest()[:12]
+            key = self._answer_key(f"{GENERAL_PROMPT_VERSION}:{sp}", user_id, question, [])
+        return prompt, key
+
+    def _build_doc_prompt(self, question: str, context_block: str) -> str:
+        return f"""You are a document Q&A assistant.
+
+Rules:
+- Answer ONLY using the provided context.
+- If the answer is not in the context, say: "I can't find this in your documents."
+- Write a COMPLETE answer (do not respond with only a list of sources).
+- Cite sources inline like: (document title, page)
+
+Context:
+{context_block}
+
+Question:
+{question}
+\nAnswer:\n
+"""
 
     def _build_general_prompt(
         self,
         question: str,
         history: Optional[List[Dict[str, Any]]] = None,
+        summary: Optional[str] = None,
     ) -> str:
         # Stateless chat: we format history into a single prompt.
-        # Keep it short to avoid token blowups.
-        max_turns = 20
-        turns = (history or [])[-max_turns:]
-
+        # History is already bounded by HistoryCompressor (recent turns + summary).
         lines: List[str] = []
         lines.append(self.general_system_prompt.strip())
         lines.append("")  # spacer
 
-        for m in turns:
-            role = (m.get("role") or "user").lower()
-            text = m.get("text") or m.get("content") or ""
-            text = str(text).strip()
-            if not text:
-                continue
+        if summary:
+            lines.append(f"Summary of the earlier conversation:\n{summary}")
+            lines.append("")
 
-            # Android sometimes uses role="model" for assistant output
-            if role in ("assistant", "model"):
-                lines.append(f"Assistant: {text}")
-            elif role == "system":
-                lines.append(f"System: {text}")
-            else:
-                lines.append(f"User: {text}")
+        for m in history or []:
+            if not (m.get("text") or m.get("content") or "").strip():
+                continue
+            lines.append(format_turn(m))
 
         lines.append(f"User: {question}")
         lines.append("Assistant:")
         return "\n".join(lines)
 
-    def ask(
+    async def _prepare(
         self,
         user_id: str,
         question: str,
-        doc_ids: Optional[List[str]] = None,
-        mode: ChatMode = "auto",
-        history: Optional[List[Dict[str, Any]]] = None,
-    ) -> Dict[str, Any]:
+        doc_ids: Optional[List[str]],
+        mode: ChatMode,
+        history: Optional[List[Dict[str, Any]]],
+    ) -> Tuple[Dict[str, Any], Optional[str], Optional[str]]:
+        """
+        Everything up to the model call.
+        Returns (response without "answer", prompt, answer cache key); prompt is None
+        when the answer is already known and is then set in the response.
+        """
         # If forced general mode: skip vector search entirely.
         if mode == "general":
-            prompt = self._build_general_prompt(question=question, history=history)
-            answer = self.gemini.generate_text(prompt)
-            return {
-                "answer": answer,
-                "citations": [],
-                "used_chunks": 0,
-                "mode_used": "general",
-            }
-
-        # 1) embed query
-        qv = self.gemini.embed_query(question)
-
-        # 2) retrieve
-        hits = self.store.search(
-            query_vector=qv,
-            user_id=user_id,
-            doc_ids=doc_ids,
-            top_k=self.top_k,
-        )
+            prompt, key = await self._general_prompt(user_id=user_id, question=question, history=history)
+            return {"citations": [], "used_chunks": 0, "mode_used": "general"}, prompt, key
 
-        # Optional score gating (treat weak matches as "no docs")
-        if hits and self.min_score > 0.0:
-            hits = [h for h in hits if float(getattr(h, "score", 0.0)) >= self.min_score]
+        hits, retrieval = await self._retrieve(user_id=user_id, question=question, doc_ids=doc_ids)
+
+        # Merge neighbouring/overlapping chunks and fill the token budget.
+        passages = pack_context(
+            hits or [],
+            token_budget=self.context_tokens,
+            max_overlap=self.chunk_overlap,
+            mmr_lambda=self.mmr_lambda,
+        )
 
         contexts: List[str] = []
         citations: List[Dict[str, Any]] = []
+        used: List[Any] = []
 
-        for h in hits or []:
-            p = getattr(h, "payload", {}) or {}
-            txt = p.get("text") or ""
-            if not txt:
-                continue
-
-            raw_doc_id = p.get("doc_id")
-            title = (p.get("title") or "").strip() or raw_doc_id  # ưu tiên title
-            page = p.get("page")
-            chunk_index = p.get("chunk_index")
-
-            # Make context source human-readable (helps the model cite properly)
-            contexts.append(f"SOURCE: {title} (page {page})\n{txt}")
-            citations.append(
-                {
-                    # trả doc_id = title để phía Android không hiện id kiểu base64 nữa
-                    "doc_id": title,
-                    # vẫn gửi raw để debug (Android sẽ ignore field lạ)
-                    "doc_id_raw": raw_doc_id,
-                    "page": page,
-                    "chunk_index": chunk_index,
-                    "score": float(getattr(h, "score", 0.0)),
-                }
-            )
+        for passage in passages:
+            contexts.append(passage.render())
+            for h in passage.hits:
+                p = getattr(h, "payload", {}) or {}
+                used.append(h)
+                citations.append(
+                    {
+                        # trả doc_id = title để phía Android không hiện id kiểu base64 nữa
+                        "doc_id": passage.title,
+                        # vẫn gửi raw để debug (Android sẽ ignore field lạ)
+                        "doc_id_raw": p.get("doc_id"),
+                        "page": p.get("page"),
+                        "chunk_index": p.get("chunk_index"),
+                        "score": float(getattr(h, "score", 0.0)),
+                    }
+                )
 
         # If no doc context:
         if not contexts:
@@ -126,41 +349,65 @@ class RAG:
                     "citations": [],
                     "used_chunks": 0,
                     "mode_used": "doc",
-                }
+                }, None, None
 
             # AUTO fallback => generic conversation
-            prompt = self._build_general_prompt(question=question, history=history)
-            answer = self.gemini.generate_text(prompt)
-            return {
-                "answer": answer,
-                "citations": [],
-                "used_chunks": 0,
-                "mode_used": "general",
-            }
+            prompt, key = await self._general_prompt(user_id=user_id, question=question, history=history)
+            return {"citations": [], "used_chunks": 0, "mode_used": "general"}, prompt, key
 
         context_block = "\n\n---\n\n".join(contexts)
 
-        # 3) generate answer (ONLY from context)
-        prompt = f"""You are a document Q&A assistant.
+        # 4) generate answer (ONLY from context); cached only for standalone questions
+        prompt = self._build_doc_prompt(question=question, context_block=context_block)
+        key = None if history else self._answer_key(DOC_PROMPT_VERSION, user_id, question, used)
+        return {
+            "citations": citations,
+            "used_chunks": len(used),
+            "mode_used": "doc",
+            "retrieval": retrieval,
+        }, prompt, key
 
-Rules:
-- Answer ONLY using the provided context.
-- If the answer is not in the context, say: "I can't find this in your documents."
-- Write a COMPLETE answer (do not respond with only a list of sources).
-- Cite sources inline like: (document title, page)
+    async def ask(
+        self,
+        user_id: str,
+        question: str,
+        doc_ids: Optional[List[str]] = None,
+        mode: ChatMode = "auto",
+        history: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        meta, prompt, key = await self._prepare(user_id, question, doc_ids, mode, history)
+        if prompt is None:
+            return meta
+        return {"answer": await self._generate(prompt, key), **meta}
 
-Context:
-{context_block}
+    async def ask_stream(
+        self,
+        user_id: str,
+        question: str,
+        doc_ids: Optional[List[str]] = None,
+        mode: ChatMode = "auto",
+        history: Optional[List[Dict[str, Any]]] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Same as ask() but as events: one "meta" event (citations etc.) as soon as
+        retrieval is done, then "token" events as the model streams, then "done".
+        """
+        meta, prompt, key = await self._prepare(user_id, question, doc_ids, mode, history)
+        answer = meta.pop("answer", None)
+        yield {"type": "meta", **meta}
 
-Question:
-{question}
-\nAnswer:\n
-"""
+        if prompt is not None and key is not None:
+            answer = self.answer_cache.get(key)
 
-        answer = self.gemini.generate_text(prompt)
-        return {
-            "answer": answer,
-            "citations": citations,
-            "used_chunks": len(contexts),
-            "mode_used": "doc",
-        }
+        if answer is not None:
+            yield {"type": "token", "text": answer}
+        else:
+            parts: List[str] = []
+            async for text in self.gemini.astream_text(prompt):
+                parts.append(text)
+                yield {"type": "token", "text": text}
+            answer = "".join(parts)
+            if key is not None:
+                self.answer_cache.set(key, answer)
+
+        yield {"type": "done", "answer": answer}
@@ -0,0 +1,58 @@
+# app/pipelines/rerank.py
+"""
+CPU-cheap second stage for over-fetched candidates: BM25 computed over the
+candidate set only (no index needed), blended with the dense score.
+"""
+from __future__ import annotations
+
+import math
+from collections import Counter
+from typing import Any, List, Optional, Sequence
+
+from app.services.lexical.fts_store import tokenize
+
+
+def bm25_scores(query: str, texts: Sequence[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    terms = set(tokenize(query))
+    docs = [tokenize(t) for t in texts]
+    if not terms or not docs:
+        return [0.0] * len(docs)
+
+    n = len(docs)
+    avgdl = sum(len(d) for d in docs) / n or 1.0
+    df = Counter(t for d in docs for t in set(d) if t in terms)
+    idf = {t: math.log(1.0 + (n - df[t] + 0.5) / (df[t] + 0.5)) for t in terms}
+
+    scores: List[float] = []
+    for d in docs:
+        tf = Counter(t for t in d if t in terms)
+        norm = k1 * (1.0 - b + b * len(d) / avgdl)
+        scores.append(sum((idf[t] * f * (k1 + 1.0) / (f + norm) for t, f in tf.items()), 0.0))
+    return scores
+
+
+def _dense_score(h) -> float:
+    # FusedHit keeps the cosine separately; lexical-only hits fall back to their squashed score.
+    dense: Optional[float] = getattr(h, "dense_score", None)
+    return float(dense if dense is not None else getattr(h, "score", 0.0))
+
+
+def rerank(question: str, hits: Sequence[Any], top_k: int, dense_weight: float = 0.7) -> List[Any]:
+    """
+    Order hits by dense_weight * dense score + (1 - dense_weight) * BM25
+    (normalised to [0, 1] within the candidate set) and keep the best top_k.
+    """
+    hits = list(hits)
+    if len(hits) <= 1:
+        return hits[:top_k]
+
+    texts = [((getattr(h, "payload", {}) or {}).get("text") or "") for h in hits]
+    lexical = bm25_scores(question, texts)
+    top = max(lexical) or 1.0
+
+    scored = [
+        (dense_weight * _dense_score(h) + (1.0 - dense_weight) * (lex / top), i)
+        for i, (h, lex) in enumerate(zip(hits, lexical))
+    ]
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return [hits[i] for _, i in scored[:top_k]]
@@ -0,0 +1,201 @@
+# app/services/lexical/fts_store.py
+"""
+Keyword index over document chunks (SQLite FTS5, BM25 ranking).
+
+Same chunk payloads as the vector store, so hits can be fused with dense
+results by (doc_id, page, chunk_index). The tenant is an indexed FTS column,
+so the per-user restriction is applied inside the FTS query itself.
+
+The index is a local SQLite file filled by the indexing routes of the process
+that writes it: every replica answering chat requests must share it, i.e. run
+the service as a single replica (any number of workers on one host) or set
+LEXICAL_INDEX_ENABLED=false. Documents indexed before the file existed are
+added with scripts/backfill_lexical_index.py, which rebuilds it from the
+Qdrant payloads.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS chunks (
+  id          INTEGER PRIMARY KEY,
+  user_id     TEXT NOT NULL,
+  tenant      TEXT NOT NULL,
+  doc_id      TEXT NOT NULL,
+  title       TEXT,
+  page        INTEGER,
+  chunk_index INTEGER,
+  text        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_chunks_user_doc ON chunks(user_id, doc_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+  text,
+  tenant,
+  content='chunks',
+  content_rowid='id',
+  tokenize='unicode61 remove_diacritics 0'
+);
+
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+  INSERT INTO chunks_fts(rowid, text, tenant) VALUES (new.id, new.text, new.tenant);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+  INSERT INTO chunks_fts(chunks_fts, rowid, text, tenant) VALUES ('delete', old.id, old.text, old.tenant);
+END;
+"""
+
+INSERT_SQL = (
+    "INSERT INTO chunks(user_id, tenant, doc_id, title, page, chunk_index, text) VALUES (?,?,?,?,?,?,?)"
+)
+
+_TOKEN_RE = re.compile(r"[0-9A-Za-zÀ-ỹ_\-]+")
+
+
+def tokenize(s: str) -> List[str]:
+    return [t.lower() for t in _TOKEN_RE.findall(s or "")]
+
+
+def _tenant(user_id: str) -> str:
+    # A single safe FTS token per user
+    return "t" + hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:20]
+
+
+@dataclass
+class LexicalHit:
+    id: str
+    score: float              # BM25 relevance (higher is better)
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+class FtsStore:
+    def __init__(self, path: str):
+        if path != ":memory:":
+            Path(path).resolve().parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.executescript(SCHEMA_SQL)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rows(payloads: List[Dict[str, Any]]) -> List[tuple]:
+        return [
+            (
+                p["user_id"],
+                _tenant(p["user_id"]),
+                p["doc_id"],
+                p.get("title"),
+                p.get("page"),
+                p.get("chunk_index"),
+                p.get("text") or "",
+            )
+            for p in payloads
+        ]
+
+    def upsert(self, payloads: List[Dict[str, Any]]) -> int:
+        rows = self._rows(payloads)
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany(INSERT_SQL, rows)
+        return len(rows)
+
+    def replace_user(self, user_id: str, payloads: List[Dict[str, Any]]) -> int:
+        """Swap all of a user's chunks for `payloads` in one transaction (backfill)."""
+        rows = self._rows(payloads)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE user_id = ?", (user_id,))
+            self._conn.executemany(INSERT_SQL, rows)
+        return len(rows)
+
+    def delete_docs(self, user_id: str, doc_ids: Iterable[str]):
+        doc_ids = list(doc_ids or [])
+        if not doc_ids:
+            return
+        marks = ",".join("?" for _ in doc_ids)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM chunks WHERE user_id = ? AND doc_id IN ({marks})",
+                [user_id, *doc_ids],
+            )
+
+    def delete_doc(self, user_id: str, doc_id: str):
+        self.delete_docs(user_id=user_id, doc_ids=[doc_id])
+
+    def search(
+        self,
+        query: str,
+        user_id: str,
+        doc_ids: Optional[List[str]],
+        top_k: int,
+    ) -> List[LexicalHit]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        # Quote every term (no FTS syntax from user input); OR for recall, BM25 ranks.
+        quoted = " OR ".join(f'"{t}"' for t in terms)
+        match = f"tenant:{_tenant(user_id)} AND ({quoted})"
+        sql = (
+            "SELECT c.id, c.doc_id, c.title, c.page, c.chunk_index, c.text, c.user_id, "
+            "bm25(chunks_fts, 1.0, 0.0) AS rank "
+            "FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? AND c.user_id = ?"
+        )
+        params: List[Any] = [match, user_id]
+        if doc_ids:
+            sql += f" AND c.doc_id IN ({','.join('?' for _ in doc_ids)})"
+            params.extend(doc_ids)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(int(top_k))
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [
+            LexicalHit(
+                id=f"lex:{r['id']}",
+                score=-float(r["rank"]),  # FTS5 bm25(): lower is better
+                payload={
+                    "user_id": r["user_id"],
+                    "doc_id": r["doc_id"],
+                    "title": r["title"],
+                    "page": r["page"],
+                    "chunk_index": r["chunk_index"],
+                    "text": r["text"],
+                },
+            )
+            for r in rows
+        ]
+
+    # Async interface: SQLite calls run in a worker thread.
+    async def aupsert(self, payloads: List[Dict[str, Any]]) -> int:
+        return await asyncio.to_thread(self.upsert, payloads)
+
+    async def adelete_docs(self, user_id: str, doc_ids: Iterable[str]):
+        await asyncio.to_thread(self.delete_docs, user_id, doc_ids)
+
+    async def asearch(
+        self,
+        query: str,
+        user_id: str,
+        doc_ids: Optional[List[str]],
+        top_k: int,
+    ) -> List[LexicalHit]:
+        return await asyncio.to_thread(self.search, query, user_id, doc_ids, top_k)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
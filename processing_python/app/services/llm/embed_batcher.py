@@ -0,0 +1,122 @@
+# app/services/llm/embed_batcher.py
+"""
+Coalesces concurrent single-text query embeddings into one batched call.
+
+Callers await embed(text). The first waiting text starts a timer; the batch
+is sent when the timer fires (max_wait_ms) or as soon as max_batch texts are
+queued, whichever comes first. Each caller gets its own row back, or the
+batch's exception.
+
+A batch is shared by several requests, so it runs in a fresh context rather
+than the one of whichever caller started the timer, bounded by the latest of
+its callers' deadlines. Each caller still waits only until its own deadline.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.resilience import DeadlineExceeded, counters, current_deadline, deadline_context
+
+# (text, caller's future, caller's deadline or None)
+_Item = Tuple[str, asyncio.Future, Optional[float]]
+
+
+class EmbeddingBatcher:
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], Awaitable[np.ndarray]],
+        max_batch: int = 100,
+        max_wait_ms: float = 5.0,
+    ):
+        self.embed_many = embed_many
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._pending: List[_Item] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()
+        # Batches sent / texts embedded, for logging and load tests.
+        self.batches = 0
+        self.texts = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        deadline = current_deadline()
+        if deadline is not None and deadline <= time.monotonic():
+            counters.incr("embed_batch.deadline_exceeded")
+            raise DeadlineExceeded("embed_batch: request deadline exceeded")
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut, deadline))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        if deadline is None:
+            return await fut
+        try:
+            # Cancels only this caller's future; the batch goes on for the others.
+            return await asyncio.wait_for(fut, deadline - time.monotonic())
+        except asyncio.TimeoutError as e:
+            counters.incr("embed_batch.deadline_exceeded")
+            raise DeadlineExceeded("embed_batch: request deadline exceeded") from e
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[: self.max_batch], self._pending[self.max_batch :]
+        if self._pending:
+            # More than one batch queued up: keep draining on the next loop turn.
+            self._timer = asyncio.get_running_loop().call_later(0, self._flush)
+        if not batch:
+            return
+        # The batch may run until the latest of its callers gives up (unbounded if any has no deadline).
+        deadlines = [d for _, _, d in batch]
+        deadline = None if None in deadlines else max(deadlines)
+        task = deadline_context(deadline).run(asyncio.ensure_future, self._send(batch, deadline))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: List[_Item], deadline: Optional[float]) -> None:
+        # Callers that already gave up are not embedded.
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+        # Identical questions in the same window share one row.
+        rows: Dict[str, int] = {}
+        for text, _, _ in batch:
+            rows.setdefault(text, len(rows))
+        try:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            vectors = await asyncio.wait_for(self.embed_many(list(rows)), timeout)
+        except asyncio.TimeoutError:
+            counters.incr("embed_batch.deadline_exceeded")
+            self._fail(batch, DeadlineExceeded("embed_batch: every caller's deadline passed"))
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        self.batches += 1
+        self.texts += len(rows)
+        for text, fut, _ in batch:
+            if not fut.done():
+                fut.set_result(vectors[rows[text]])
+
+    @staticmethod
+    def _fail(batch: List[_Item], exc: BaseException) -> None:
+        for _, fut, _ in batch:
+            if not fut.done():
+                fut.set_exception(exc)
+
+    async def aclose(self) -> None:
+        if self._pending:
+            self._flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
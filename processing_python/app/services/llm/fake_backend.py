@@ -0,0 +1,113 @@
+# app/services/llm/fake_backend.py
+"""
+Offline stand-in for google.genai.Client (LLM_BACKEND=fake).
+
+Implements just the calls GeminiClient makes:
+    aio.models.embed_content / generate_content / generate_content_stream
+    close / aio.aclose
+
+Embeddings are deterministic feature-hashed bags of words, so texts that share
+words get similar vectors and retrieval behaves plausibly. Latency is
+synthetic and configurable; no network, no quota.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, List, Union
+
+import numpy as np
+
+from app.services.lexical.fts_store import tokenize
+
+
+def hash_embedding(text: str, dims: int) -> np.ndarray:
+    v = np.zeros(dims, dtype=np.float32)
+    for tok in tokenize(text):
+        h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % dims] += 1.0 if (h >> 63) & 1 else -1.0
+    n = float(np.linalg.norm(v))
+    if n == 0.0:
+        v[0] = 1.0
+        return v
+    return v / n
+
+
+def _as_texts(contents: Union[str, List[Any]]) -> List[str]:
+    if isinstance(contents, str):
+        return [contents]
+    return [c if isinstance(c, str) else str(c) for c in contents]
+
+
+class _FakeAsyncModels:
+    def __init__(self, backend: "FakeGenAIClient"):
+        self._b = backend
+
+    async def embed_content(self, model: str, contents, config=None):
+        texts = _as_texts(contents)
+        await asyncio.sleep(self._b.embed_latency)
+        return self._b._embed_response(texts, config)
+
+    async def generate_content(self, model: str, contents, config=None):
+        await asyncio.sleep(self._b.generate_latency)
+        return SimpleNamespace(text=self._b._answer(contents))
+
+    async def generate_content_stream(self, model: str, contents, config=None) -> AsyncIterator[Any]:
+        async def _stream():
+            await asyncio.sleep(self._b.first_token_latency)
+            for piece in self._b._pieces(contents):
+                await asyncio.sleep(self._b.token_latency)
+                yield SimpleNamespace(text=piece)
+
+        return _stream()
+
+
+class _FakeAio:
+    def __init__(self, backend: "FakeGenAIClient"):
+        self.models = _FakeAsyncModels(backend)
+
+    async def aclose(self) -> None:
+        return None
+
+
+class FakeGenAIClient:
+    def __init__(
+        self,
+        dims: int = 768,
+        embed_latency_ms: float = 0.0,
+        generate_latency_ms: float = 0.0,
+        first_token_latency_ms: float = 0.0,
+        token_latency_ms: float = 0.0,
+        answer_words: int = 60,
+    ):
+        self.dims = int(dims)
+        self.embed_latency = embed_latency_ms / 1000.0
+        self.generate_latency = generate_latency_ms / 1000.0
+        self.first_token_latency = first_token_latency_ms / 1000.0
+        self.token_latency = token_latency_ms / 1000.0
+        self.answer_words = int(answer_words)
+        self.aio = _FakeAio(self)
+
+    def _embed_response(self, texts: List[str], config=None):
+        dims = getattr(config, "output_dimensionality", None) or self.dims
+        return SimpleNamespace(
+            embeddings=[SimpleNamespace(values=hash_embedding(t, dims).tolist()) for t in texts]
+        )
+
+    def _answer(self, contents) -> str:
+        # Deterministic per prompt, so cached and uncached runs are comparable.
+        prompt = "\n".join(_as_texts(contents))
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        words = tokenize(prompt)[-self.answer_words:] or ["ok"]
+        return f"[fake:{digest[:8]}] " + " ".join(words)
+
+    def _pieces(self, contents, words_per_piece: int = 4) -> List[str]:
+        words = self._answer(contents).split(" ")
+        return [
+            " ".join(words[i : i + words_per_piece]) + (" " if i + words_per_piece < len(words) else "")
+            for i in range(0, len(words), words_per_piece)
+        ]
+
+    def close(self) -> None:
+        return None
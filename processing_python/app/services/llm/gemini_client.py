@@ -1,11 +1,18 @@
 # app/services/llm/gemini_client.py
 from __future__ import annotations
 
-from typing import List, Optional
+import asyncio
+from typing import Any, AsyncIterator, List, Optional
 
+import numpy as np
 from google import genai
 from google.genai import types
 
+from app.core.resilience import CallPolicy, DeadlineExceeded, counters, remaining
+
+
+EMBED_BATCH = 100  # Google GenAI limit per embed_content call
+
 
 class GeminiClient:
     def __init__(
@@ -16,64 +23,167 @@ class GeminiClient:
         embed_dims: Optional[int] = None,  # optional: reduce vector size (e.g., 768/1536)
         max_output_tokens: int = 1024,
         temperature: float = 0.2,
+        embed_concurrency: int = 4,  # embed batches in flight at once (shared by all callers)
+        http_options: Optional[types.HttpOptions] = None,  # e.g. pooled/keep-alive httpx limits
+        backend: Optional[Any] = None,  # genai.Client look-alike, e.g. FakeGenAIClient for offline runs
+        policy: Optional[CallPolicy] = None,  # deadlines / hedging / breaker for the async calls
+        embed_timeout: Optional[float] = None,      # seconds
+        generate_timeout: Optional[float] = None,   # seconds (until the first chunk when streaming)
+        stream_idle_timeout: Optional[float] = None,  # seconds between two streamed chunks
+        embed_hedge_after: Optional[float] = None,  # seconds; embeddings are idempotent
     ):
-        if not api_key:
+        if backend is not None:
+            self._client = backend
+        elif not api_key:
             raise RuntimeError("GEMINI_API_KEY is missing")
-
-        self._client = genai.Client(api_key=api_key)
+        else:
+            self._client = genai.Client(api_key=api_key, http_options=http_options)
         self._embed_model = embed_model
         self._chat_model = chat_model
         self._embed_dims = embed_dims
         self._max_output_tokens = int(max_output_tokens or 1024)
         self._temperature = float(temperature if temperature is not None else 0.2)
+        self._embed_slots = asyncio.Semaphore(max(1, int(embed_concurrency)))
+        self.policy = policy
+        self._embed_timeout = embed_timeout
+        self._generate_timeout = generate_timeout
+        self._stream_idle_timeout = stream_idle_timeout
+        self._embed_hedge_after = embed_hedge_after
+
+    async def _call(self, op: str, fn, timeout: Optional[float], hedge_after: Optional[float] = None):
+        if self.policy is None:
+            return await fn()
+        return await self.policy.call(op, fn, timeout=timeout, hedge_after=hedge_after)
+
+    @property
+    def chat_model(self) -> Optional[str]:
+        return self._chat_model
+
+    @property
+    def temperature(self) -> float:
+        return self._temperature
+
+    @property
+    def max_output_tokens(self) -> int:
+        return self._max_output_tokens
+
+    def _embed_config(self) -> Optional[types.EmbedContentConfig]:
+        return types.EmbedContentConfig(output_dimensionality=self._embed_dims) if self._embed_dims else None
+
+    def _empty_embeddings(self) -> np.ndarray:
+        return np.empty((0, self._embed_dims or 0), dtype=np.float32)
+
+    @staticmethod
+    def _fill(out: Optional[np.ndarray], total: int, start: int, batch: List[str], resp) -> np.ndarray:
+        embs = np.asarray(
+            [getattr(e, "values", e) for e in resp.embeddings],
+            dtype=np.float32,
+        )
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        if not texts:
-            return []
-
-        cfg = types.EmbedContentConfig(output_dimensionality=self._embed_dims) if self._embed_dims else None
+        if embs.ndim != 2 or len(embs) != len(batch):
+            raise RuntimeError(f"Embedding count mismatch: got {len(embs)} for {len(batch)} texts")
 
-        BATCH = 100  # Google GenAI limit
-        out: List[List[float]] = []
+        # Allocate once we know the model's dimensionality, then fill in place.
+        if out is None:
+            out = np.empty((total, embs.shape[1]), dtype=np.float32)
+        out[start : start + len(batch)] = embs
+        return out
 
-        for start in range(0, len(texts), BATCH):
-            batch = texts[start : start + BATCH]
+    async def aembed_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts into a (len(texts), dims) float32 matrix. Batches are sent
+        concurrently, at most embed_concurrency at a time for the whole client,
+        so a large document cannot flood the API (429s would trip the breaker).
+        """
+        if not texts:
+            return self._empty_embeddings()
 
-            resp = self._client.models.embed_content(
+        cfg = self._embed_config()
+        starts = list(range(0, len(texts), EMBED_BATCH))
+        def _embed(start: int):
+            return lambda: self._client.aio.models.embed_content(
                 model=self._embed_model,
-                contents=batch,
+                contents=texts[start : start + EMBED_BATCH],
                 config=cfg,
             )
 
-            embs: List[List[float]] = []
-            for e in resp.embeddings:
-                values = getattr(e, "values", e)
-                embs.append(list(values))
+        async def _send(start: int):
+            async with self._embed_slots:
+                return await self._call("embed", _embed(start), self._embed_timeout, self._embed_hedge_after)
 
-            if len(embs) != len(batch):
-                raise RuntimeError(f"Embedding count mismatch: got {len(embs)} for {len(batch)} texts")
-
-            out.extend(embs)
-
-        if len(out) != len(texts):
-            raise RuntimeError(f"Embedding count mismatch: got {len(out)} for {len(texts)} texts")
+        resps = await asyncio.gather(*(_send(start) for start in starts))
 
+        out: Optional[np.ndarray] = None
+        for start, resp in zip(starts, resps):
+            out = self._fill(out, len(texts), start, texts[start : start + EMBED_BATCH], resp)
         return out
 
-    def embed_query(self, text: str) -> List[float]:
-        vecs = self.embed_documents([text])
-        return vecs[0] if vecs else []
+    async def aembed_query(self, text: str) -> np.ndarray:
+        vecs = await self.aembed_documents([text])
+        return vecs[0] if len(vecs) else np.empty(0, dtype=np.float32)
 
-    def generate_text(self, prompt: str) -> str:
+    def _generate_config(self) -> types.GenerateContentConfig:
         if not self._chat_model:
             raise RuntimeError("Chat model not configured (set GEMINI_CHAT_MODEL).")
+        return types.GenerateContentConfig(
+            temperature=self._temperature,
+            max_output_tokens=self._max_output_tokens,
+        )
 
-        resp = self._client.models.generate_content(
-            model=self._chat_model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=self._temperature,
-                max_output_tokens=self._max_output_tokens,
+    async def agenerate_text(self, prompt: str) -> str:
+        cfg = self._generate_config()
+        resp = await self._call(
+            "generate",
+            lambda: self._client.aio.models.generate_content(
+                model=self._chat_model,
+                contents=prompt,
+                config=cfg,
             ),
+            self._generate_timeout,
         )
         return resp.text or ""
+
+    async def astream_text(self, prompt: str) -> AsyncIterator[str]:
+        """Yield answer text pieces as the model produces them."""
+        cfg = self._generate_config()
+        stream = await self._call(
+            "stream",
+            lambda: self._client.aio.models.generate_content_stream(
+                model=self._chat_model,
+                contents=prompt,
+                config=cfg,
+            ),
+            self._generate_timeout,
+        )
+        if self.policy is None:
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+            return
+
+        # A stalled stream must not hold the request past its deadline: the
+        # first chunk gets generate_timeout, each later one stream_idle_timeout.
+        chunks = stream.__aiter__()
+        timeout = self._generate_timeout
+        while True:
+            left = remaining()
+            own_timeout = timeout is not None and (left is None or timeout <= left)
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout if own_timeout else left)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError as e:
+                counters.incr(f"{self.policy.name}.stream.idle_timeouts")
+                # Same rule as CallPolicy: only the upstream's own timeout counts against it.
+                if own_timeout and self.policy.breaker is not None:
+                    self.policy.breaker.record_failure()
+                raise DeadlineExceeded("gemini.stream: no chunk in time") from e
+            if chunk.text:
+                yield chunk.text
+            timeout = self._stream_idle_timeout
+
+    def close(self) -> None:
+        self._client.close()
+
+    async def aclose(self) -> None:
+        await self._client.aio.aclose()
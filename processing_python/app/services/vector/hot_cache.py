@@ -0,0 +1,168 @@
+# app/services/vector/hot_cache.py
+"""
+Per-process cache of the vectors behind recently chatted-about documents.
+
+A scoped chat (doc_ids given) usually asks many questions about a document of
+a few hundred chunks. The first question loads that (user, doc) pair's
+L2-normalised float32 matrix and payloads from Qdrant; later questions are
+answered with one in-memory matrix product instead of a network round trip.
+
+- Entries are per (user_id, doc_id), so overlapping doc sets share them.
+- Total size (vectors + estimated payload bytes) is bounded; least recently
+  used entries are evicted first.
+- The store invalidates entries when a document is re-indexed or deleted in
+  this process; `ttl` bounds staleness from writes made by other processes.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.vector.local_store import LocalHit
+
+
+Key = Tuple[str, str]  # (user_id, doc_id)
+
+
+@dataclass
+class HotDoc:
+    ids: List[str]
+    matrix: np.ndarray              # (n, dim) float32, rows L2-normalised
+    payloads: List[Dict[str, Any]]
+    nbytes: int
+    loaded_at: float
+
+
+def _payload_bytes(payloads: List[Dict[str, Any]]) -> int:
+    # Rough: text dominates; the rest is a fixed per-row overhead.
+    return sum(len(str(p.get("text") or "")) + 256 for p in payloads)
+
+
+def make_hot_doc(ids: List[str], vectors: Any, payloads: List[Dict[str, Any]]) -> HotDoc:
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1) if ids else np.empty((0, 0), np.float32)
+    if len(matrix):
+        matrix = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+    return HotDoc(
+        ids=list(ids),
+        matrix=np.ascontiguousarray(matrix, dtype=np.float32),
+        payloads=list(payloads),
+        nbytes=int(matrix.nbytes) + _payload_bytes(payloads),
+        loaded_at=time.monotonic(),
+    )
+
+
+class HotDocCache:
+    def __init__(self, max_bytes: int, ttl: float = 300.0, max_docs_per_query: int = 16):
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self.max_docs_per_query = int(max_docs_per_query)
+        self._data: "OrderedDict[Key, HotDoc]" = OrderedDict()
+        self._bytes = 0
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Hits / misses / evictions, for logging and load tests.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl > 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def covers(self, doc_ids: Optional[Iterable[str]]) -> bool:
+        """Only scoped searches over a handful of documents are worth pinning."""
+        return self.enabled and bool(doc_ids) and len(set(doc_ids)) <= self.max_docs_per_query
+
+    def generation(self, user_id: str) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get_many(self, user_id: str, doc_ids: Iterable[str]) -> Tuple[Dict[str, HotDoc], List[str]]:
+        """Returns (cached entries by doc_id, doc_ids that must be loaded)."""
+        found: Dict[str, HotDoc] = {}
+        missing: List[str] = []
+        now = time.monotonic()
+        with self._lock:
+            for doc_id in dict.fromkeys(doc_ids):
+                key = (user_id, doc_id)
+                entry = self._data.get(key)
+                if entry is not None and now - entry.loaded_at > self.ttl:
+                    self._drop(key)
+                    entry = None
+                if entry is None:
+                    missing.append(doc_id)
+                    continue
+                self._data.move_to_end(key)
+                found[doc_id] = entry
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put(self, user_id: str, doc_id: str, entry: HotDoc, generation: int) -> bool:
+        """Insert unless the user's documents changed since `generation` was read, or it can't fit."""
+        if not self.enabled or entry.nbytes > self.max_bytes:
+            return False
+        key = (user_id, doc_id)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return False
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and self._data:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+        return True
+
+    def invalidate(self, user_id: str, doc_ids: Optional[Iterable[str]] = None) -> None:
+        """Drop the given documents (all of the user's when doc_ids is None)."""
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            if doc_ids is None:
+                keys = [k for k in self._data if k[0] == user_id]
+            else:
+                keys = [(user_id, d) for d in doc_ids]
+            for key in keys:
+                if key in self._data:
+                    self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _drop(self, key: Key) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry.nbytes
+
+    @staticmethod
+    def search(entries: Iterable[HotDoc], query_vector: Any, top_k: int) -> List[LocalHit]:
+        """Cosine top_k over the given entries (same scores Qdrant reports for COSINE)."""
+        entries = [e for e in entries if len(e.ids)]
+        if not entries or top_k <= 0:
+            return []
+        q = np.asarray(query_vector, dtype=np.float32).ravel()
+        q = q / (float(np.linalg.norm(q)) + 1e-12)
+
+        scores = np.concatenate([e.matrix @ q for e in entries])
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        offsets = np.cumsum([0] + [len(e.ids) for e in entries])
+        out: List[LocalHit] = []
+        for i in top:
+            e_no = int(np.searchsorted(offsets, i, side="right") - 1)
+            entry, row = entries[e_no], int(i - offsets[e_no])
+            out.append(LocalHit(id=entry.ids[row], score=float(scores[i]), payload=entry.payloads[row]))
+        return out
@@ -0,0 +1,576 @@
+# app/services/vector/local_store.py
+"""
+In-process vector store with the same interface as QdrantStore.
+
+Layout on disk (one directory per user, named by a hash of the user id):
+    meta.json          {"generation", "dim", "rows", "payload_bytes"}: the committed state
+    vectors.<gen>.f32  row-major float32 matrix, rows L2-normalised (cosine == dot)
+    payloads.<gen>.jsonl  one JSON object per row: {"id": ..., "payload": {...}}
+    ivf.npz            optional approximate index (centroids + row assignments)
+    lock               flock()ed by writers
+
+Appends go to the end of the current generation's files and are committed by
+replacing meta.json; deletes write a new generation and switch to it the same
+way. A crash at any point leaves the last committed state readable.
+
+Several processes (uvicorn workers, admin scripts) may share the directory:
+every write holds an exclusive lock on the tenant's `lock` file and first
+catches up with meta.json, so it never cuts off rows another process just
+committed. Readers notice a replaced meta.json and catch up before searching.
+
+Small tenants are searched exactly with one vectorised matrix product over a
+memory-mapped matrix. Above `ann_threshold` rows only the `nprobe` closest lists
+of an IVF index (spherical k-means) are scored. The index is trained in a
+background thread, never inside a search; appended rows are assigned to the
+existing centroids, and the centroids are retrained once `ivf_rebuild_drift` of
+the rows changed since they were trained.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single process there
+    fcntl = None
+
+
+@dataclass
+class LocalHit:
+    # Same attributes RAG reads from Qdrant's ScoredPoint
+    id: str
+    score: float
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+def _write_synced(path: Path, data: bytes) -> None:
+    with path.open("wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    _write_synced(tmp, data)
+    os.replace(tmp, path)
+
+
+def _size(path: Path) -> int:
+    return os.path.getsize(path) if path.exists() else 0
+
+
+def _truncate(path: Path, size: int) -> None:
+    if _size(path) > size:
+        os.truncate(path, size)
+
+
+def _append(path: Path, committed: int, data: bytes) -> None:
+    # Drop an uncommitted tail first, so new rows land right after the committed ones.
+    _truncate(path, committed)
+    with path.open("ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _kmeans(x: np.ndarray, nlist: int, iters: int = 10, sample: int = 50_000) -> np.ndarray:
+    """Spherical k-means centroids (nlist, dim) trained on a sample of the rows."""
+    rng = np.random.default_rng(0)
+    train = x if len(x) <= sample else x[np.sort(rng.choice(len(x), sample, replace=False))]
+    train = np.asarray(train)
+
+    nlist = max(1, min(nlist, len(train)))
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = train[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+    return centroids.astype(np.float32)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, step: int = 65_536) -> np.ndarray:
+    # In chunks, to keep peak memory bounded.
+    assign = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), step):
+        assign[start:start + step] = np.argmax(np.asarray(x[start:start + step]) @ centroids.T, axis=1)
+    return assign
+
+
+class _Tenant:
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.ids: List[str] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self.doc_ids = np.empty(0, dtype=object)
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self._payload_bytes = 0  # committed length of the payload file
+        self._matrix: Optional[np.ndarray] = None
+        # IVF index: new rows are assigned to the existing centroids; `ivf_drift` counts
+        # rows added or removed since the centroids were trained on `ivf_rows_built` rows.
+        self.ivf: Optional[Dict[str, np.ndarray]] = None
+        self.ivf_rows_built = 0
+        self.ivf_drift = 0
+        self.ivf_thread: Optional[threading.Thread] = None
+        self._stamp = None  # identity of the meta.json this state was loaded from
+        if self.meta_path.exists():
+            with self.file_lock():
+                self._load()
+
+    @property
+    def meta_path(self) -> Path:
+        return self.path / "meta.json"
+
+    def _vectors_path(self, generation: int) -> Path:
+        return self.path / f"vectors.{generation}.f32"
+
+    def _payloads_path(self, generation: int) -> Path:
+        return self.path / f"payloads.{generation}.jsonl"
+
+    @property
+    def vectors_path(self) -> Path:
+        return self._vectors_path(self.generation)
+
+    @property
+    def payloads_path(self) -> Path:
+        return self._payloads_path(self.generation)
+
+    @property
+    def ivf_path(self) -> Path:
+        return self.path / "ivf.npz"
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        """Exclusive across processes; held around every write and reload."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with (self.path / "lock").open("a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _meta_stamp(self):
+        try:
+            st = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return None
+        # meta.json is only ever replaced, so a new commit means a new inode.
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def sync(self) -> None:
+        """Catch up with commits made by other processes (cheap when there are none)."""
+        if self._meta_stamp() != self._stamp:
+            with self.file_lock():
+                self.catch_up()
+
+    def catch_up(self) -> None:
+        """
+        Bring the in-memory state to the committed meta.json (file lock held).
+        Rows another process appended to the same generation are read
+        incrementally; anything else (a delete, a new generation) reloads.
+        """
+        stamp = self._meta_stamp()
+        if stamp == self._stamp or stamp is None:
+            return
+        meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        rows, payload_bytes = int(meta["rows"]), int(meta["payload_bytes"])
+        if int(meta["generation"]) == self.generation and rows >= len(self.ids) and payload_bytes >= self._payload_bytes:
+            with self.payloads_path.open("rb") as f:
+                f.seek(self._payload_bytes)
+                lines = f.read(payload_bytes - self._payload_bytes).splitlines()
+            if len(lines) == rows - len(self.ids):
+                records = [json.loads(line) for line in lines]
+                self.dim = int(meta["dim"]) if meta.get("dim") else self.dim
+                self._payload_bytes = payload_bytes
+                self._add_rows([r["id"] for r in records], [r["payload"] for r in records])
+                self._stamp = stamp
+                return
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.ids, self.payloads = [], []
+        self.doc_ids = np.empty(0, dtype=object)
+        self.dim, self.generation, self._payload_bytes = None, 0, 0
+        self._matrix = None
+        self.ivf, self.ivf_rows_built, self.ivf_drift = None, 0, 0
+
+    def _add_rows(self, ids: List[str], payloads: List[Dict[str, Any]]):
+        self._invalidate()
+        self.ids.extend(ids)
+        self.payloads.extend(payloads)
+        self.doc_ids = np.array([p.get("doc_id") for p in self.payloads], dtype=object)
+        if self.ivf is not None:
+            # Not persisted here: rows past the saved assignments are assigned on load.
+            new = _assign(self.matrix()[len(self.ids) - len(ids):], self.ivf["centroids"])
+            self.ivf["assign"] = np.concatenate([self.ivf["assign"], new])
+            self.ivf_drift += len(ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def _vector_bytes(self) -> int:
+        return len(self.ids) * (self.dim or 0) * 4
+
+    def _load(self):
+        # File lock held: the truncations below must not race another writer.
+        if not self.meta_path.exists():
+            return
+        meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        self.generation = int(meta["generation"])
+        self.dim = int(meta["dim"]) if meta.get("dim") else None
+        rows = int(meta["rows"])
+        self._payload_bytes = int(meta["payload_bytes"])
+
+        # meta.json is written last: anything past the committed lengths is the tail
+        # of an append that did not finish, and is cut off.
+        _truncate(self.payloads_path, self._payload_bytes)
+        lines: List[bytes] = []
+        if self.payloads_path.exists():
+            with self.payloads_path.open("rb") as f:
+                lines = f.read(self._payload_bytes).splitlines(keepends=True)
+        if lines and not lines[-1].endswith(b"\n"):
+            lines.pop()  # torn last line
+        records = [json.loads(line) for line in lines]
+        row_bytes = (self.dim or 0) * 4
+        _truncate(self.vectors_path, rows * row_bytes)
+        complete = min(len(records), _size(self.vectors_path) // row_bytes if row_bytes else 0)
+        if complete != rows:
+            # Committed rows are missing (e.g. files restored from an inconsistent copy):
+            # keep the complete prefix rather than misreading every row.
+            logger.error("Local vector store truncated", {"path": str(self.path), "rows": rows, "kept": complete})
+            records = records[:complete]
+            self._payload_bytes = sum(len(line) for line in lines[:complete])
+            _truncate(self.vectors_path, complete * row_bytes)
+            _truncate(self.payloads_path, self._payload_bytes)
+            self._write_meta(complete, self._payload_bytes, self.generation, self.dim)
+
+        self.ids = [r["id"] for r in records]
+        self.payloads = [r["payload"] for r in records]
+        self.doc_ids = np.array([p.get("doc_id") for p in self.payloads], dtype=object)
+        self._stamp = self._meta_stamp()
+        self._remove_stale_generations()
+        self._load_ivf()
+
+    def _load_ivf(self):
+        if not self.ivf_path.exists():
+            return
+        with np.load(self.ivf_path) as data:
+            if int(data["generation"]) != self.generation or len(data["assign"]) > len(self.ids):
+                return  # written for rows that were since rewritten; rebuilt on demand
+            centroids, assign = data["centroids"], data["assign"]
+            self.ivf_rows_built, self.ivf_drift = int(data["rows_built"]), int(data["drift"])
+        # Rows appended after the last save are assigned now.
+        tail = _assign(self.matrix()[len(assign):], centroids)
+        self.ivf = {"centroids": centroids, "assign": np.concatenate([assign, tail])}
+        self.ivf_drift += len(tail)
+
+    def _save_ivf(self):
+        tmp = self.ivf_path.with_name(self.ivf_path.name + ".tmp")
+        with tmp.open("wb") as f:
+            np.savez(
+                f,
+                centroids=self.ivf["centroids"],
+                assign=self.ivf["assign"],
+                generation=self.generation,
+                rows_built=self.ivf_rows_built,
+                drift=self.ivf_drift,
+            )
+        os.replace(tmp, self.ivf_path)
+
+    def needs_index(self, rebuild_drift: float) -> bool:
+        return self.ivf is None or self.ivf_drift > rebuild_drift * max(self.ivf_rows_built, 1)
+
+    def install_ivf(self, centroids: np.ndarray, assign: np.ndarray, generation: int) -> bool:
+        """
+        Swap in centroids trained off the request path on the first len(assign)
+        rows of `generation`. Rows appended meanwhile are assigned here; if a
+        delete rewrote the rows since, the result is discarded.
+        """
+        if generation != self.generation:
+            return False
+        tail = _assign(self.matrix()[len(assign):], centroids)
+        self.ivf = {"centroids": centroids, "assign": np.concatenate([assign, tail])}
+        self.ivf_rows_built, self.ivf_drift = len(assign), len(tail)
+        self._save_ivf()
+        return True
+
+    def _write_meta(self, rows: int, payload_bytes: int, generation: int, dim: Optional[int]):
+        meta = {"generation": generation, "dim": dim, "rows": rows, "payload_bytes": payload_bytes}
+        _atomic_write(self.meta_path, json.dumps(meta).encode("utf-8"))
+        self._stamp = self._meta_stamp()
+
+    def _remove_stale_generations(self):
+        # Files of other generations are left over from a delete that was interrupted
+        # (before or after its switch), or could not be removed while still mapped.
+        keep = {self.vectors_path.name, self.payloads_path.name}
+        for f in list(self.path.glob("vectors.*.f32")) + list(self.path.glob("payloads.*.jsonl")):
+            if f.name not in keep:
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            if not self.ids:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+        return self._matrix
+
+    def _invalidate(self):
+        self._matrix = None
+
+    def append(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]) -> List[str]:
+        """
+        Appends rows to both files, then commits them by rewriting meta.json
+        (temp file + rename). A crash before the commit leaves only an
+        uncommitted tail, which the next append or load cuts off.
+        Called with the file lock held and the state caught up (see catch_up).
+        """
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector size {vectors.shape[1]} does not match stored size {self.dim}")
+        self.path.mkdir(parents=True, exist_ok=True)
+        ids = [str(uuid.uuid4()) for _ in payloads]
+        lines = "".join(
+            json.dumps({"id": i, "payload": p}, ensure_ascii=False) + "\n" for i, p in zip(ids, payloads)
+        ).encode("utf-8")
+
+        self._invalidate()
+        _append(self.vectors_path, self._vector_bytes, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        _append(self.payloads_path, self._payload_bytes, lines)
+        self._write_meta(
+            rows=len(self.ids) + len(ids),
+            payload_bytes=self._payload_bytes + len(lines),
+            generation=self.generation,
+            dim=vectors.shape[1],
+        )
+
+        self.dim = vectors.shape[1]
+        self._payload_bytes += len(lines)
+        self._add_rows(ids, payloads)
+        return ids
+
+    def remove(self, keep: np.ndarray) -> int:
+        """
+        Writes the kept rows as a new generation of both files and switches to it
+        by rewriting meta.json; until then the current generation stays intact.
+        Called with the file lock held and the state caught up (see catch_up).
+        """
+        removed = int(len(keep) - keep.sum())
+        if removed == 0:
+            return 0
+
+        kept = np.array(self.matrix()[keep])
+        ids = [i for i, k in zip(self.ids, keep) if k]
+        payloads = [p for p, k in zip(self.payloads, keep) if k]
+        lines = "".join(
+            json.dumps({"id": i, "payload": p}, ensure_ascii=False) + "\n" for i, p in zip(ids, payloads)
+        ).encode("utf-8")
+
+        old = (self.vectors_path, self.payloads_path)
+        generation = self.generation + 1
+        _write_synced(self._vectors_path(generation), kept.tobytes())
+        _write_synced(self._payloads_path(generation), lines)
+        self._invalidate()
+        self._write_meta(rows=len(ids), payload_bytes=len(lines), generation=generation, dim=self.dim)
+
+        self.generation = generation
+        self._payload_bytes = len(lines)
+        self.ids, self.payloads = ids, payloads
+        self.doc_ids = np.array([p.get("doc_id") for p in self.payloads], dtype=object)
+        if self.ivf is not None:
+            self.ivf["assign"] = self.ivf["assign"][keep]
+            self.ivf_drift += removed
+            self._save_ivf()
+        for f in old:
+            try:
+                f.unlink()
+            except OSError:
+                pass  # still mapped elsewhere (Windows); removed on the next load
+        return removed
+
+
+class LocalVectorStore:
+    def __init__(
+        self,
+        path: str,
+        ann_threshold: int = 20_000,
+        nprobe: int = 8,
+        ivf_rebuild_drift: float = 0.2,  # retrain centroids once this share of rows changed
+    ):
+        self.root = Path(path).resolve()
+        self.ann_threshold = max(1, int(ann_threshold))
+        self.nprobe = max(1, int(nprobe))
+        self.ivf_rebuild_drift = float(ivf_rebuild_drift)
+        self._tenants: Dict[str, _Tenant] = {}
+        self._lock = threading.Lock()
+
+    def _tenant(self, user_id: str) -> _Tenant:
+        with self._lock:
+            t = self._tenants.get(user_id)
+            if t is None:
+                key = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+                t = _Tenant(self.root / key)
+                self._tenants[user_id] = t
+            return t
+
+    def _schedule_index(self, t: _Tenant) -> None:
+        # Called with t.lock held; at most one build per tenant.
+        if t.ivf_thread is not None and t.ivf_thread.is_alive():
+            return
+        t.ivf_thread = threading.Thread(target=self._build_index, args=(t,), name="local-ivf-build", daemon=True)
+        t.ivf_thread.start()
+
+    def _build_index(self, t: _Tenant) -> bool:
+        # k-means and the bulk assignment run without the tenant lock: within a
+        # generation rows are append-only, so the snapshot stays valid.
+        try:
+            with t.lock:
+                generation, x = t.generation, t.matrix()
+            if not len(x):
+                return False
+            centroids = _kmeans(x, nlist=int(np.sqrt(len(x))))
+            assign = _assign(x, centroids)
+            with t.lock:
+                return t.install_ivf(centroids, assign, generation)
+        except Exception as e:
+            logger.error("Local IVF build failed", {"path": str(t.path), "err": repr(e)})
+            return False
+
+    def build_index(self, user_id: str) -> bool:
+        """(Re)train the user's IVF index now, in the calling thread."""
+        return self._build_index(self._tenant(user_id))
+
+    @staticmethod
+    def _normalise(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    # QdrantStore compatibility: nothing to bootstrap for files on disk.
+    def bootstrap(self, vector_size: Optional[int] = None) -> bool:
+        self.root.mkdir(parents=True, exist_ok=True)
+        return True
+
+    def ensure_collection(self, vector_size: int):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def upsert(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]) -> int:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return 0
+        if len(vectors) != len(payloads):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(payloads)} payloads")
+
+        by_user: Dict[str, List[int]] = {}
+        for i, p in enumerate(payloads):
+            by_user.setdefault(p["user_id"], []).append(i)
+
+        vectors = self._normalise(vectors)
+        for user_id, rows in by_user.items():
+            t = self._tenant(user_id)
+            with t.lock, t.file_lock():
+                t.catch_up()
+                t.append(vectors[rows], [payloads[i] for i in rows])
+        return len(payloads)
+
+    def search(self, query_vector, user_id: str, doc_ids, top_k: int) -> List[LocalHit]:
+        if query_vector is None or len(query_vector) == 0:
+            return []
+
+        t = self._tenant(user_id)
+        with t.lock:
+            t.sync()
+            if not len(t):
+                return []
+            q = self._normalise(query_vector)
+            x = t.matrix()
+
+            rows: Optional[np.ndarray] = None
+            if doc_ids:
+                rows = np.flatnonzero(np.isin(t.doc_ids, list(doc_ids)))
+                if not len(rows):
+                    return []
+
+            n = len(x) if rows is None else len(rows)
+            if n > self.ann_threshold and t.needs_index(self.ivf_rebuild_drift):
+                # Trained in the background; until then the current index (or exact search) serves.
+                self._schedule_index(t)
+            if n > self.ann_threshold and t.ivf is not None:
+                scores_c = t.ivf["centroids"] @ q
+                probe = np.argpartition(-scores_c, min(self.nprobe, len(scores_c)) - 1)[: self.nprobe]
+                candidates = np.flatnonzero(np.isin(t.ivf["assign"], probe))
+                rows = candidates if rows is None else np.intersect1d(rows, candidates, assume_unique=True)
+
+            if rows is None:
+                scores = x @ q
+                rows = np.arange(len(x))
+            else:
+                scores = np.asarray(x[rows]) @ q
+
+            k = min(top_k, len(scores))
+            if k <= 0:
+                return []
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            return [
+                LocalHit(id=t.ids[rows[i]], score=float(scores[i]), payload=t.payloads[rows[i]])
+                for i in best
+            ]
+
+    def delete_docs(self, user_id: str, doc_ids: Iterable[str]):
+        doc_ids = list(doc_ids or [])
+        if not doc_ids:
+            return
+        t = self._tenant(user_id)
+        with t.lock, t.file_lock():
+            t.catch_up()
+            if len(t):
+                t.remove(~np.isin(t.doc_ids, doc_ids))
+
+    def delete_doc(self, user_id: str, doc_id: str):
+        self.delete_docs(user_id=user_id, doc_ids=[doc_id])
+
+    # Async interface (matches QdrantStore): file I/O and numpy run in a worker thread.
+    async def aensure_collection(self, vector_size: int):
+        self.ensure_collection(vector_size)
+
+    async def aupsert(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]) -> int:
+        return await asyncio.to_thread(self.upsert, vectors, payloads)
+
+    async def asearch(self, query_vector, user_id: str, doc_ids, top_k: int) -> List[LocalHit]:
+        return await asyncio.to_thread(self.search, query_vector, user_id, doc_ids, top_k)
+
+    async def adelete_docs(self, user_id: str, doc_ids: Iterable[str]):
+        await asyncio.to_thread(self.delete_docs, user_id, doc_ids)
+
+    async def adelete_doc(self, user_id: str, doc_id: str):
+        await self.adelete_docs(user_id=user_id, doc_ids=[doc_id])
+
+    def close(self) -> None:
+        with self._lock:
+            self._tenants.clear()
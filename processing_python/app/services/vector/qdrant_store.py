@@ -1,95 +1,535 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import threading
 import uuid
 
-from qdrant_client import QdrantClient
+import httpx
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models as qm
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+from app.core.resilience import CallPolicy
+from app.services.vector.hot_cache import HotDoc, HotDocCache, make_hot_doc
+
+
+def _is_collection_missing(exc: Exception) -> bool:
+    # REST -> 404, gRPC -> NOT_FOUND, local/embedded mode -> ValueError("... not found")
+    if isinstance(exc, UnexpectedResponse):
+        return exc.status_code == 404
+    code = getattr(exc, "code", None)
+    if callable(code):
+        try:
+            return getattr(code(), "name", "") == "NOT_FOUND"
+        except Exception:
+            return False
+    msg = str(exc).lower()
+    return "collection" in msg and ("not found" in msg or "doesn't exist" in msg)
+
+
+# Points of users without a dedicated shard key live here (custom sharding only).
+DEFAULT_SHARD_KEY = "default"
 
 
 class QdrantStore:
-    def __init__(self, url: str, api_key: str, collection: str):
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        collection: str,
+        upsert_batch_size: int = 128,
+        upsert_parallel: int = 4,
+        upsert_wait: bool = True,   # False: don't wait for indexing (barrier batches still wait)
+        upsert_barrier: bool = True,
+        quantization: Optional[str] = None,  # None | "scalar" | "binary"
+        on_disk: bool = False,
+        rescore: bool = True,
+        oversampling: Optional[float] = None,
+        prefer_grpc: bool = False,
+        grpc_port: int = 6334,
+        limits: Optional[httpx.Limits] = None,  # REST keep-alive pool
+        tenant_layout: bool = True,
+        hnsw_payload_m: int = 16,
+        tenant_shard_users: Optional[Iterable[str]] = None,
+        policy: Optional[CallPolicy] = None,  # deadlines / hedging / breaker for the async calls
+        timeout: Optional[float] = None,      # seconds per call
+        search_hedge_after: Optional[float] = None,  # seconds; searches are idempotent, writes are not hedged
+        hot_cache: Optional[HotDocCache] = None,     # pinned vectors for scoped (doc_ids) searches
+        hot_doc_max_points: int = 20000,             # larger documents are always searched remotely
+    ):
         self.collection = collection
-        self.client = QdrantClient(url=url, api_key=(api_key or None))
+        self.policy = policy
+        self.call_timeout = timeout
+        self.search_hedge_after = search_hedge_after
+        self.hot_cache = hot_cache
+        self.hot_doc_max_points = int(hot_doc_max_points)
+        self._hot_loads: Dict[Any, asyncio.Task] = {}
+        client_kwargs: Dict[str, Any] = {}
+        if limits is not None:
+            client_kwargs["limits"] = limits
+        # Blocking client: startup bootstrap and admin scripts only.
+        self.client = QdrantClient(
+            url=url,
+            api_key=(api_key or None),
+            prefer_grpc=prefer_grpc,
+            grpc_port=grpc_port,
+            **client_kwargs,
+        )
+        # Every upsert / search / delete goes through the async client (a-prefixed methods).
+        self.aclient = AsyncQdrantClient(
+            url=url,
+            api_key=(api_key or None),
+            prefer_grpc=prefer_grpc,
+            grpc_port=grpc_port,
+            **client_kwargs,
+        )
+        self.upsert_batch_size = max(1, int(upsert_batch_size or 1))
+        self.upsert_parallel = max(1, int(upsert_parallel or 1))
+        self.upsert_wait = bool(upsert_wait)
+        self.upsert_barrier = bool(upsert_barrier)
+        self.quantization = (quantization or "none").lower().strip()
+        if self.quantization not in ("none", "scalar", "binary"):
+            raise ValueError(f"Unknown Qdrant quantization: {quantization!r}")
+        self.on_disk = bool(on_disk)
+        self.rescore = bool(rescore)
+        self.oversampling = oversampling
 
-    def ensure_collection(self, vector_size: int):
-        existing = {c.name for c in self.client.get_collections().collections}
-        if self.collection in existing:
-            return
+        # Multi-tenancy: user_id is the tenant key; HNSW graphs are built per tenant
+        # (payload_m) instead of one global graph (m=0), so user-filtered search stays
+        # fast as users are added. Listed users get their own shard key.
+        self.tenant_layout = bool(tenant_layout)
+        self.hnsw_payload_m = int(hnsw_payload_m)
+        self.tenant_shard_users = {u for u in (tenant_shard_users or []) if u}
 
-        self.client.create_collection(
-            collection_name=self.collection,
-            vectors_config=qm.VectorParams(size=vector_size, distance=qm.Distance.COSINE),
+        # "Known good" collection state, so hot paths skip the existence check.
+        self._collection_ready = False
+        self._collection_lock = threading.Lock()
+        self._acollection_lock = asyncio.Lock()
+
+    def _quantization_config(self):
+        if self.quantization == "scalar":
+            return qm.ScalarQuantization(
+                scalar=qm.ScalarQuantizationConfig(type=qm.ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if self.quantization == "binary":
+            return qm.BinaryQuantization(binary=qm.BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def _search_params(self):
+        # Only meaningful for quantised collections: search the compact in-RAM vectors,
+        # then rescore the oversampled candidates with the (possibly on-disk) originals.
+        if self.quantization == "none":
+            return None
+        return qm.SearchParams(
+            quantization=qm.QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
         )
 
-        # Speed up filtered retrieval
-        self.client.create_payload_index(
-            collection_name=self.collection,
-            field_name="user_id",
-            field_schema=qm.PayloadSchemaType.KEYWORD,
+    @property
+    def sharded(self) -> bool:
+        return bool(self.tenant_shard_users)
+
+    def shard_key(self, user_id: str) -> Optional[str]:
+        if not self.sharded:
+            return None
+        return user_id if user_id in self.tenant_shard_users else DEFAULT_SHARD_KEY
+
+    def _hnsw_config(self) -> Optional[qm.HnswConfigDiff]:
+        if not self.tenant_layout:
+            return None
+        return qm.HnswConfigDiff(payload_m=self.hnsw_payload_m, m=0)
+
+    def _payload_index_schemas(self) -> Dict[str, Any]:
+        return {
+            "user_id": (
+                qm.KeywordIndexParams(type=qm.KeywordIndexType.KEYWORD, is_tenant=True)
+                if self.tenant_layout
+                else qm.PayloadSchemaType.KEYWORD
+            ),
+            "doc_id": qm.PayloadSchemaType.KEYWORD,
+            "page": qm.PayloadSchemaType.INTEGER,
+            "chunk_index": qm.PayloadSchemaType.INTEGER,
+        }
+
+    def _ensure_payload_indexes(self, existing: Iterable[str] = ()):
+        # Speed up filtered retrieval; only missing indexes are created.
+        existing = set(existing)
+        for field, schema in self._payload_index_schemas().items():
+            if field in existing:
+                continue
+            self.client.create_payload_index(
+                collection_name=self.collection,
+                field_name=field,
+                field_schema=schema,
+            )
+
+    async def _aensure_payload_indexes(self):
+        await asyncio.gather(
+            *(
+                self.aclient.create_payload_index(
+                    collection_name=self.collection,
+                    field_name=field,
+                    field_schema=schema,
+                )
+                for field, schema in self._payload_index_schemas().items()
+            )
         )
-        self.client.create_payload_index(
+
+    def bootstrap(self, vector_size: Optional[int] = None) -> bool:
+        """
+        One-time startup check: make sure the collection and its payload indexes exist.
+        Without a known vector size a missing collection is created on first upsert.
+        Returns True when the collection is ready.
+        """
+        with self._collection_lock:
+            if self.client.collection_exists(self.collection):
+                info = self.client.get_collection(self.collection)
+                self._ensure_payload_indexes(existing=(info.payload_schema or {}).keys())
+                self._collection_ready = True
+            elif vector_size:
+                self._create_collection(vector_size)
+        return self._collection_ready
+
+    def _create_collection(self, vector_size: int):
+        self.client.create_collection(**self._create_collection_kwargs(vector_size))
+        if self.sharded:
+            for key in [DEFAULT_SHARD_KEY, *sorted(self.tenant_shard_users)]:
+                self.client.create_shard_key(collection_name=self.collection, shard_key=key)
+        self._ensure_payload_indexes()
+        self._collection_ready = True
+
+    def _create_collection_kwargs(self, vector_size: int) -> Dict[str, Any]:
+        return dict(
             collection_name=self.collection,
-            field_name="doc_id",
-            field_schema=qm.PayloadSchemaType.KEYWORD,
+            vectors_config=qm.VectorParams(size=vector_size, distance=qm.Distance.COSINE, on_disk=self.on_disk),
+            quantization_config=self._quantization_config(),
+            hnsw_config=self._hnsw_config(),
+            sharding_method=qm.ShardingMethod.CUSTOM if self.sharded else None,
         )
 
-    def upsert(self, vectors: List[List[float]], payloads: List[Dict[str, Any]]) -> int:
-        if not vectors:
-            return 0
-        self.ensure_collection(vector_size=len(vectors[0]))
+    async def _acreate_collection(self, vector_size: int):
+        await self.aclient.create_collection(**self._create_collection_kwargs(vector_size))
+        if self.sharded:
+            for key in [DEFAULT_SHARD_KEY, *sorted(self.tenant_shard_users)]:
+                await self.aclient.create_shard_key(collection_name=self.collection, shard_key=key)
+        await self._aensure_payload_indexes()
+        self._collection_ready = True
+
+    def migrate_tenant_layout(self, rebuild_tenant_index: bool = False) -> Dict[str, Any]:
+        """
+        Bring an existing collection to the tenant-optimised layout in place:
+        per-tenant HNSW, user_id as tenant index, page/chunk_index indexes.
+        (Switching to custom sharding needs a copy; see scripts/migrate_qdrant_tenancy.py.)
+
+        A plain user_id index can't be flagged as tenant index in place: it has to be
+        dropped and re-created, and user-filtered searches run unindexed in between.
+        That only happens with rebuild_tenant_index=True (maintenance window);
+        otherwise the report marks it as "needs_rebuild".
+        """
+        report: Dict[str, Any] = {"collection": self.collection, "hnsw": None, "indexes": [], "user_id_index": "ok"}
+
+        hnsw = self._hnsw_config()
+        if hnsw is not None:
+            self.client.update_collection(collection_name=self.collection, hnsw_config=hnsw)
+            report["hnsw"] = hnsw.model_dump(exclude_none=True)
+
+        info = self.client.get_collection(self.collection)
+        schema = dict(info.payload_schema or {})
+
+        user_idx = schema.get("user_id")
+        is_tenant = bool(getattr(getattr(user_idx, "params", None), "is_tenant", False))
+        if user_idx is not None and self.tenant_layout and not is_tenant:
+            if rebuild_tenant_index:
+                self.client.delete_payload_index(collection_name=self.collection, field_name="user_id")
+                schema.pop("user_id")
+                report["user_id_index"] = "rebuilt"
+            else:
+                report["user_id_index"] = "needs_rebuild"
 
+        missing = [f for f in self._payload_index_schemas() if f not in schema]
+        self._ensure_payload_indexes(existing=schema.keys())
+        report["indexes"] = missing
+        self._collection_ready = True
+        return report
+
+    def ensure_collection(self, vector_size: int):
+        if self._collection_ready:
+            return
+
+        with self._collection_lock:
+            if self._collection_ready:
+                return
+            if self.client.collection_exists(self.collection):
+                self._collection_ready = True
+                return
+            self._create_collection(vector_size)
+
+    async def aensure_collection(self, vector_size: int):
+        if self._collection_ready:
+            return
+
+        async with self._acollection_lock:
+            if self._collection_ready:
+                return
+            if await self._call("collection_exists", lambda: self.aclient.collection_exists(self.collection)):
+                self._collection_ready = True
+                return
+            await self._acreate_collection(vector_size)
+
+    async def _awith_collection(self, op: Callable[[], Awaitable[Any]], vector_size: int):
+        """
+        Run op against the (assumed) existing collection. If Qdrant reports the
+        collection as missing (e.g. dropped after startup), forget the cached
+        state, re-create it and retry once.
+        """
+        try:
+            return await op()
+        except Exception as e:
+            if not _is_collection_missing(e):
+                raise
+            self._collection_ready = False
+            await self.aensure_collection(vector_size=vector_size)
+            return await op()
+
+    def _upsert_kwargs(
+        self,
+        vectors: np.ndarray,
+        payloads: List[Dict[str, Any]],
+        rows: List[int],
+        shard_key: Optional[str],
+        wait: bool,
+    ) -> Dict[str, Any]:
+        # Points are built per batch so only in-flight batches are held in memory;
+        # the float32 rows are converted to the wire format here and nowhere earlier.
         points = [
-            qm.PointStruct(id=str(uuid.uuid4()), vector=v, payload=p)
-            for v, p in zip(vectors, payloads)
+            qm.PointStruct(id=str(uuid.uuid4()), vector=vectors[i].tolist(), payload=payloads[i])
+            for i in rows
         ]
-        self.client.upsert(collection_name=self.collection, points=points)
-        return len(points)
+        return dict(
+            collection_name=self.collection,
+            points=points,
+            wait=wait,
+            shard_key_selector=shard_key,
+        )
 
-    def search(self, query_vector, user_id: str, doc_ids, top_k: int):
-        # If embedding fails or returns empty, avoid crashing
-        if not query_vector:
-            return []
+    async def _call(self, op: str, fn: Callable[[], Awaitable[Any]], hedge_after: Optional[float] = None):
+        if self.policy is None:
+            return await fn()
+        # A missing collection is an answer, not an outage; _awith_collection handles it.
+        return await self.policy.call(
+            op, fn, timeout=self.call_timeout, hedge_after=hedge_after, answered=_is_collection_missing
+        )
 
-        # ✅ Ensure collection exists even if user chats before indexing
-        # Use query vector length as vector_size for creation (works on first call)
+    async def _aupsert_batch(
+        self,
+        vectors: np.ndarray,
+        payloads: List[Dict[str, Any]],
+        rows: List[int],
+        shard_key: Optional[str],
+        wait: bool,
+    ) -> int:
+        kwargs = self._upsert_kwargs(vectors, payloads, rows, shard_key, wait)
+        await self._call("upsert", lambda: self.aclient.upsert(**kwargs))
+        return len(rows)
+
+    def _check_upsert(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) != len(payloads):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(payloads)} payloads")
+        return vectors
+
+    async def aupsert(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]) -> int:
+        if len(vectors) == 0:
+            return 0
+        vectors = self._check_upsert(vectors, payloads)
+        await self.aensure_collection(vector_size=len(vectors[0]))
         try:
-            self.ensure_collection(vector_size=len(query_vector))
-        except Exception:
-            # If Qdrant is down/misconfigured, don't crash chat endpoint
-            return []
+            return await self._awith_collection(
+                lambda: self._aupsert_batches(vectors, payloads), vector_size=len(vectors[0])
+            )
+        finally:
+            # After the write (even a partial one): loads that raced it are discarded.
+            self._invalidate_hot(payloads)
+
+    def _batch_plan(self, payloads: List[Dict[str, Any]]):
+        """
+        Split the rows into (rows, shard_key) batches, each for one shard key.
+        Returns (batches, barriers). With wait=False, Qdrant applies a shard's queued
+        updates in order, so the last batch of every shard key, sent with wait=True
+        once all other batches are acknowledged, is that shard key's barrier.
+        """
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, p in enumerate(payloads):
+            groups.setdefault(self.shard_key(p["user_id"]), []).append(i)
+
+        batches: List[Tuple[List[int], Optional[str]]] = []
+        barriers: List[Tuple[List[int], Optional[str]]] = []
+        for key, rows in groups.items():
+            chunks = [
+                (rows[start : start + self.upsert_batch_size], key)
+                for start in range(0, len(rows), self.upsert_batch_size)
+            ]
+            if not self.upsert_wait and self.upsert_barrier:
+                barriers.append(chunks.pop())
+            batches.extend(chunks)
+        return batches, barriers
+
+    async def _aupsert_batches(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]) -> int:
+        batches, barriers = self._batch_plan(payloads)
+        sem = asyncio.Semaphore(self.upsert_parallel)
+
+        async def _one(rows: List[int], shard_key: Optional[str], wait: bool) -> int:
+            async with sem:
+                return await self._aupsert_batch(vectors, payloads, rows, shard_key, wait)
 
+        count = sum(await asyncio.gather(*(_one(rows, key, self.upsert_wait) for rows, key in batches)))
+        count += sum(await asyncio.gather(*(_one(rows, key, True) for rows, key in barriers)))
+        return count
+
+    @staticmethod
+    def _filter(user_id: str, doc_ids: Optional[Iterable[str]]) -> qm.Filter:
         must = [qm.FieldCondition(key="user_id", match=qm.MatchValue(value=user_id))]
         if doc_ids:
-            must.append(qm.FieldCondition(key="doc_id", match=qm.MatchAny(any=doc_ids)))
-        flt = qm.Filter(must=must)
+            must.append(qm.FieldCondition(key="doc_id", match=qm.MatchAny(any=list(doc_ids))))
+        return qm.Filter(must=must)
 
-        # Newer clients: query_points()
-        if hasattr(self.client, "query_points"):
-            res = self.client.query_points(
-                collection_name=self.collection,
-                query=query_vector,
-                query_filter=flt,
-                limit=top_k,
-                with_payload=True,
-            )
-            return getattr(res, "points", getattr(res, "result", res))
-
-        # Older clients: search()
-        return self.client.search(
+    def _query_kwargs(self, query_vector, user_id: str, doc_ids, top_k: int) -> Dict[str, Any]:
+        return dict(
             collection_name=self.collection,
-            query_vector=query_vector,
+            query=query_vector,
+            query_filter=self._filter(user_id, doc_ids),
             limit=top_k,
             with_payload=True,
-            query_filter=flt,
+            search_params=self._search_params(),
+            shard_key_selector=self.shard_key(user_id),
         )
 
-        
-    def delete_doc(self, user_id: str, doc_id: str):
-        flt = qm.Filter(
-            must=[
-                qm.FieldCondition(key="user_id", match=qm.MatchValue(value=user_id)),
-                qm.FieldCondition(key="doc_id", match=qm.MatchValue(value=doc_id)),
-            ]
-        )
-        self.client.delete(collection_name=self.collection, points_selector=qm.FilterSelector(filter=flt))
+    async def asearch(self, query_vector, user_id: str, doc_ids, top_k: int):
+        if query_vector is None or len(query_vector) == 0:
+            return []
+
+        if self.hot_cache is not None and self.hot_cache.covers(doc_ids):
+            hits = await self._ahot_search(query_vector, user_id, doc_ids, top_k)
+            if hits is not None:
+                return hits
+
+        # Failures propagate: the RAG pipeline decides whether to degrade to lexical.
+        await self.aensure_collection(vector_size=len(query_vector))
+
+        kwargs = self._query_kwargs(query_vector, user_id, doc_ids, top_k)
+
+        async def _query():
+            res = await self._call("search", lambda: self.aclient.query_points(**kwargs), self.search_hedge_after)
+            return getattr(res, "points", getattr(res, "result", res))
+
+        return await self._awith_collection(_query, vector_size=len(query_vector))
+
+    # -----------------------------
+    # Hot-document cache
+    # -----------------------------
+
+    def _invalidate_hot(self, payloads: List[Dict[str, Any]]):
+        if self.hot_cache is None:
+            return
+        by_user: Dict[str, set] = {}
+        for p in payloads:
+            by_user.setdefault(p["user_id"], set()).add(p.get("doc_id"))
+        for user_id, doc_ids in by_user.items():
+            self.hot_cache.invalidate(user_id, doc_ids)
+
+    async def _ahot_search(self, query_vector, user_id: str, doc_ids, top_k: int):
+        """In-memory search over pinned documents; None when one is too large to pin."""
+        generation = self.hot_cache.generation(user_id)
+        found, missing = self.hot_cache.get_many(user_id, doc_ids)
+        if missing:
+            loaded = await asyncio.gather(*(self._ahot_doc(user_id, d, generation) for d in missing))
+            if any(entry is None for entry in loaded):
+                return None
+            found.update(zip(missing, loaded))
+        return HotDocCache.search(found.values(), query_vector, top_k)
+
+    async def _ahot_doc(self, user_id: str, doc_id: str, generation: int) -> Optional[HotDoc]:
+        # Concurrent questions about the same document share one load.
+        key = (user_id, doc_id, generation)
+        task = self._hot_loads.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._aload_hot_doc(user_id, doc_id, generation))
+            self._hot_loads[key] = task
+            task.add_done_callback(lambda _t: self._hot_loads.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _aload_hot_doc(self, user_id: str, doc_id: str, generation: int) -> Optional[HotDoc]:
+        ids: List[str] = []
+        vectors: List[Any] = []
+        payloads: List[Dict[str, Any]] = []
+        offset = None
+        flt = self._filter(user_id, [doc_id])
+        while True:
+            try:
+                points, offset = await self._call(
+                    "scroll",
+                    lambda: self.aclient.scroll(
+                        collection_name=self.collection,
+                        scroll_filter=flt,
+                        limit=512,
+                        offset=offset,
+                        with_payload=True,
+                        with_vectors=True,
+                        shard_key_selector=self.shard_key(user_id),
+                    ),
+                    self.search_hedge_after,
+                )
+            except Exception as e:
+                if not _is_collection_missing(e):
+                    raise
+                self._collection_ready = False
+                points, offset = [], None
+            for pt in points:
+                ids.append(str(pt.id))
+                vectors.append(pt.vector)
+                payloads.append(pt.payload or {})
+            if len(ids) > self.hot_doc_max_points:
+                return None
+            if offset is None:
+                break
+
+        entry = make_hot_doc(ids, vectors, payloads)
+        # Nothing found is not pinned: the document may be mid-indexing, possibly by
+        # another worker whose invalidation never reaches this cache.
+        if ids:
+            self.hot_cache.put(user_id, doc_id, entry, generation)
+        return entry
+
+    async def _adelete(self, flt: qm.Filter, user_id: str):
+        try:
+            await self._call(
+                "delete",
+                lambda: self.aclient.delete(
+                    collection_name=self.collection,
+                    points_selector=qm.FilterSelector(filter=flt),
+                    shard_key_selector=self.shard_key(user_id),
+                ),
+            )
+        except Exception as e:
+            if not _is_collection_missing(e):
+                raise
+            self._collection_ready = False
+
+    async def adelete_doc(self, user_id: str, doc_id: str):
+        await self.adelete_docs(user_id, [doc_id])
+
+    async def adelete_docs(self, user_id: str, doc_ids: List[str]):
+        if not doc_ids:
+            return
+        try:
+            await self._adelete(self._filter(user_id, doc_ids), user_id)
+        finally:
+            if self.hot_cache is not None:
+                self.hot_cache.invalidate(user_id, doc_ids)
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        await self.aclient.close()
@@ -0,0 +1,87 @@
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv(ROOT / ".env")
+
+import argparse
+import json
+
+from qdrant_client.http import models as qm
+
+from app.core import config
+from app.core.clients import build_qdrant_store
+from app.services.lexical.fts_store import FtsStore
+
+
+def list_users(store, batch: int) -> list:
+    """Distinct user_ids found in the collection's payloads."""
+    users = set()
+    offset = None
+    while True:
+        records, offset = store.client.scroll(
+            collection_name=store.collection,
+            limit=batch,
+            offset=offset,
+            with_payload=["user_id"],
+            with_vectors=False,
+        )
+        users.update((r.payload or {}).get("user_id") for r in records)
+        if offset is None:
+            users.discard(None)
+            return sorted(users)
+
+
+def user_payloads(store, user_id: str, batch: int) -> list:
+    flt = qm.Filter(must=[qm.FieldCondition(key="user_id", match=qm.MatchValue(value=user_id))])
+    payloads = []
+    offset = None
+    while True:
+        records, offset = store.client.scroll(
+            collection_name=store.collection,
+            scroll_filter=flt,
+            limit=batch,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+            shard_key_selector=store.shard_key(user_id),
+        )
+        payloads.extend(r.payload for r in records if r.payload and r.payload.get("doc_id"))
+        if offset is None:
+            return payloads
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Rebuild the keyword (BM25) index from the chunk payloads stored in Qdrant. "
+                    "Run it on the host that serves the API, against the same LEXICAL_DB_PATH."
+    )
+    ap.add_argument("--collection", default=None, help="Collection to read (default: QDRANT_COLLECTION)")
+    ap.add_argument("--db", default=None, help="Index file to fill (default: LEXICAL_DB_PATH)")
+    ap.add_argument("--user", action="append", default=None,
+                    help="Only rebuild these users (repeatable; default: every user in the collection)")
+    ap.add_argument("--batch", type=int, default=256)
+    args = ap.parse_args()
+
+    store = build_qdrant_store()
+    if args.collection:
+        store.collection = args.collection
+    fts = FtsStore(path=args.db or config.LEXICAL_DB_PATH)
+
+    users = args.user or list_users(store, batch=args.batch)
+    report = {}
+    try:
+        for user_id in users:
+            # Each user is swapped in one transaction, so the API can keep serving meanwhile.
+            report[user_id] = fts.replace_user(user_id, user_payloads(store, user_id, batch=args.batch))
+            print(f"{user_id}: {report[user_id]} chunks")
+    finally:
+        fts.close()
+    print(json.dumps({"users": len(report), "chunks": sum(report.values())}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
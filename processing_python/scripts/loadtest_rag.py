@@ -0,0 +1,210 @@
+"""
+End-to-end load test for /internal/index/upsert_ocr and /internal/chat/ask.
+
+By default the app runs in process with the offline backends (LLM_BACKEND=fake,
+VECTOR_BACKEND=local, lexical index in a temp dir), so no quota or network is
+needed. Use --url to drive a running service instead.
+
+    python scripts/loadtest_rag.py --concurrency 1,8,32 --requests 200 --out run.json
+    python scripts/loadtest_rag.py --url http://localhost:8000 --token $INTERNAL_TOKEN
+
+Reports p50/p95/p99 latency (ms), throughput (req/s) and errors per phase and
+concurrency level, as JSON. All levels ask the same questions, so only the
+first level is cold unless --no-cache is given.
+"""
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List
+
+import httpx
+import numpy as np
+
+
+VOCAB = (
+    "invoice contract payment total amount due date customer supplier order "
+    "delivery address tax rate account balance report summary policy clause "
+    "term renewal notice period signature approval budget project quarter"
+).split()
+
+
+def synthetic_doc(rng: random.Random, doc_no: int, pages: int, words_per_page: int) -> Dict[str, Any]:
+    # Every document carries a unique code, so questions have a findable answer.
+    code = f"REF-{doc_no:05d}"
+    out = []
+    for p in range(1, pages + 1):
+        words = [rng.choice(VOCAB) for _ in range(words_per_page)]
+        words.insert(rng.randrange(len(words)), f"{code} total {rng.randint(100, 99999)}")
+        out.append({"page_number": p, "text": " ".join(words)})
+    return {"doc_id": f"doc-{doc_no}", "title": f"Document {doc_no}", "pages": out, "code": code}
+
+
+def question_for(rng: random.Random, doc: Dict[str, Any]) -> str:
+    return f"What is the {rng.choice(VOCAB)} total for {doc['code']}?"
+
+
+def summarise(latencies: List[float], errors: int, wall: float, concurrency: int) -> Dict[str, Any]:
+    lat = np.asarray(latencies, dtype=np.float64) * 1000.0
+    done = len(latencies)
+    stats = {
+        "concurrency": concurrency,
+        "requests": done + errors,
+        "ok": done,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(done / wall, 2) if wall > 0 else None,
+    }
+    if done:
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        stats.update(
+            p50_ms=round(float(p50), 2),
+            p95_ms=round(float(p95), 2),
+            p99_ms=round(float(p99), 2),
+            mean_ms=round(float(lat.mean()), 2),
+            max_ms=round(float(lat.max()), 2),
+        )
+    return stats
+
+
+async def run_level(
+    concurrency: int,
+    total: int,
+    make_request: Callable[[int], Any],
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                r = await make_request(i)
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - t0)
+            except Exception:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarise(latencies, errors, time.perf_counter() - t0, concurrency)
+
+
+@asynccontextmanager
+async def http_client(args):
+    if args.url:
+        limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            yield client
+        return
+
+    # In process: offline backends in a throwaway directory. Env must be set
+    # before app.core.config is imported.
+    tmp = tempfile.mkdtemp(prefix="rag-loadtest-")
+    os.environ.setdefault("LLM_BACKEND", "fake")
+    os.environ.setdefault("VECTOR_BACKEND", "local")
+    os.environ.setdefault("LOCAL_VECTOR_DIR", os.path.join(tmp, "vectors"))
+    os.environ.setdefault("LEXICAL_DB_PATH", os.path.join(tmp, "lexical.sqlite"))
+    os.environ.setdefault("INTERNAL_TOKEN", args.token)
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            yield client
+
+
+async def main_async(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    docs = [synthetic_doc(rng, i, args.pages, args.words_per_page) for i in range(args.docs)]
+    users = [f"loadtest-user-{u}" for u in range(args.users)]
+
+    def headers(i: int) -> Dict[str, str]:
+        return {"X-Internal-Token": args.token, "X-User-Id": users[i % len(users)]}
+
+    report: Dict[str, Any] = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.url or "in-process",
+        "params": {k: v for k, v in vars(args).items() if k not in ("token", "out")},
+        "index": [],
+        "ask": [],
+    }
+
+    async with http_client(args) as client:
+        if not args.url:
+            report["backend"] = {
+                "llm": os.environ["LLM_BACKEND"],
+                "vector": os.environ["VECTOR_BACKEND"],
+            }
+
+        if not args.skip_index:
+            for c in args.concurrency:
+                def index_request(i: int):
+                    d = docs[i % len(docs)]
+                    body = {"doc_id": d["doc_id"], "title": d["title"], "pages": d["pages"]}
+                    return client.post("/internal/index/upsert_ocr", json=body, headers=headers(i))
+
+                # Every level re-indexes the same documents (replace=True), so levels are comparable.
+                report["index"].append(await run_level(c, len(docs), index_request))
+                print(f"index c={c}: {report['index'][-1]}", file=sys.stderr)
+
+        questions = [question_for(rng, docs[i % len(docs)]) for i in range(args.requests)]
+        for c in args.concurrency:
+            def ask_request(i: int):
+                # Every level asks the same questions: without --no-cache, levels after the
+                # first are answered from the caches (warm path); with it, nothing is cached.
+                body = {"question": questions[i], "mode": "doc", "no_cache": args.no_cache}
+                return client.post("/internal/chat/ask", json=body, headers=headers(i))
+
+            report["ask"].append(await run_level(c, args.requests, ask_request))
+            print(f"ask   c={c}: {report['ask'][-1]}", file=sys.stderr)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running service (default: in process, offline backends)")
+    parser.add_argument("--token", default=os.getenv("INTERNAL_TOKEN", "dev-internal-token"))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Ask requests per concurrency level")
+    parser.add_argument("--docs", type=int, default=50, help="Documents indexed per concurrency level")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Send no_cache=true: bypass every cache (query embedding, retrieval, answer), "
+                             "so each level measures the uncached path")
+    parser.add_argument("--skip-index", action="store_true", help="Only run the ask phase")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    # The in-process app logs to stdout; keep stdout for the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
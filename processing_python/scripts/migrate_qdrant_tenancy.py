@@ -0,0 +1,148 @@
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from dotenv import load_dotenv
+load_dotenv(ROOT / ".env")
+
+import argparse
+import json
+from collections import defaultdict
+
+from qdrant_client.http import models as qm
+
+from app.core.clients import build_qdrant_store
+from app.services.vector.qdrant_store import DEFAULT_SHARD_KEY
+
+
+def describe(store) -> dict:
+    info = store.client.get_collection(store.collection)
+    return {
+        "collection": store.collection,
+        "points": info.points_count,
+        "hnsw": info.config.hnsw_config.model_dump(exclude_none=True),
+        "sharding_method": str(info.config.params.sharding_method),
+        "payload_schema": {k: v.model_dump(exclude_none=True) for k, v in (info.payload_schema or {}).items()},
+    }
+
+
+def copy_points(source, target, batch: int) -> int:
+    """Copy every point (ids, vectors, payloads) into target, routed by tenant shard key."""
+    info = source.client.get_collection(source.collection)
+    target.ensure_collection(vector_size=info.config.params.vectors.size)
+
+    copied = 0
+    offset = None
+    while True:
+        records, offset = source.client.scroll(
+            collection_name=source.collection,
+            limit=batch,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        by_user = defaultdict(list)
+        for r in records:
+            by_user[(r.payload or {}).get("user_id")].append(
+                qm.PointStruct(id=r.id, vector=r.vector, payload=r.payload)
+            )
+        for user_id, points in by_user.items():
+            target.client.upsert(
+                collection_name=target.collection,
+                points=points,
+                shard_key_selector=target.shard_key(user_id),
+            )
+            copied += len(points)
+        print(f"copied {copied} points")
+        if offset is None:
+            return copied
+
+
+def promote_tenants(store, batch: int) -> dict:
+    """Move configured large tenants from the default shard key to their own."""
+    moved = {}
+    for user_id in sorted(store.tenant_shard_users):
+        try:
+            store.client.create_shard_key(collection_name=store.collection, shard_key=user_id)
+        except Exception as e:
+            if "already exists" not in str(e).lower():
+                raise
+
+        flt = qm.Filter(must=[qm.FieldCondition(key="user_id", match=qm.MatchValue(value=user_id))])
+        count = 0
+        while True:
+            records, _ = store.client.scroll(
+                collection_name=store.collection,
+                scroll_filter=flt,
+                limit=batch,
+                with_payload=True,
+                with_vectors=True,
+                shard_key_selector=DEFAULT_SHARD_KEY,
+            )
+            if not records:
+                break
+            store.client.upsert(
+                collection_name=store.collection,
+                points=[qm.PointStruct(id=r.id, vector=r.vector, payload=r.payload) for r in records],
+                shard_key_selector=user_id,
+            )
+            store.client.delete(
+                collection_name=store.collection,
+                points_selector=qm.PointIdsList(points=[r.id for r in records]),
+                shard_key_selector=DEFAULT_SHARD_KEY,
+            )
+            count += len(records)
+        moved[user_id] = count
+    return moved
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Migrate a Qdrant collection to the multi-tenant layout.")
+    ap.add_argument("--collection", default=None, help="Collection to migrate (default: QDRANT_COLLECTION)")
+    ap.add_argument("--dry-run", action="store_true", help="Only print the current layout")
+    ap.add_argument("--copy-to", default=None,
+                    help="Copy into a new collection created with the configured layout "
+                         "(required to switch to shard-key routing)")
+    ap.add_argument("--promote-tenants", action="store_true",
+                    help="Move QDRANT_TENANT_SHARD_USERS from the default shard key to their own")
+    ap.add_argument("--rebuild-tenant-index", action="store_true",
+                    help="Drop and re-create a plain user_id index as tenant index. Filtered searches "
+                         "run without the index until it is rebuilt: use a maintenance window, or "
+                         "--copy-to for a zero-downtime switch")
+    ap.add_argument("--batch", type=int, default=256)
+    args = ap.parse_args()
+
+    store = build_qdrant_store()
+    if args.collection:
+        store.collection = args.collection
+
+    print(json.dumps(describe(store), indent=2, default=str))
+    if args.dry_run:
+        return
+
+    if args.copy_to:
+        target = build_qdrant_store()
+        target.collection = args.copy_to
+        copy_points(store, target, batch=args.batch)
+        print(json.dumps(describe(target), indent=2, default=str))
+        print(f"Done. Point QDRANT_COLLECTION at '{args.copy_to}' to use it.")
+        return
+
+    if args.promote_tenants:
+        if not store.sharded:
+            raise RuntimeError("Set QDRANT_TENANT_SHARD_USERS first")
+        print(json.dumps({"moved": promote_tenants(store, batch=args.batch)}, indent=2))
+        return
+
+    report = store.migrate_tenant_layout(rebuild_tenant_index=args.rebuild_tenant_index)
+    print(json.dumps(report, indent=2, default=str))
+    if report["user_id_index"] == "needs_rebuild":
+        print("user_id is indexed without the tenant flag. Re-run with --rebuild-tenant-index in a "
+              "maintenance window, or use --copy-to.")
+    print(json.dumps(describe(store), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+from app.pipelines.cache import AnswerCache
+
+
+class TestAnswerCache:
+    def key(self, user_id, question="What is the refund policy?"):
+        return AnswerCache.key("general-v1", "model", 0.2, user_id, question, [])
+
+    def test_key_is_scoped_per_user(self):
+        assert self.key("u1") == self.key("u1", "  what is the REFUND policy? ")
+        assert self.key("u1") != self.key("u2")
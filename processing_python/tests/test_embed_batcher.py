@@ -0,0 +1,110 @@
+import asyncio
+import time
+from contextvars import ContextVar
+
+import numpy as np
+import pytest
+
+from app.core.resilience import DeadlineExceeded, deadline_context, remaining
+from app.services.llm.embed_batcher import EmbeddingBatcher
+
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class FakeEmbedder:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, texts):
+        self.calls.append({"texts": list(texts), "request_id": request_id.get(), "remaining": remaining()})
+        await asyncio.sleep(self.delay)
+        return np.array([[float(len(t))] for t in texts], dtype=np.float32)
+
+
+def embed_in_request(batcher, text, budget=None, rid="-"):
+    """Start batcher.embed(text) as a request with its own context and deadline."""
+    ctx = deadline_context(None if budget is None else time.monotonic() + budget)
+    ctx.run(request_id.set, rid)
+    return ctx.run(asyncio.ensure_future, batcher.embed(text))
+
+
+async def settle(tasks):
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class TestEmbeddingBatcher:
+    def test_concurrent_texts_share_one_call(self):
+        async def main():
+            embed = FakeEmbedder()
+            batcher = EmbeddingBatcher(embed, max_wait_ms=5)
+            results = await settle([embed_in_request(batcher, t) for t in ("a", "bb", "a")])
+            return embed, results
+
+        embed, results = asyncio.run(main())
+        assert len(embed.calls) == 1 and embed.calls[0]["texts"] == ["a", "bb"]
+        assert [r[0] for r in results] == [1.0, 2.0, 1.0]
+
+    def test_batch_runs_outside_the_callers_context(self):
+        async def main():
+            embed = FakeEmbedder()
+            batcher = EmbeddingBatcher(embed, max_wait_ms=5)
+            await settle([
+                embed_in_request(batcher, "a", budget=0.5, rid="first"),
+                embed_in_request(batcher, "b", budget=5.0, rid="second"),
+            ])
+            return embed
+
+        call = asyncio.run(main()).calls[0]
+        assert call["request_id"] == "-"
+        # Bounded by the latest deadline in the batch, not by the caller that started the timer.
+        assert 4.0 < call["remaining"] <= 5.0
+
+    def test_no_deadline_when_a_caller_has_none(self):
+        async def main():
+            embed = FakeEmbedder()
+            batcher = EmbeddingBatcher(embed, max_wait_ms=5)
+            await settle([embed_in_request(batcher, "a", budget=0.5), embed_in_request(batcher, "b")])
+            return embed
+
+        assert asyncio.run(main()).calls[0]["remaining"] is None
+
+    def test_each_caller_waits_until_its_own_deadline(self):
+        async def main():
+            embed = FakeEmbedder(delay=0.2)
+            batcher = EmbeddingBatcher(embed, max_wait_ms=5)
+            started = time.monotonic()
+            short = embed_in_request(batcher, "a", budget=0.05)
+            long = embed_in_request(batcher, "b", budget=2.0)
+            with pytest.raises(DeadlineExceeded):
+                await short
+            short_elapsed = time.monotonic() - started
+            return short_elapsed, await long
+
+        short_elapsed, vector = asyncio.run(main())
+        assert short_elapsed < 0.15
+        assert vector[0] == 1.0
+
+    def test_batch_stops_when_every_deadline_passed(self):
+        async def main():
+            embed = FakeEmbedder(delay=5.0)
+            batcher = EmbeddingBatcher(embed, max_wait_ms=5)
+            started = time.monotonic()
+            results = await settle([embed_in_request(batcher, t, budget=0.1) for t in ("a", "b")])
+            await batcher.aclose()
+            return time.monotonic() - started, results
+
+        elapsed, results = asyncio.run(main())
+        assert elapsed < 1.0
+        assert all(isinstance(r, DeadlineExceeded) for r in results)
+
+    def test_expired_caller_is_rejected_up_front(self):
+        async def main():
+            embed = FakeEmbedder()
+            batcher = EmbeddingBatcher(embed, max_wait_ms=5)
+            results = await settle([embed_in_request(batcher, "a", budget=-1.0)])
+            await batcher.aclose()
+            return embed, results
+
+        embed, results = asyncio.run(main())
+        assert isinstance(results[0], DeadlineExceeded) and embed.calls == []
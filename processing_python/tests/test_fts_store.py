@@ -0,0 +1,16 @@
+from app.services.lexical.fts_store import FtsStore
+
+
+def chunk(user_id, doc_id, text, i=0):
+    return {"user_id": user_id, "doc_id": doc_id, "text": text, "page": 1, "chunk_index": i}
+
+
+class TestFtsStore:
+    def test_replace_user_only_touches_that_user(self, tmp_path):
+        fts = FtsStore(str(tmp_path / "lex.sqlite"))
+        fts.upsert([chunk("u", "stale", "alpha beta"), chunk("v", "other", "alpha gamma")])
+
+        assert fts.replace_user("u", [chunk("u", "d0", "alpha delta", i) for i in range(3)]) == 3
+        assert {h.payload["doc_id"] for h in fts.search("alpha", "u", None, 10)} == {"d0"}
+        assert {h.payload["doc_id"] for h in fts.search("alpha", "v", None, 10)} == {"other"}
+        fts.close()
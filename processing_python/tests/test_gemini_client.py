@@ -0,0 +1,42 @@
+import asyncio
+
+import numpy as np
+
+from app.services.llm.fake_backend import FakeGenAIClient, hash_embedding
+from app.services.llm.gemini_client import GeminiClient
+
+
+class CountingBackend(FakeGenAIClient):
+    """Fake client that records how many embed calls run at the same time."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.peak = 0
+        embed = self.aio.models.embed_content
+
+        async def counted(*args, **kw):
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                return await embed(*args, **kw)
+            finally:
+                self.in_flight -= 1
+
+        self.aio.models.embed_content = counted
+
+
+class TestEmbedDocuments:
+    def test_batches_are_capped_and_kept_in_order(self):
+        backend = CountingBackend(dims=8, embed_latency_ms=10)
+        client = GeminiClient(api_key="", embed_model="fake", backend=backend, embed_concurrency=2)
+        texts = [f"text number {i}" for i in range(1050)]
+
+        async def main():
+            # Two callers at once share the same limit.
+            return await asyncio.gather(client.aembed_documents(texts), client.aembed_documents(texts[:300]))
+
+        big, small = asyncio.run(main())
+        assert backend.peak == 2
+        assert big.shape == (1050, 8) and small.shape == (300, 8)
+        assert np.allclose(big[1049], hash_embedding(texts[1049], 8))
@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+
+from app.services.vector.hot_cache import HotDocCache
+from app.services.vector.qdrant_store import QdrantStore
+
+
+def store(aclient, hot_cache=None):
+    s = QdrantStore(url="http://localhost:1", api_key="", collection="c", hot_cache=hot_cache, tenant_layout=False)
+    s.aclient = aclient
+    return s
+
+
+def chunks(doc_id, n):
+    return [{"user_id": "u", "doc_id": doc_id, "text": f"t{i}", "page": 1, "chunk_index": i} for i in range(n)]
+
+
+class TestHotDocCache:
+    def test_pinned_search_matches_remote_search(self):
+        async def main():
+            aclient = AsyncQdrantClient(":memory:")
+            cache = HotDocCache(max_bytes=10_000_000)
+            rng = np.random.default_rng(0)
+            await store(aclient).aupsert(rng.standard_normal((60, 8)).astype(np.float32), chunks("d0", 60))
+            q = rng.standard_normal(8).astype(np.float32)
+            remote = await store(aclient).asearch(q, "u", ["d0"], 5)
+            hot = await store(aclient, cache).asearch(q, "u", ["d0"], 5)
+            return remote, hot, cache
+
+        remote, hot, cache = asyncio.run(main())
+        assert [h.payload["text"] for h in hot] == [r.payload["text"] for r in remote]
+        assert cache.nbytes > 0
+
+    def test_empty_load_is_not_pinned(self):
+        async def main():
+            aclient = AsyncQdrantClient(":memory:")
+            cache = HotDocCache(max_bytes=10_000_000)
+            reader, writer = store(aclient, cache), store(aclient)  # writer: another worker
+            rng = np.random.default_rng(0)
+            await writer.aupsert(rng.standard_normal((10, 8)).astype(np.float32), chunks("d0", 10))
+            q = rng.standard_normal(8).astype(np.float32)
+
+            before = await reader.asearch(q, "u", ["d1"], 5)
+            await writer.aupsert(rng.standard_normal((10, 8)).astype(np.float32), chunks("d1", 10))
+            after = await reader.asearch(q, "u", ["d1"], 5)
+            return before, after, cache
+
+        before, after, cache = asyncio.run(main())
+        assert before == []
+        assert len(after) == 5 and {h.payload["doc_id"] for h in after} == {"d1"}
+        assert cache.nbytes > 0
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.pipelines.chunk import PageText
+from app.pipelines.indexer import Indexer
+from app.services.lexical.fts_store import FtsStore
+from app.services.llm.fake_backend import FakeGenAIClient
+from app.services.llm.gemini_client import GeminiClient
+from app.services.vector.local_store import LocalVectorStore
+
+
+class FailingStore(LocalVectorStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self.fail = False
+
+    def upsert(self, vectors, payloads):
+        if self.fail:
+            raise ConnectionError("vector store down")
+        return super().upsert(vectors, payloads)
+
+
+def pages(text):
+    return [PageText(page_number=1, text=text)]
+
+
+class TestIndexer:
+    @pytest.fixture()
+    def parts(self, tmp_path):
+        gemini = GeminiClient(api_key="", embed_model="fake", backend=FakeGenAIClient(dims=16))
+        store = FailingStore(str(tmp_path / "vectors"))
+        lexical = FtsStore(str(tmp_path / "lexical.sqlite"))
+        yield Indexer(gemini, store, chunk_size=200, overlap=20, lexical_index=lexical), store, lexical
+        lexical.close()
+
+    def test_failed_embedding_keeps_the_previous_version(self, parts):
+        indexer, store, lexical = parts
+        asyncio.run(indexer.upsert_ocr_bulk("u", [
+            {"doc_id": "d0", "pages": pages("invoice REF-1 total 500")},
+            {"doc_id": "d1", "pages": pages("contract REF-2 renewal notice")},
+        ]))
+
+        async def broken(texts):
+            raise TimeoutError("embedding timed out")
+
+        indexer.gemini.aembed_documents = broken
+        with pytest.raises(TimeoutError):
+            asyncio.run(indexer.upsert_ocr("u", "d0", pages("invoice REF-1 total 700")))
+        with pytest.raises(TimeoutError):
+            asyncio.run(indexer.upsert_ocr_bulk("u", [{"doc_id": "d1", "pages": pages("contract v2")}]))
+
+        assert len(store._tenant("u")) == 2
+        assert {h.payload["doc_id"] for h in lexical.search("REF", "u", None, 10)} == {"d0", "d1"}
+
+    def test_bulk_replaces_each_document(self, parts):
+        indexer, store, lexical = parts
+        docs = [{"doc_id": f"d{i}", "pages": pages(f"invoice REF-{i} total {i}")} for i in range(3)]
+        asyncio.run(indexer.upsert_ocr_bulk("u", docs))
+        docs[1]["pages"] = pages("invoice REF-1 total updated")
+        result = asyncio.run(indexer.upsert_ocr_bulk("u", docs))
+
+        assert result["indexed"] and len(store._tenant("u")) == 3
+        assert [h.payload["text"] for h in lexical.search("updated", "u", None, 10)] == ["invoice REF-1 total updated"]
+
+    def test_failed_vector_write_leaves_no_keyword_rows(self, parts):
+        indexer, store, lexical = parts
+        store.fail = True
+        with pytest.raises(ConnectionError):
+            asyncio.run(indexer.upsert_ocr("u", "d0", pages("invoice REF-1 total 500")))
+        assert lexical.search("invoice", "u", None, 10) == []
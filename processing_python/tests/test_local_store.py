@@ -0,0 +1,206 @@
+import json
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from app.services.vector.local_store import LocalVectorStore
+
+DIM = 16
+
+
+def clustered(rng, n, centers=20):
+    means = rng.standard_normal((centers, DIM)).astype(np.float32) * 4
+    return (means[rng.integers(0, centers, n)] + rng.standard_normal((n, DIM))).astype(np.float32)
+
+
+def payloads(n, doc_id="d0", user_id="u", start=0):
+    return [{"user_id": user_id, "doc_id": doc_id, "text": f"t{start + i}"} for i in range(n)]
+
+
+def texts(hits):
+    return [h.payload["text"] for h in hits]
+
+
+def append_rows(root, worker, n):
+    rng = np.random.default_rng(worker)
+    store = LocalVectorStore(root)
+    for i in range(n):
+        store.upsert(rng.standard_normal((2, DIM)).astype(np.float32), payloads(2, f"w{worker}", start=2 * i))
+
+
+class TestLocalVectorStore:
+    @pytest.fixture()
+    def rng(self):
+        return np.random.default_rng(0)
+
+    @pytest.fixture()
+    def root(self, tmp_path):
+        return str(tmp_path / "vectors")
+
+    def test_append_and_reload(self, root, rng):
+        vectors = rng.standard_normal((30, DIM)).astype(np.float32)
+        store = LocalVectorStore(root)
+        store.upsert(vectors[:10], payloads(10, "d0"))
+        store.upsert(vectors[10:], payloads(20, "d1", start=10))
+
+        reloaded = LocalVectorStore(root)
+        for i in (0, 15, 29):
+            assert texts(reloaded.search(vectors[i], "u", None, 1)) == [f"t{i}"]
+        assert texts(reloaded.search(vectors[15], "u", ["d0"], 10))[0] != "t15"
+        assert len(reloaded._tenant("u")) == 30
+
+    def test_uncommitted_tail_is_cut_off(self, root, rng):
+        vectors = rng.standard_normal((12, DIM)).astype(np.float32)
+        store = LocalVectorStore(root)
+        store.upsert(vectors[:8], payloads(8))
+        t = store._tenant("u")
+        # An append that crashed before its meta.json commit
+        with t.vectors_path.open("ab") as f:
+            f.write(b"\0" * (DIM * 4 + 7))
+        with t.payloads_path.open("ab") as f:
+            f.write(b'{"id": "x", "payl')
+
+        reloaded = LocalVectorStore(root)
+        assert len(reloaded._tenant("u")) == 8
+        reloaded.upsert(vectors[8:], payloads(4, start=8))
+        again = LocalVectorStore(root)
+        for i in range(12):
+            assert texts(again.search(vectors[i], "u", None, 1)) == [f"t{i}"]
+
+    def test_missing_committed_rows_keep_complete_prefix(self, root, rng):
+        vectors = rng.standard_normal((6, DIM)).astype(np.float32)
+        store = LocalVectorStore(root)
+        store.upsert(vectors, payloads(6))
+        t = store._tenant("u")
+        meta = json.loads(t.meta_path.read_text())
+        meta["rows"] += 3
+        t.meta_path.write_text(json.dumps(meta))
+
+        reloaded = LocalVectorStore(root)
+        assert len(reloaded._tenant("u")) == 6
+        assert texts(reloaded.search(vectors[5], "u", None, 1)) == ["t5"]
+
+    def test_delete_switches_generation(self, root, rng):
+        vectors = rng.standard_normal((20, DIM)).astype(np.float32)
+        store = LocalVectorStore(root)
+        store.upsert(vectors[:10], payloads(10, "d0"))
+        store.upsert(vectors[10:], payloads(10, "d1", start=10))
+        store.delete_docs("u", ["d0"])
+
+        reloaded = LocalVectorStore(root)
+        t = reloaded._tenant("u")
+        assert len(t) == 10
+        assert {h.payload["doc_id"] for h in reloaded.search(vectors[0], "u", None, 20)} == {"d1"}
+        assert sorted(p.name for p in t.path.glob("*.f32")) == [t.vectors_path.name]
+
+    def test_interrupted_delete_keeps_previous_generation(self, root, rng):
+        vectors = rng.standard_normal((5, DIM)).astype(np.float32)
+        store = LocalVectorStore(root)
+        store.upsert(vectors, payloads(5))
+        t = store._tenant("u")
+        # New generation written, but meta.json never switched to it
+        (t.path / f"vectors.{t.generation + 1}.f32").write_bytes(b"\0" * 16)
+        (t.path / f"payloads.{t.generation + 1}.jsonl").write_bytes(b"")
+
+        reloaded = LocalVectorStore(root)
+        assert texts(reloaded.search(vectors[3], "u", None, 1)) == ["t3"]
+        assert not (t.path / f"vectors.{t.generation + 1}.f32").exists()
+
+    def test_ivf_search_matches_exact_search(self, root, rng):
+        vectors = clustered(rng, 3000)
+        exact = LocalVectorStore(root + "-exact", ann_threshold=10**9)
+        ivf = LocalVectorStore(root, ann_threshold=500, nprobe=10**6)  # probing every list is exact
+        for store in (exact, ivf):
+            store.upsert(vectors, payloads(3000))
+        assert ivf.build_index("u")
+
+        for q in rng.standard_normal((10, DIM)).astype(np.float32):
+            assert texts(ivf.search(q, "u", None, 10)) == texts(exact.search(q, "u", None, 10))
+
+    def test_ivf_recall_with_default_nprobe(self, root, rng):
+        vectors = clustered(rng, 3000)
+        exact = LocalVectorStore(root + "-exact", ann_threshold=10**9)
+        ivf = LocalVectorStore(root, ann_threshold=500)
+        for store in (exact, ivf):
+            store.upsert(vectors, payloads(3000))
+        ivf.build_index("u")
+
+        queries = vectors[rng.choice(3000, 20, replace=False)] + 0.1 * rng.standard_normal((20, DIM))
+        found = sum(
+            len(set(texts(ivf.search(q, "u", None, 10))) & set(texts(exact.search(q, "u", None, 10))))
+            for q in queries.astype(np.float32)
+        )
+        assert found / 200 >= 0.9
+
+    def test_search_builds_index_in_background(self, root, rng):
+        vectors = clustered(rng, 1000)
+        store = LocalVectorStore(root, ann_threshold=500)
+        store.upsert(vectors, payloads(1000))
+        t = store._tenant("u")
+
+        # No index yet: this search is answered exactly and only schedules the build.
+        assert texts(store.search(vectors[7], "u", None, 1)) == ["t7"]
+        t.ivf_thread.join(timeout=30)
+        assert t.ivf is not None and len(t.ivf["assign"]) == 1000
+
+    def test_appends_reuse_centroids_until_drift(self, root, rng):
+        vectors = clustered(rng, 1201)
+        store = LocalVectorStore(root, ann_threshold=500, nprobe=10**6, ivf_rebuild_drift=0.2)
+        store.upsert(vectors[:1000], payloads(1000))
+        store.build_index("u")
+        t = store._tenant("u")
+        centroids = t.ivf["centroids"]
+
+        store.upsert(vectors[1000:1100], payloads(100, start=1000))
+        assert t.ivf["centroids"] is centroids and len(t.ivf["assign"]) == 1100
+        assert texts(store.search(vectors[1050], "u", None, 1)) == ["t1050"]
+        assert t.ivf_thread is None  # 10% drift: no rebuild
+
+        store.upsert(vectors[1100:], payloads(101, start=1100))
+        store.search(vectors[0], "u", None, 1)  # 201 of 1000 rows changed: rebuild scheduled
+        t.ivf_thread.join(timeout=30)
+        assert t.ivf_rows_built == 1201 and t.ivf_drift == 0
+
+    def test_index_survives_delete_and_reload(self, root, rng):
+        vectors = clustered(rng, 1000)
+        store = LocalVectorStore(root, ann_threshold=500, nprobe=10**6)
+        store.upsert(vectors[:600], payloads(600, "d0"))
+        store.upsert(vectors[600:], payloads(400, "d1", start=600))
+        store.build_index("u")
+        store.delete_docs("u", ["d1"])
+        store.upsert(vectors[600:650], payloads(50, "d2", start=600))
+
+        reloaded = LocalVectorStore(root, ann_threshold=500, nprobe=10**6)
+        t = reloaded._tenant("u")
+        assert t.ivf is not None and len(t.ivf["assign"]) == len(t) == 650
+        for i in (3, 620):
+            assert texts(reloaded.search(vectors[i], "u", None, 1)) == [f"t{i}"]
+
+    def test_stale_instances_do_not_cut_off_each_others_rows(self, root, rng):
+        vectors = rng.standard_normal((25, DIM)).astype(np.float32)
+        a, b = LocalVectorStore(root), LocalVectorStore(root)  # e.g. two workers
+        a.upsert(vectors[:10], payloads(10, "d0"))
+        b.upsert(vectors[10:15], payloads(5, "d1", start=10))
+        a.upsert(vectors[15:20], payloads(5, "d2", start=15))
+        assert texts(b.search(vectors[17], "u", None, 1)) == ["t17"]
+
+        b.delete_docs("u", ["d0"])
+        a.upsert(vectors[20:], payloads(5, "d3", start=20))
+        for store in (a, b, LocalVectorStore(root)):
+            assert len(store.search(vectors[0], "u", None, 100)) == 15
+            for i in (12, 17, 22):
+                assert texts(store.search(vectors[i], "u", None, 1)) == [f"t{i}"]
+
+    def test_concurrent_processes_keep_every_row(self, root):
+        ctx = multiprocessing.get_context("fork")
+        procs = [ctx.Process(target=append_rows, args=(root, w, 20)) for w in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(timeout=60)
+        assert all(p.exitcode == 0 for p in procs)
+
+        t = LocalVectorStore(root)._tenant("u")
+        assert len(t) == 160
+        assert sorted({p["doc_id"] for p in t.payloads}) == ["w0", "w1", "w2", "w3"]
@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.core.resilience import CircuitOpenError, UpstreamUnavailable, counters
+from app.pipelines.rag import RAG
+
+
+def hit(i, score, text="invoice total"):
+    return SimpleNamespace(
+        id=i, score=score, payload={"doc_id": "d", "title": "T", "page": 1, "chunk_index": i, "text": text}
+    )
+
+
+class FakeGemini:
+    async def aembed_query(self, question):
+        return np.ones(4, dtype=np.float32)
+
+
+class FakeStore:
+    def __init__(self, hits=None, error=None):
+        self.hits = hits or []
+        self.error = error
+
+    async def asearch(self, query_vector, user_id, doc_ids, top_k):
+        if self.error is not None:
+            raise self.error
+        return self.hits
+
+
+class FakeLexical:
+    def __init__(self, hits=None, error=None):
+        self.hits = hits or []
+        self.error = error
+
+    async def asearch(self, query, user_id, doc_ids, top_k):
+        if self.error is not None:
+            raise self.error
+        return self.hits
+
+
+def search(store, lexical, fastpath):
+    rag = RAG(FakeGemini(), store, top_k=3, lexical_index=lexical, lexical_fastpath=fastpath)
+    return asyncio.run(rag._retrieve("u", "what is the invoice total", None))
+
+
+class TestDegradedRetrieval:
+    @pytest.mark.parametrize("fastpath", [False, True])
+    def test_keyword_failure_keeps_dense_hits(self, fastpath):
+        before = counters.snapshot().get("rag.lexical_failed", 0)
+        hits, retrieval = search(
+            FakeStore(hits=[hit(0, 0.9), hit(1, 0.8)]),
+            FakeLexical(error=sqlite3.OperationalError("database is locked")),
+            fastpath,
+        )
+        assert [h.id for h in hits] == [0, 1]
+        assert retrieval == "dense_fallback"
+        assert counters.snapshot()["rag.lexical_failed"] == before + 1
+
+    def test_dense_failure_uses_keyword_hits(self):
+        hits, retrieval = search(FakeStore(error=CircuitOpenError("open")), FakeLexical(hits=[hit(5, 3.0)]), False)
+        assert [h.payload["chunk_index"] for h in hits] == [5] and retrieval == "lexical_fallback"
+
+    def test_unexpected_dense_error_becomes_upstream_unavailable(self):
+        with pytest.raises(UpstreamUnavailable) as info:
+            search(FakeStore(error=ValueError("bad vector")), FakeLexical(), False)
+        assert isinstance(info.value.__cause__, ValueError)
+
+    def test_upstream_error_is_passed_through(self):
+        with pytest.raises(CircuitOpenError):
+            search(FakeStore(error=CircuitOpenError("open")), FakeLexical(), True)
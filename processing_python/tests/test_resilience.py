@@ -0,0 +1,197 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.resilience import (
+    CallPolicy,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    counters,
+    deadline_context,
+)
+from app.services.llm.fake_backend import FakeGenAIClient
+from app.services.llm.gemini_client import GeminiClient
+
+
+def run_with_budget(coro, budget):
+    """asyncio.run(coro) as if inside a request with `budget` seconds left."""
+    async def main():
+        ctx = deadline_context(time.monotonic() + budget)
+        return await ctx.run(asyncio.ensure_future, coro)
+
+    return asyncio.run(main())
+
+
+def open_breaker(reset_timeout=0.05):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=reset_timeout)
+    breaker.record_failure()
+    return breaker
+
+
+class TestCircuitBreaker:
+    def test_half_open_lets_a_single_probe_through(self):
+        breaker = open_breaker()
+        assert not breaker.allow()
+        time.sleep(0.06)
+
+        assert breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.allow()  # probe still in flight
+
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow() and breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        breaker = open_breaker()
+        time.sleep(0.06)
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+    def test_cancelled_probe_frees_the_slot(self):
+        breaker = open_breaker()
+        time.sleep(0.06)
+        policy = CallPolicy("test", breaker=breaker)
+
+        async def main():
+            task = asyncio.ensure_future(policy.call("op", lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0.01)
+            concurrent = breaker.allow()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return concurrent
+
+        assert asyncio.run(main()) is False
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+
+    def test_open_breaker_rejects_calls(self):
+        policy = CallPolicy("test", breaker=open_breaker(reset_timeout=60))
+
+        async def fn():
+            raise AssertionError("must not be called")
+
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(policy.call("op", fn))
+
+
+class TestHedging:
+    def test_slow_first_attempt_loses_and_is_cancelled(self):
+        attempts = []
+
+        async def fn():
+            n = len(attempts)
+            attempts.append("running")
+            try:
+                await asyncio.sleep(1.0 if n == 0 else 0.01)
+                attempts[n] = "done"
+                return n
+            except asyncio.CancelledError:
+                attempts[n] = "cancelled"
+                raise
+
+        async def main():
+            result = await CallPolicy("test").call("op", fn, timeout=2.0, hedge_after=0.02)
+            await asyncio.sleep(0)  # let the loser observe its cancellation
+            return result
+
+        assert asyncio.run(main()) == 1
+        assert attempts == ["cancelled", "done"]
+
+    def test_fast_first_attempt_is_not_hedged(self):
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            return "ok"
+
+        assert asyncio.run(CallPolicy("test").call("op", fn, hedge_after=0.05)) == "ok"
+        assert calls == [1]
+
+    def test_failed_attempt_falls_back_to_the_other(self):
+        attempts = []
+
+        async def fn():
+            n = len(attempts)
+            attempts.append(n)
+            if n == 0:
+                await asyncio.sleep(0.05)
+                raise ConnectionError("reset")
+            await asyncio.sleep(0.1)
+            return "second"
+
+        assert asyncio.run(CallPolicy("test").call("op", fn, timeout=2.0, hedge_after=0.01)) == "second"
+
+
+class TestTimeoutAccounting:
+    def test_upstream_timeout_counts_against_the_breaker(self):
+        breaker = CircuitBreaker("test", failure_threshold=1)
+        policy = CallPolicy("test", breaker=breaker)
+        with pytest.raises(DeadlineExceeded):
+            run_with_budget(policy.call("op", lambda: asyncio.sleep(1), timeout=0.02), budget=5.0)
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_short_caller_budget_does_not(self):
+        breaker = CircuitBreaker("test", failure_threshold=1)
+        policy = CallPolicy("test", breaker=breaker, margin_ms=0)
+        with pytest.raises(DeadlineExceeded):
+            run_with_budget(policy.call("op", lambda: asyncio.sleep(1), timeout=5.0), budget=0.02)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.snapshot()["failures"] == 0
+
+    def test_spent_budget_fails_before_calling(self):
+        policy = CallPolicy("test", breaker=CircuitBreaker("test"))
+        calls = []
+
+        async def fn():
+            calls.append(1)
+
+        with pytest.raises(DeadlineExceeded):
+            run_with_budget(policy.call("op", fn, timeout=1.0), budget=0.01)
+        assert calls == []
+
+
+class TestGeminiStream:
+    def client(self, idle_timeout, token_latency_ms):
+        backend = FakeGenAIClient(dims=8, token_latency_ms=token_latency_ms, answer_words=5)
+        return GeminiClient(
+            api_key="",
+            embed_model="fake",
+            chat_model="fake",
+            backend=backend,
+            policy=CallPolicy("gemini", breaker=CircuitBreaker("gemini", failure_threshold=1)),
+            generate_timeout=1.0,
+            stream_idle_timeout=idle_timeout,
+        )
+
+    @staticmethod
+    async def collect(client):
+        return [piece async for piece in client.astream_text("one two three four five six seven eight nine ten")]
+
+    def test_stalled_stream_times_out(self):
+        client = self.client(idle_timeout=0.05, token_latency_ms=300)
+        before = counters.snapshot().get("gemini.stream.idle_timeouts", 0)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(self.collect(client))
+        # First chunk after 0.3s (within generate_timeout), the second never within 0.05s.
+        assert time.monotonic() - started < 0.45
+        assert counters.snapshot()["gemini.stream.idle_timeouts"] == before + 1
+        assert client.policy.breaker.state == CircuitBreaker.OPEN
+
+    def test_idle_timeout_is_capped_by_the_request_deadline(self):
+        client = self.client(idle_timeout=5.0, token_latency_ms=300)
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            run_with_budget(self.collect(client), budget=0.1)
+        assert time.monotonic() - started < 0.25
+        assert client.policy.breaker.state == CircuitBreaker.CLOSED
+
+    def test_steady_stream_completes(self):
+        client = self.client(idle_timeout=0.2, token_latency_ms=5)
+        assert asyncio.run(self.collect(client))
@@ -1,22 +1,51 @@
+import io
 import os
 import uuid
 import base64
-from pathlib import Path
+import signal
+import asyncio
+from contextlib import asynccontextmanager
 from typing import Optional
 
 import httpx
 from fastapi import FastAPI, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from PIL import Image
 from pydantic import BaseModel
 
-from remove_handwriting import main as remove_hw_main
-
-app = FastAPI(title="WPI Handwriting Removal", version="0.1.0")
+from inference import InferenceSettings
+from model_registry import ModelRegistry
+from remove_handwriting import DEFAULT_CONFIG, remove_handwriting_from_image
 
 INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
-WORK_ROOT = Path("/tmp/wpi_hw").resolve()
+
+# Models are loaded once per process, in the background, so /healthz answers
+# right away and /readyz flips once they are resident. `kill -HUP <pid>`
+# reloads them (e.g. after new weights were copied in).
+registry = ModelRegistry(
+    config_file=os.getenv("WPI_CONFIG", str(DEFAULT_CONFIG)),
+    settings=InferenceSettings.from_env(),  # WPI_DEVICE (auto), WPI_THREADS, WPI_CHANNELS_LAST, WPI_BF16
+    warmup_on_load=os.getenv("WPI_WARMUP", "true").lower() in ("1", "true", "yes"),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.load_in_background()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, registry.load_in_background)
+    except (NotImplementedError, AttributeError, RuntimeError):
+        pass  # no SIGHUP (Windows) or not on the main thread: use POST /internal/reload-models
+    yield
+
+
+app = FastAPI(title="WPI Handwriting Removal", version="0.1.0", lifespan=lifespan)
 
 class HandwritingOptions(BaseModel):
     strength: str = "medium"  # low|medium|high
+    includeMask: bool = False  # also return the handwriting mask
 
 class HandwritingRequest(BaseModel):
     jobId: str
@@ -29,6 +58,7 @@ class HandwritingResponse(BaseModel):
     jobId: str
     status: str
     cleanImageUrl: Optional[str] = None
+    maskImageUrl: Optional[str] = None
     error: Optional[str] = None
 
 def _auth(x_internal_token: Optional[str]):
@@ -43,10 +73,26 @@ def _strip_data_url_prefix(b64: str) -> str:
         return b64.split(",", 1)[1]
     return b64
 
+def _png_data_url(image: Image.Image) -> str:
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("utf-8")
+
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
 
+@app.get("/readyz")
+def readyz():
+    status = registry.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.post("/internal/reload-models")
+def reload_models(x_internal_token: Optional[str] = Header(default=None, alias="X-Internal-Token")):
+    _auth(x_internal_token)
+    registry.load_in_background()
+    return registry.status()
+
 @app.post("/internal/remove-handwriting", response_model=HandwritingResponse)
 async def remove_handwriting(
     req: HandwritingRequest,
@@ -54,12 +100,10 @@ async def remove_handwriting(
 ):
     _auth(x_internal_token)
 
+    if not registry.ready:
+        raise HTTPException(status_code=503, detail=f"Models not loaded yet ({registry.state})")
+
     job = req.jobId or uuid.uuid4().hex
-    job_dir = WORK_ROOT / job
-    in_dir = job_dir / "in"
-    out_dir = job_dir / "out"
-    in_dir.mkdir(parents=True, exist_ok=True)
-    out_dir.mkdir(parents=True, exist_ok=True)
 
     # get input bytes: base64 preferred, fallback to imageUrl
     img_bytes: Optional[bytes] = None
@@ -82,32 +126,21 @@ async def remove_handwriting(
         except Exception as e:
             return HandwritingResponse(jobId=job, status="error", error=f"Download failed: {e}")
 
-    # save as input.png
-    in_path = in_dir / "input.png"
-    in_path.write_bytes(img_bytes)
-
     strength = (req.options.strength or "medium").lower().strip()
     use_mean = True if strength == "low" else False  # low = faster/worse
 
-    # run WPI
+    # run WPI in memory on the resident models, off the event loop (no files are written)
     try:
-        class Args:
-            input_dir = Path(in_dir)
-            output_dir = Path(out_dir)
-            image_mean_method = use_mean
+        models = registry.get()
+
+        def _run():
+            with models.lock:
+                clean, mask = remove_handwriting_from_image(img_bytes, models.segmenter, models.inpainting_model,
+                                                            image_mean=use_mean, settings=models.settings)
+            return _png_data_url(clean), (_png_data_url(mask) if req.options.includeMask else None)
 
-        remove_hw_main(args=Args())
+        clean_url, mask_url = await run_in_threadpool(_run)
     except Exception as e:
         return HandwritingResponse(jobId=job, status="error", error=f"WPI failed: {e}")
 
-    outs = [p for p in out_dir.glob("*") if p.is_file()]
-    if not outs:
-        return HandwritingResponse(jobId=job, status="error", error="No output produced")
-
-    outs = sorted(outs, key=lambda p: ("mask" in p.name.lower(), -p.stat().st_size))
-    out_path = outs[0]
-    data = out_path.read_bytes()
-
-    b64 = base64.b64encode(data).decode("utf-8")
-    mime = "image/png" if out_path.suffix.lower() == ".png" else "image/jpeg"
-    return HandwritingResponse(jobId=job, status="success", cleanImageUrl=f"data:{mime};base64,{b64}")
+    return HandwritingResponse(jobId=job, status="success", cleanImageUrl=clean_url, maskImageUrl=mask_url)
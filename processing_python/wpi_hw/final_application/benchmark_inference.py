@@ -0,0 +1,152 @@
+"""
+Seconds per page of the handwriting pipeline for each inference setting.
+
+Loads the models once, then for every combination of intra-op threads,
+channels-last, bf16 autocast and inpainting batch size runs one warmup page
+and times the rest. Without --images, synthetic pages (printed lines plus
+scribbles) are used.
+
+Inter-op threads are not a grid axis: torch fixes them once the first
+parallel work has run, so they can only be set once per process. Run the
+script once per --interop-threads value to compare them.
+
+    python benchmark_inference.py --device cpu --threads 1,4,8 --inpaint-batch 1,8,32 --pages 3
+    python benchmark_inference.py --images ./samples --channels-last on --bf16 off,on --out cpu.json
+    python benchmark_inference.py --threads 4 --interop-threads 2
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import torch
+from PIL import Image, ImageDraw
+
+from inference import InferenceSettings
+from model_registry import load_models
+from remove_handwriting import DEFAULT_CONFIG, is_image, remove_handwriting_from_image
+
+
+def synthetic_page(rng: random.Random, width: int, height: int) -> Image.Image:
+    page = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(page)
+    for y in range(80, height - 80, 36):
+        if rng.random() < 0.2:
+            continue  # paragraph gap
+        x = 80
+        while x < width - 120:
+            w = rng.randint(20, 90)
+            draw.rectangle((x, y, x + w, y + 14), fill=(30, 30, 30))
+            x += w + rng.randint(8, 16)
+    for _ in range(rng.randint(3, 8)):
+        points = [(rng.randint(0, width), rng.randint(0, height))]
+        for _ in range(12):
+            px, py = points[-1]
+            points.append((px + rng.randint(-40, 60), py + rng.randint(-25, 25)))
+        draw.line(points, fill=(20, 40, 160), width=3)
+    return page
+
+
+def _flags(value: str):
+    return [v.strip().lower() in ("on", "true", "1", "yes") for v in value.split(",") if v.strip()]
+
+
+def _ints(value: str):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _apply(models, settings: InferenceSettings, default_threads: int):
+    # threads=0 means torch's default: restore it, or a previous grid point's count would stick.
+    torch.set_num_threads(settings.threads if settings.threads > 0 else default_threads)
+    models.settings = settings
+    models.segmenter.inference_settings = settings
+    models.segmenter.network = settings.prepare_module(models.segmenter.network)
+    models.inpainting_model = settings.prepare_module(models.inpainting_model)
+
+
+def run(models, pages, image_mean: bool) -> float:
+    start = time.perf_counter()
+    for page in pages:
+        remove_handwriting_from_image(page, models.segmenter, models.inpainting_model, image_mean, models.settings)
+    if models.settings.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG)
+    parser.add_argument("--device", default="cpu", help="cpu, cuda or auto")
+    parser.add_argument("--images", type=Path, help="Directory of page images (default: synthetic pages)")
+    parser.add_argument("--pages", type=int, default=3, help="Timed pages per setting")
+    parser.add_argument("--page-size", default="1240x1754", help="Synthetic page size, WxH")
+    parser.add_argument("--threads", default="0", help="Comma-separated intra-op thread counts (0 = default)")
+    parser.add_argument("--interop-threads", type=int, default=None,
+                        help="Inter-op threads for the whole run (default: WPI_INTEROP_THREADS or torch's)")
+    parser.add_argument("--inpaint-batch", default=None,
+                        help="Comma-separated patches per LBAM forward (default: WPI_INPAINT_BATCH)")
+    parser.add_argument("--channels-last", default="off,on")
+    parser.add_argument("--bf16", default="off,on")
+    parser.add_argument("--image-mean-method", action="store_true", help="Inpaint with the image mean, not LBAM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    default_threads = torch.get_num_threads()
+    base = InferenceSettings.from_env(device=args.device)
+    if args.interop_threads is not None:
+        base.interop_threads = args.interop_threads
+    base.configure_threads()
+    models = load_models(args.config, settings=base)
+
+    if args.images:
+        pages = [Image.open(p).convert("RGB") for p in sorted(args.images.rglob("*")) if is_image(p)]
+        pages = pages[:args.pages + 1]
+    else:
+        rng = random.Random(args.seed)
+        width, height = (int(v) for v in args.page_size.lower().split("x"))
+        pages = [synthetic_page(rng, width, height) for _ in range(args.pages + 1)]
+    assert len(pages) >= 2, "Need at least two pages (one warmup, one timed)."
+
+    report = {
+        "device": base.device,
+        "torch": torch.__version__,
+        "default_threads": default_threads,
+        "interop_threads": torch.get_num_interop_threads(),
+        "page_size": list(pages[1].size),
+        "pages": len(pages) - 1,
+        "image_mean_method": args.image_mean_method,
+        "results": [],
+    }
+    batches = _ints(args.inpaint_batch) if args.inpaint_batch else [base.inpaint_batch]
+    grid = itertools.product(_ints(args.threads), _flags(args.channels_last), _flags(args.bf16), batches)
+    for threads, channels_last, bf16, inpaint_batch in grid:
+        settings = InferenceSettings(device=base.device, threads=threads, interop_threads=base.interop_threads,
+                                     channels_last=channels_last, bf16=bf16, inpaint_batch=inpaint_batch)
+        if bf16 and not settings.autocast_enabled:
+            continue  # not supported by this torch / device
+        _apply(models, settings, default_threads)
+        run(models, pages[:1], args.image_mean_method)  # warmup
+        secs = run(models, pages[1:], args.image_mean_method)
+        row = {
+            "threads": torch.get_num_threads(),
+            "channels_last": channels_last,
+            "bf16": bf16,
+            "inpaint_batch": inpaint_batch,
+            "secs_per_page": round(secs, 3),
+        }
+        report["results"].append(row)
+        print(row, file=sys.stderr, flush=True)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Device, thread and precision settings for handwriting inference.
+
+CPU is a first-class target: the device is picked automatically, intra/inter-op
+thread pools can be sized to the node, convolutions can run in channels-last
+layout and, where the CPU supports it, under bfloat16 autocast. Everything runs
+under torch.inference_mode (torch.no_grad on versions without it).
+"""
+import contextlib
+import os
+from dataclasses import dataclass
+
+import torch
+import torch.nn as nn
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def select_device(requested: str = "auto") -> str:
+    requested = (requested or "auto").lower()
+    if requested == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return requested
+
+
+@dataclass
+class InferenceSettings:
+    device: str = "cpu"
+    threads: int = 0            # intra-op threads; 0 keeps torch's default (one per core)
+    interop_threads: int = 0    # inter-op threads; 0 keeps torch's default
+    channels_last: bool = False
+    bf16: bool = False
+    inpaint_batch: int = 8      # patches per LBAM forward
+
+    @classmethod
+    def from_env(cls, device: str = None) -> "InferenceSettings":
+        device = select_device(device or os.getenv("WPI_DEVICE", "auto"))
+        on_cpu = device == "cpu"
+        return cls(
+            device=device,
+            threads=int(os.getenv("WPI_THREADS", "0")),
+            interop_threads=int(os.getenv("WPI_INTEROP_THREADS", "0")),
+            # channels-last pays off for the oneDNN convolutions on CPU
+            channels_last=_env_bool("WPI_CHANNELS_LAST", "true" if on_cpu else "false"),
+            # bf16 only helps on CPUs with native support (AVX512-BF16 / AMX); opt in
+            bf16=_env_bool("WPI_BF16", "false"),
+            inpaint_batch=int(os.getenv("WPI_INPAINT_BATCH", "8")),
+        )
+
+    def configure_threads(self) -> None:
+        """Process-wide; call once before the first inference."""
+        if self.threads > 0:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:
+                pass  # already fixed once parallel work has started
+
+    @property
+    def autocast_enabled(self) -> bool:
+        if not self.bf16:
+            return False
+        if self.device.startswith("cuda"):
+            # is_bf16_supported() needs torch >= 1.10; older builds run in fp32.
+            return (torch.cuda.is_available() and hasattr(torch.cuda, "is_bf16_supported")
+                    and torch.cuda.is_bf16_supported())
+        return hasattr(torch, "autocast")  # CPU autocast needs torch >= 1.10
+
+    def autocast(self):
+        if not self.autocast_enabled:
+            return contextlib.nullcontext()
+        device_type = "cuda" if self.device.startswith("cuda") else "cpu"
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+
+    def prepare_module(self, module: nn.Module) -> nn.Module:
+        for param in module.parameters():
+            param.requires_grad = False
+        module = module.to(self.device).eval()
+        memory_format = torch.channels_last if self.channels_last else torch.contiguous_format
+        return module.to(memory_format=memory_format)
+
+    def prepare_input(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.to(self.device, non_blocking=True)
+        if self.channels_last and x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x
+
+
+def inference_mode():
+    if hasattr(torch, "inference_mode"):
+        return torch.inference_mode()
+    return torch.no_grad()
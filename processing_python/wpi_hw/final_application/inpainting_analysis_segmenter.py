@@ -4,6 +4,7 @@ from typing import List, Tuple, Iterator, Optional, Union
 
 import torch
 import torch.nn.functional as torch_functional
+from PIL import ImageColor
 from PIL.Image import Image as ImageClass
 from torchvision import transforms
 
@@ -13,6 +14,7 @@ if str(_SGCF) not in sys.path:
     sys.path.insert(0, str(_SGCF))
 
 from synthesis_in_style_lightning.stylegan_code_finder.segmentation.analysis_segmenter import AnalysisSegmenter
+from inference import InferenceSettings, inference_mode
 
 
 class InpaintingAnalysisSegmenter(AnalysisSegmenter):
@@ -20,13 +22,21 @@ class InpaintingAnalysisSegmenter(AnalysisSegmenter):
     def __init__(self, model_checkpoint: str, device: str, class_to_color_map: Union[str, Path],
                  original_config_path: Optional[Path] = None, batch_size: Optional[int] = None,
                  max_image_size: int = None, print_progress: bool = True, patch_overlap: int = 0,
-                 patch_overlap_factor: float = 0.0, show_confidence_in_segmentation: bool = False):
+                 patch_overlap_factor: float = 0.0, show_confidence_in_segmentation: bool = False,
+                 inference_settings: Optional[InferenceSettings] = None):
         super().__init__(model_checkpoint=model_checkpoint, device=device, class_to_color_map=class_to_color_map,
                          original_config_path=original_config_path, batch_size=batch_size,
                          max_image_size=max_image_size, print_progress=print_progress,
                          patch_overlap=patch_overlap, patch_overlap_factor=patch_overlap_factor,
                          show_confidence_in_segmentation=show_confidence_in_segmentation)
         self.patch_size = int(self.config.get("cutting_size", 256))
+        self.inference_settings = inference_settings
+        # Patches whose pixel standard deviation (in [0, 1] units) is below this are
+        # treated as blank (margins, empty paper) and not sent through the network.
+        self.uniform_std_threshold = 0.0
+        self.mask_class_ids = self._mask_class_ids()
+        if inference_settings is not None:
+            self.network = inference_settings.prepare_module(self.network)
 
     def crop_and_batch_patches(self, input_image: ImageClass, normalize: bool = True) -> Iterator[dict]:
         if normalize:
@@ -49,14 +59,53 @@ class InpaintingAnalysisSegmenter(AnalysisSegmenter):
             batch_images = batch_images.to(self.device)
             yield {'images': batch_images, 'bboxes': batch_bboxes}
 
+    def _mask_class_ids(self) -> List[int]:
+        # The colour-image path painted each pixel with its class colour and took a red
+        # channel >= 0.5 as handwriting; these are the classes for which that holds.
+        return [class_id for class_id, color in enumerate(self.class_to_color_map.values())
+                if ImageColor.getrgb(color)[0] >= 128]
+
+    def handwriting_mask(self, predictions: torch.Tensor) -> torch.Tensor:
+        """Binary handwriting mask (N, 1, H, W) from class confidences (N, C, H, W), on their device."""
+        predicted_classes = torch.max(predictions, dim=1, keepdim=True).indices
+        mask = torch.zeros_like(predicted_classes, dtype=torch.bool)
+        for class_id in self.mask_class_ids:
+            mask |= predicted_classes == class_id
+        return mask.float()
+
+    def _predict(self, images: torch.Tensor) -> torch.Tensor:
+        settings = self.inference_settings
+        if settings is None:
+            return self.network.predict(images)
+        # Same as network.predict, but the forward pass runs in the tuned layout/precision
+        # and softmax + postprocessing in float32.
+        with settings.autocast():
+            logits = self.network(settings.prepare_input(images))
+        return self.network.postprocess(torch_functional.softmax(logits.float(), dim=1))
+
+    def informative_patches(self, images: torch.Tensor) -> torch.Tensor:
+        """Boolean (B,) mask of the patches that are not near-uniform."""
+        if self.uniform_std_threshold <= 0:
+            return torch.ones(len(images), dtype=torch.bool, device=images.device)
+        # images are normalised to [-1, 1]; halve the std to compare in [0, 1] units
+        return images.flatten(1).std(dim=1) * 0.5 >= self.uniform_std_threshold
+
     def predict_patches(self, patches: Iterator[dict]) -> [dict]:
         predicted_patches = []
         for batch in self.progress_bar(patches, desc="Predicting patches...", leave=False):
-            batch_interpolated = torch_functional.interpolate(batch['images'],
-                                                              (self.config['image_size'], self.config['image_size']))
-            with torch.no_grad():
-                prediction = self.network.predict(batch_interpolated)
-            prediction = torch_functional.interpolate(prediction, (self.patch_size, self.patch_size))
+            with inference_mode():
+                images = batch['images']
+                keep = self.informative_patches(images)
+                # Blank patches are pure background with full confidence.
+                prediction = images.new_zeros((len(images), self.network.num_classes, self.patch_size,
+                                               self.patch_size))
+                prediction[:, self.network.background_class_id] = 1.0
+                if bool(keep.any()):
+                    batch_interpolated = torch_functional.interpolate(
+                        images[keep], (self.config['image_size'], self.config['image_size']))
+                    predicted = self._predict(batch_interpolated)
+                    prediction[keep] = torch_functional.interpolate(predicted.to(prediction.device),
+                                                                    (self.patch_size, self.patch_size))
             for i, bbox in enumerate(batch['bboxes']):
                 predicted_patches.append({
                     "prediction": prediction[i],
@@ -0,0 +1,132 @@
+"""
+Process-wide handwriting models for the API.
+
+The segmenter (TransUNet checkpoint) and the LBAM inpainting network are loaded
+once, warmed up with one inference, and then shared by every request. A reload
+(e.g. on SIGHUP after new weights were copied in) builds a complete new set next
+to the current one and swaps it in only when it is ready, so requests keep being
+served from the old models meanwhile.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+import torch
+from PIL import Image
+
+from inference import InferenceSettings
+from inpainting_analysis_segmenter import InpaintingAnalysisSegmenter
+from remove_handwriting import (DEFAULT_CONFIG, build_inpainting_model, build_segmenter, load_model_config,
+                                process_image)
+
+
+@dataclass
+class HandwritingModels:
+    segmenter: InpaintingAnalysisSegmenter
+    inpainting_model: object
+    settings: InferenceSettings
+    config: dict
+    loaded_at: float = field(default_factory=time.time)
+    # Models hold no per-request state, but one page at a time keeps device memory bounded.
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def device(self) -> str:
+        return self.settings.device
+
+
+def load_models(config_file: Union[str, Path] = DEFAULT_CONFIG,
+                settings: Optional[InferenceSettings] = None) -> HandwritingModels:
+    settings = settings or InferenceSettings.from_env()
+    model_config = load_model_config(config_file)
+    segmenter = build_segmenter(model_config, device=settings.device, settings=settings)
+    inpainting_model = settings.prepare_module(build_inpainting_model(model_config, device=settings.device))
+    return HandwritingModels(segmenter=segmenter, inpainting_model=inpainting_model, settings=settings,
+                             config=model_config)
+
+
+def warmup(models: HandwritingModels, size: int = 256) -> float:
+    """Runs one noisy page through both networks (allocator, cuDNN autotuning); returns seconds."""
+    start = time.perf_counter()
+    page = Image.effect_noise((size, size), 64).convert("RGB")
+    with models.lock:
+        process_image(page, models.segmenter, False, models.inpainting_model, models.settings)
+    return time.perf_counter() - start
+
+
+class ModelRegistry:
+
+    def __init__(self, config_file: Union[str, Path] = DEFAULT_CONFIG,
+                 settings: Optional[InferenceSettings] = None, warmup_on_load: bool = True):
+        self.config_file = Path(config_file)
+        self.settings = settings or InferenceSettings.from_env()
+        self.settings.configure_threads()
+        self.warmup_on_load = warmup_on_load
+        self._models: Optional[HandwritingModels] = None
+        self._load_lock = threading.Lock()
+        self.state = "empty"  # empty | loading | ready | failed (last load; old models may still serve)
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.reloads = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._models is not None
+
+    def get(self) -> HandwritingModels:
+        models = self._models
+        if models is None:
+            raise RuntimeError(f"Handwriting models are not loaded (state: {self.state})")
+        return models
+
+    def load(self) -> bool:
+        """Builds a fresh set of models and swaps it in. Concurrent calls are coalesced."""
+        if not self._load_lock.acquire(blocking=False):
+            return False
+        try:
+            self.state = "loading"
+            start = time.perf_counter()
+            models = load_models(self.config_file, settings=self.settings)
+            self.load_seconds = time.perf_counter() - start
+            if self.warmup_on_load:
+                self.warmup_seconds = warmup(models)
+            if self._models is not None:
+                self.reloads += 1
+            self._models = models
+            self.state, self.error = "ready", None
+            return True
+        except Exception as e:
+            self.state, self.error = "failed", repr(e)
+            raise
+        finally:
+            self._load_lock.release()
+
+    def load_in_background(self) -> threading.Thread:
+        def _run():
+            try:
+                self.load()
+            except Exception:
+                pass  # recorded in self.state / self.error
+
+        thread = threading.Thread(target=_run, name="wpi-model-load", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> dict:
+        models = self._models
+        return {
+            "ready": models is not None,
+            "state": self.state,
+            "device": self.settings.device,
+            "threads": torch.get_num_threads(),
+            "channels_last": self.settings.channels_last,
+            "bf16": self.settings.autocast_enabled,
+            "loaded_at": models.loaded_at if models is not None else None,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "reloads": self.reloads,
+            "error": self.error,
+        }
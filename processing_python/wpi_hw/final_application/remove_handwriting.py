@@ -1,7 +1,7 @@
 import argparse
-import copy
+import io
 from pathlib import Path
-from typing import Union
+from typing import TYPE_CHECKING, Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
@@ -11,9 +11,18 @@ import yaml
 from PIL import Image
 from tqdm import tqdm
 
+from inference import InferenceSettings, inference_mode
 from inpainting_analysis_segmenter import InpaintingAnalysisSegmenter
 from models.LBAMModel import LBAMModel
 
+if TYPE_CHECKING:  # model_registry imports this module
+    from model_registry import HandwritingModels
+
+APP_DIR = Path(__file__).resolve().parent
+DEFAULT_CONFIG = APP_DIR / 'application_config.yaml'
+DEFAULT_INPAINTING_WEIGHTS = APP_DIR / 'weights' / 'inpainting.pth'
+CLASS_TO_COLOR_MAP = APP_DIR / 'synthesis_in_style_lightning' / 'stylegan_code_finder' / 'handwriting_colors.json'
+
 
 def is_image(file_name: Union[str, Path]) -> bool:
     if not isinstance(file_name, Path):
@@ -21,110 +30,198 @@ def is_image(file_name: Union[str, Path]) -> bool:
     return file_name.suffix.lower() in ['.png', '.jpeg', '.jpg', '.svg']
 
 
-def inpaint_patch(segmentation: Image, ground_truth: torch.Tensor, image_mean: bool, inpainting_model: nn.Module):
-    # A kernel size of 7 is big enough to cover most handwriting.
-    # A padding of 3 makes sure that the image size is not different.
-    max_pooling = nn.MaxPool2d(kernel_size=7, stride=1, padding=3)
-
-    device = ground_truth.device
-
-    # Map the values between 0 and 1 to 0 and 1
-    segmentation_tensor = F.to_tensor(segmentation).to(device)
-    mask = torch.zeros_like(segmentation_tensor[0])
-    mask.masked_fill_(segmentation_tensor[0] >= 0.5, 1.0)
-
-    # repeat the mask, so it covers all three channel of the input image
-    # enlarge the masks so that the whole handwriting is covered
-    mask = 1 - max_pooling(mask.repeat(3, 1, 1))
-    image = ground_truth * mask
-
-    # the LBAM-model needs a mask as a channel of the input image
-    input_image = torch.cat((image, mask[0].unsqueeze(0)), 0)
-
-    # unsqueeze image and mask to simulate a batch of one
-    input_image = input_image.unsqueeze(0)  # (1, 4, H, W)
-    mask = mask.unsqueeze(0)                # (1, 3, H, W)
-
-    # ---- FIX: pad to multiples of 64 so LBAM down/upsampling doesn't break on border tiles ----
-    _, _, h0, w0 = input_image.shape
-    pad_h = (64 - (h0 % 64)) % 64
-    pad_w = (64 - (w0 % 64)) % 64
-    if pad_h != 0 or pad_w != 0:
-        # replicate is safer than reflect for small border patches
-        input_image = NF.pad(input_image, (0, pad_w, 0, pad_h), mode="replicate")
-        mask = NF.pad(mask, (0, pad_w, 0, pad_h), mode="replicate")
-    # -----------------------------------------------------------------------------------------
-
-    if image_mean:
-        # inpaint with image mean (match current patch size, not hardcoded 256x256)
-        m = torch.mean(ground_truth, dim=[1, 2])  # (3,)
-        output = m.unsqueeze(0).unsqueeze(2).unsqueeze(3).repeat(1, 1, input_image.shape[-2], input_image.shape[-1])
-        output = output.to(device)
-    else:
-        # inpaint with the LBAM-model
-        for param in inpainting_model.parameters():
-            param.requires_grad = False
-        inpainting_model.eval()
-        inpainting_model = inpainting_model.to(device)
-        output = inpainting_model(input_image, mask)
-
-    # crop back to original size if padded
-    output = output[:, :, :h0, :w0]
-    mask = mask[:, :, :h0, :w0]
-    input_image = input_image[:, :, :h0, :w0]
-
-    # fill the masked parts of the image with the inpainting model, while the unmasked parts stay the same
-    output = output * (1 - mask) + input_image[:, 0:3, :, :] * mask
-    return output, mask
-
-
-
-def main(args: argparse.Namespace):
-    config_file = Path('application_config.yaml')
-    with config_file.open() as f:
-        model_config = yaml.safe_load(f)
-
+class PatchInpainter:
+    """
+    Inpaints the handwriting of a stack of patches, `batch_size` patches per
+    LBAM forward. Model state, the dilation layer and the padding are set up
+    once per instance, not per patch.
+    """
+
+    def __init__(self, inpainting_model: nn.Module, settings: Optional[InferenceSettings] = None,
+                 image_mean: bool = False, batch_size: Optional[int] = None):
+        self.model = inpainting_model
+        self.settings = settings
+        self.image_mean = image_mean
+        self.batch_size = max(1, int(batch_size or (settings.inpaint_batch if settings is not None else 8)))
+        # A kernel size of 7 is big enough to cover most handwriting.
+        # A padding of 3 makes sure that the image size is not different.
+        self.max_pooling = nn.MaxPool2d(kernel_size=7, stride=1, padding=3)
+        if settings is None and not image_mean:
+            for param in inpainting_model.parameters():
+                param.requires_grad = False
+            inpainting_model.eval()
+
+    def _forward(self, input_image: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        if self.settings is None:
+            return self.model.to(input_image.device)(input_image, mask)
+        # prepared once by settings.prepare_module
+        with self.settings.autocast():
+            output = self.model(self.settings.prepare_input(input_image), self.settings.prepare_input(mask))
+        return output.float().contiguous()
+
+    def __call__(self, ground_truth: torch.Tensor, handwriting: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        ground_truth: (N, 3, H, W) original patches in [0, 1]; handwriting: (N, 1, H, W) binary mask.
+        Returns the inpainted patches and the keep-mask (0 where handwriting was removed), both (N, 3, H, W).
+        Patches without handwriting are returned as they are, without a forward pass.
+        """
+        handwriting = handwriting.to(ground_truth.device)
+        # enlarge the masks so that the whole handwriting is covered, then
+        # repeat them, so they cover all three channels of the input image
+        mask = (1 - self.max_pooling(handwriting)).expand(-1, 3, -1, -1)
+
+        output = ground_truth.clone()
+        todo = handwriting.flatten(1).amax(dim=1).nonzero().squeeze(1)
+        if len(todo) > 0:
+            output[todo] = self._inpaint(ground_truth[todo], mask[todo])
+        return output, mask
+
+    def _inpaint(self, ground_truth: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        image = ground_truth * mask
+
+        if self.image_mean:
+            # inpaint with the mean of each patch
+            output = ground_truth.mean(dim=[2, 3], keepdim=True).expand_as(ground_truth)
+        else:
+            # the LBAM-model needs a mask as a channel of the input image
+            input_image = torch.cat((image, mask[:, 0:1]), 1)  # (N, 4, H, W)
+            model_mask = mask
+
+            # pad to multiples of 64 so LBAM down/upsampling doesn't break on border tiles (once for the stack)
+            h0, w0 = input_image.shape[-2:]
+            pad_h = (64 - (h0 % 64)) % 64
+            pad_w = (64 - (w0 % 64)) % 64
+            if pad_h != 0 or pad_w != 0:
+                # replicate is safer than reflect for small border patches
+                input_image = NF.pad(input_image, (0, pad_w, 0, pad_h), mode="replicate")
+                model_mask = NF.pad(model_mask, (0, pad_w, 0, pad_h), mode="replicate")
+
+            output = torch.cat([
+                self._forward(input_image[i:i + self.batch_size], model_mask[i:i + self.batch_size])
+                for i in range(0, len(input_image), self.batch_size)
+            ])
+            # crop back to original size if padded
+            output = output[:, :, :h0, :w0]
+
+        # fill the masked parts of the image with the inpainting model, while the unmasked parts stay the same
+        return output * (1 - mask) + image * mask
+
+
+def _resolve(path: Union[str, Path]) -> Path:
+    # Paths in application_config.yaml are relative to this directory, not the working directory.
+    path = Path(path)
+    return path if path.is_absolute() else APP_DIR / path
+
+
+def load_model_config(config_file: Union[str, Path] = DEFAULT_CONFIG) -> dict:
+    with Path(config_file).open() as f:
+        return yaml.safe_load(f)
+
+
+def build_segmenter(model_config: dict, device: str,
+                    settings: Optional[InferenceSettings] = None) -> InpaintingAnalysisSegmenter:
     hyperparam_config = {'patch_overlap': model_config['patch_overlap'],
                          'min_confidence': model_config['min_confidence'],
                          'min_contour_area': model_config['min_contour_area']}
 
     segmenter = InpaintingAnalysisSegmenter(
-        model_config["checkpoint"],
-        device="cuda",
-        class_to_color_map=Path(
-            '/workspace/final_application/synthesis_in_style_lightning/stylegan_code_finder/handwriting_colors.json'),
-        original_config_path=Path(model_config["config_path"]),
+        str(_resolve(model_config["checkpoint"])),
+        device=device,
+        class_to_color_map=CLASS_TO_COLOR_MAP,
+        original_config_path=_resolve(model_config["config_path"]),
         max_image_size=int(model_config.get("max_image_size", 0)),
         print_progress=False,
-        show_confidence_in_segmentation=False
+        show_confidence_in_segmentation=False,
+        inference_settings=settings,
     )
+    segmenter.set_hyperparams(hyperparam_config)
+    segmenter.uniform_std_threshold = float(model_config.get("uniform_patch_std", 0.0))
+    return segmenter
+
+
+def build_inpainting_model(model_config: dict, device: str = "cpu") -> nn.Module:
     net_g = LBAMModel(4, 3)
-    net_g.load_state_dict(torch.load('weights/inpainting.pth'))
+    weights = _resolve(model_config.get("inpainting_weights", DEFAULT_INPAINTING_WEIGHTS))
+    net_g.load_state_dict(torch.load(str(weights), map_location=device))
+    return net_g
+
+
+def process_image(original_image: Image.Image, segmenter: InpaintingAnalysisSegmenter, image_mean: bool,
+                  inpainting_model: nn.Module,
+                  settings: Optional[InferenceSettings] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Segments and inpaints one page; returns the assembled image and mask tensors (C, H, W)."""
+    with inference_mode():
+        return _process_image(original_image, segmenter, image_mean, inpainting_model, settings)
+
+
+def _process_image(original_image: Image.Image, segmenter: InpaintingAnalysisSegmenter, image_mean: bool,
+                   inpainting_model: nn.Module,
+                   settings: Optional[InferenceSettings]) -> Tuple[torch.Tensor, torch.Tensor]:
+    image = original_image.convert("L")
+    predicted_patches = segmenter.segment_image(image)
+    if not predicted_patches:
+        raise ValueError("The image has no pixels to process.")
+
+    # every patch of the page is stacked and inpainted in batches
+    ground_truth = torch.cat([batch['images'] for batch in segmenter.crop_and_batch_patches(original_image, False)])
+    # class confidences -> binary mask, batched and on the model's device (dilated by the inpainter)
+    handwriting = segmenter.handwriting_mask(torch.stack([patch['prediction'] for patch in predicted_patches]))
+    inpainter = PatchInpainter(inpainting_model, settings, image_mean=image_mean)
+    inpainted, masks = inpainter(ground_truth, handwriting)
+
+    bboxes = [patch['bbox'] for patch in predicted_patches]
+    inpainted_patches = [{'prediction': patch, 'bbox': bbox} for patch, bbox in zip(inpainted, bboxes)]
+    mask_patches = [{'prediction': mask, 'bbox': bbox} for mask, bbox in zip(masks, bboxes)]
+    assembled_image = segmenter.assemble_predictions(inpainted_patches, image.size)
+    assembled_mask = segmenter.assemble_predictions(mask_patches, image.size)
+    return assembled_image, assembled_mask
+
+
+def open_image(image: Union[bytes, Image.Image]) -> Image.Image:
+    """Decodes encoded image bytes (PNG, JPEG, ...) or takes a PIL image; returns it as RGB."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+        image.load()
+    if image.mode != "RGB":
+        # LBAM inpaints three channels; grey, palette and RGBA inputs are converted once here.
+        image = image.convert("RGB")
+    return image
+
+
+def remove_handwriting_from_image(image: Union[bytes, Image.Image], segmenter: InpaintingAnalysisSegmenter,
+                                  inpainting_model: nn.Module, image_mean: bool = False,
+                                  settings: Optional[InferenceSettings] = None) -> Tuple[Image.Image, Image.Image]:
+    """
+    In-memory pipeline: image bytes or a PIL image in, (cleaned page, handwriting mask) out.
+    Nothing is written to disk.
+    """
+    page = open_image(image)
+    assembled_image, assembled_mask = process_image(page, segmenter, image_mean, inpainting_model, settings)
+    return F.to_pil_image(assembled_image.cpu()), F.to_pil_image(assembled_mask.cpu())
+
+
+def main(args: argparse.Namespace, models: Optional["HandwritingModels"] = None):
+    """
+    Directory-based CLI entry point. `models` (see model_registry) lets a long-running
+    process reuse already loaded networks instead of loading them per call.
+    """
+    if models is None:
+        settings = InferenceSettings.from_env(device=args.device)
+        settings.configure_threads()
+        model_config = load_model_config()
+        segmenter = build_segmenter(model_config, device=settings.device, settings=settings)
+        net_g = settings.prepare_module(build_inpainting_model(model_config, device=settings.device))
+    else:
+        segmenter, net_g, settings = models.segmenter, models.inpainting_model, models.settings
 
     image_paths = [f for f in args.input_dir.rglob("*") if is_image(f)]
     assert len(image_paths) > 0, "There are no images in the given directory."
-    segmenter.set_hyperparams(hyperparam_config)
 
     for i, image_path in enumerate(tqdm(image_paths, desc="Segmenting and inpainting images...", leave=False)):
-        original_image = Image.open(image_path)
-        image = original_image.convert("L")
-        predicted_patches = segmenter.segment_image(image)
-        mask_patches = copy.deepcopy(predicted_patches)
-        original_batches = segmenter.crop_and_batch_patches(original_image, False)
-        original_patches = []
-        for original_batch in original_batches:
-            for original_patch in original_batch['images']:
-                original_patches.append(original_patch)
-        for patch_counter, (patch, original_patch) in enumerate(zip(predicted_patches, original_patches)):
-            color_prediction = segmenter.prediction_to_color_image(patch['prediction'])
-            patch['ground_truth'] = original_patch
-            inpainted_image, mask = inpaint_patch(color_prediction, patch['ground_truth'], args.image_mean_method, net_g)
-            mask_patches[patch_counter]['prediction'] = mask
-            predicted_patches[patch_counter]['prediction'] = inpainted_image
-        assembled_image = segmenter.assemble_predictions(predicted_patches, image.size)
-        assembled_mask = segmenter.assemble_predictions(mask_patches, image.size)
-        F.to_pil_image(assembled_image).save(args.output_dir/image_path.name)
-        F.to_pil_image(assembled_mask).save(args.output_dir/f'{image_path.name}_mask.jpg')
+        clean_image, mask_image = remove_handwriting_from_image(Image.open(image_path), segmenter, net_g,
+                                                                args.image_mean_method, settings)
+        clean_image.save(args.output_dir/image_path.name)
+        mask_image.save(args.output_dir/f'{image_path.name}_mask.jpg')
 
 
 if __name__ == '__main__':
@@ -134,5 +231,6 @@ if __name__ == '__main__':
     parser.add_argument('--output-dir', type=Path, help='the directory of the images without handwriting')
     parser.add_argument('--image-mean-method', type=bool, default=False,
                         help='If the image mean method should be used instead of LBAM')
+    parser.add_argument('--device', default='auto', help='cuda, cpu or auto (cuda when available)')
     args = parser.parse_args()
     main(args=args)
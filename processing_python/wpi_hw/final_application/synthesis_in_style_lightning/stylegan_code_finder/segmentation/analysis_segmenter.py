@@ -82,7 +82,10 @@ class AnalysisSegmenter:
             if candidate.is_file():
                 self.config["class_to_color_map"] = str(candidate)
 
-        lightning_model = get_segmenter_class(self.config).load_from_checkpoint(self.config['fine_tune'], configs=self.config)
+        # map_location: checkpoints saved on GPU must also load on CPU-only nodes
+        lightning_model = get_segmenter_class(self.config).load_from_checkpoint(self.config['fine_tune'],
+                                                                                map_location=self.device,
+                                                                                configs=self.config)
         segmentation_network = lightning_model.segmentation_network.to(self.device)
         return segmentation_network
 